@@ -5,9 +5,15 @@ from dotenv import load_dotenv
 from langchain_openai import OpenAIEmbeddings
 from langchain_core.vectorstores import InMemoryVectorStore
 
-# Load environment variables
+# Load environment variables before the local modules below read their
+# settings from them.
 load_dotenv()
 
+from hashing_embeddings import HashingEmbeddings
+from query_memo import QueryEmbeddingMemo
+from search_engine import VectorSearchEngine
+
+
 def cosine_similarity(vector_a, vector_b):
     """
     Calculate cosine similarity between two vectors
@@ -26,12 +32,96 @@ def cosine_similarity(vector_a, vector_b):
     return dot_product / (norm_a * norm_b)
 
 
-def search_sentences(vector_store, query: str, k: int = 3):
+def build_search_engine(vector_store) -> VectorSearchEngine:
+    """
+    Copy every vector already held by an `InMemoryVectorStore` into a
+    `VectorSearchEngine`, keyed by the store's document ids. No embedding
+    calls are made; the store already has the vectors.
+    """
+    engine = VectorSearchEngine()
+    entries = list(vector_store.store.values())
+    if entries:
+        engine.add([e["id"] for e in entries], [e["vector"] for e in entries])
+    return engine
+
+
+def embeds_queries_like_documents(embeddings) -> bool:
+    """
+    True when `embeddings` gives a text the same vector whether it is
+    embedded as a query or as a document. `HashingEmbeddings` hashes both
+    the same way and the text-embedding-3 models have no query/document
+    mode; asymmetric models (e.g. E5 or BGE with an instruction prefix)
+    would make a stored sentence's vector the wrong query vector.
+    """
+    if isinstance(embeddings, HashingEmbeddings):
+        return True
+    return isinstance(embeddings, OpenAIEmbeddings) and (
+        embeddings.model.startswith("text-embedding-3")
+    )
+
+
+def stored_text_ids(vector_store) -> dict:
+    """
+    Map each stored sentence to its document id, so a query that is exactly
+    a stored sentence reuses the vector the store already holds. Empty when
+    the store's embeddings are not symmetric (`embeds_queries_like_documents`).
+    Rebuild it after adding sentences.
+    """
+    if not embeds_queries_like_documents(vector_store.embeddings):
+        return {}
+    return {
+        entry["text"]: doc_id for doc_id, entry in vector_store.store.items()
+    }
+
+
+def embed_search_query(
+    vector_store,
+    query: str,
+    memo: QueryEmbeddingMemo = None,
+    text_ids: dict = None,
+) -> list:
+    """
+    Embed `query`, skipping the embedding call when the vector is already
+    known: a stored sentence's vector via `text_ids` (see
+    `stored_text_ids`), or an earlier query's vector from `memo`.
+    """
+    doc_id = text_ids.get(query) if text_ids else None
+    if doc_id is not None:
+        return vector_store.store[doc_id]["vector"]
+    vector = memo.get(query) if memo is not None else None
+    if vector is None:
+        vector = vector_store.embeddings.embed_query(query)
+        if memo is not None:
+            memo.put(query, vector)
+    return vector
+
+
+def search_sentences(
+    vector_store,
+    query: str,
+    k: int = 3,
+    engine: VectorSearchEngine = None,
+    memo: QueryEmbeddingMemo = None,
+    text_ids: dict = None,
+):
     """
     Search the `vector_store` for `query` and return top `k` results with scores.
     Prints ranked results with score (4 decimal places) and the sentence text.
+
+    When an `engine` built by `build_search_engine` is given, the query is
+    embedded once and scored against every stored vector with a single
+    NumPy matmul instead of going through the store's search. A `memo` and
+    `text_ids` skip the embedding call for repeated queries and stored
+    sentences (see `embed_search_query`).
     """
-    results = vector_store.similarity_search_with_score(query, k=k)
+    if engine is not None:
+        query_vector = embed_search_query(vector_store, query, memo, text_ids)
+        results = [
+            (vector_store.store[doc_id]["text"], score)
+            for doc_id, score in engine.search(query_vector, k)
+        ]
+    else:
+        results = vector_store.similarity_search_with_score(query, k=k)
     top_k = results[:k]
     output = []
     for rank, item in enumerate(top_k, start=1):
@@ -53,27 +143,49 @@ def search_sentences(vector_store, query: str, k: int = 3):
 
     return output
 
+# Embedding backend: "openai" (text-embedding-3-small via GitHub Models,
+# needs GITHUB_TOKEN) or "local" (`HashingEmbeddings`, no network).
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+
+
+def create_embeddings(backend: str = EMBEDDING_BACKEND):
+    """Build the embeddings for `backend` ("openai" or "local")."""
+    if backend == "local":
+        return HashingEmbeddings()
+    if backend != "openai":
+        raise ValueError(
+            f"Unknown EMBEDDING_BACKEND '{backend}' "
+            "(expected 'openai' or 'local')."
+        )
+    return OpenAIEmbeddings(
+        model="text-embedding-3-small",
+        base_url="https://models.inference.ai.azure.com",
+        api_key=os.getenv("GITHUB_TOKEN"),
+        check_embedding_ctx_length=False,
+    )
+
+
 def main():
     print("🤖 Python LangChain Agent Starting...\n")
 
-    # Check for GitHub token
-    if not os.getenv("GITHUB_TOKEN"):
+    # Check for GitHub token (not needed with EMBEDDING_BACKEND=local)
+    if EMBEDDING_BACKEND != "local" and not os.getenv("GITHUB_TOKEN"):
         print("❌ Error: GITHUB_TOKEN not found in environment variables.")
         print("Please create a .env file with your GitHub token:")
         print("GITHUB_TOKEN=your-github-token-here")
         print("\nGet your token from: https://github.com/settings/tokens")
         print("Or use GitHub Models: https://github.com/marketplace/models")
+        print("(Or set EMBEDDING_BACKEND=local to embed without the API.)")
         return
-    
-    # Create OpenAIEmbeddings instance for GitHub Models API
-    embeddings = OpenAIEmbeddings(
-        model="text-embedding-3-small",
-        base_url="https://models.inference.ai.azure.com",
-        api_key=os.getenv("GITHUB_TOKEN"),
-        check_embedding_ctx_length=False,
-    )
 
-    print("✅ OpenAIEmbeddings instance created (GitHub Models API).")
+    embeddings = create_embeddings(EMBEDDING_BACKEND)
+    if EMBEDDING_BACKEND == "local":
+        print(
+            f"✅ Local hashing embeddings created (dim {embeddings.size}); "
+            "no embedding API calls."
+        )
+    else:
+        print("✅ OpenAIEmbeddings instance created (GitHub Models API).")
     # Create an in-memory vector store using the embeddings instance
     vector_store = InMemoryVectorStore(embeddings)
     print("=== Embedding Inspector Lab ===")
@@ -109,11 +221,16 @@ def main():
             "index": idx,
         })
 
-    vector_store.add_texts(test_sentences, metadatas=metadatas)
+    sentence_ids = vector_store.add_texts(test_sentences, metadatas=metadatas)
     print(f"✅ Stored {len(test_sentences)} sentences in the vector store.")
     for idx, s in enumerate(test_sentences, start=1):
         print(f"Stored Sentence {idx}: {s}")
 
+    # Build the NumPy search engine from the vectors the store already holds
+    engine = build_search_engine(vector_store)
+    memo = QueryEmbeddingMemo()
+    text_ids = stored_text_ids(vector_store)
+
     # Interactive semantic search loop
     print("=== Semantic Search ===")
     while True:
@@ -124,16 +241,18 @@ def main():
             continue
 
         # Perform search and display results
-        search_sentences(vector_store, query)
+        search_sentences(
+            vector_store, query, engine=engine, memo=memo, text_ids=text_ids
+        )
         print()
 
-    # Generate embeddings for each test sentence (for similarity checks)
-    embedding_vectors = []
-    for idx, sentence in enumerate(test_sentences, start=1):
-        vec = embeddings.embed_query(sentence)
-        embedding_vectors.append(vec)
+    # Reuse the embeddings `add_texts` already computed for each test
+    # sentence (for similarity checks) instead of embedding them again
+    embedding_vectors = [
+        vector_store.store[doc_id]["vector"] for doc_id in sentence_ids
+    ]
 
-    print("✅ Generated embeddings for all sentences.")
+    print("✅ Collected embeddings for all sentences.")
 
     # Compute and display cosine similarities between sentence pairs
     comparisons = [
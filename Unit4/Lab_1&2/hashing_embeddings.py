@@ -0,0 +1,107 @@
+"""
+Offline feature-hashing embeddings (no API key, no network).
+
+This file is kept identical in Unit4/Lab_1&2 and Unit4/Lab_3&4 so that
+each lab runs on its own; change both copies together.
+"""
+import os
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+LOCAL_EMBEDDING_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", "512"))
+LOCAL_EMBEDDING_NGRAM = int(os.getenv("LOCAL_EMBEDDING_NGRAM", "4"))
+
+# Byte translation for `HashingEmbeddings`: ASCII letters and digits are
+# kept, every other ASCII byte becomes a space. Non-ASCII (UTF-8) bytes pass
+# through, so accented words still hash as words.
+_HASHING_FOLD = bytes(
+    b if chr(b).isalnum() or b >= 128 else 32 for b in range(256)
+)
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic, offline embedding model: signed feature hashing of
+    character n-grams ("hashing trick").
+
+    Each text is lower-cased, punctuation folds to spaces, and every
+    `ngram`-byte window (word boundaries included) is hashed to one of
+    `size` buckets with a +1/-1 sign; rows are L2-normalized. Texts that
+    share words and word pieces get similar vectors, so retrieval behaves
+    sensibly without an API key. A whole batch is hashed and accumulated
+    with a few NumPy passes over the concatenated bytes, with no
+    per-word Python loop, so ingest runs at tens of thousands of chunks
+    per second.
+    """
+
+    def __init__(
+        self,
+        size: int = LOCAL_EMBEDDING_DIM,
+        ngram: int = LOCAL_EMBEDDING_NGRAM,
+    ):
+        self.size = size
+        self.ngram = ngram
+
+    @property
+    def model_name(self) -> str:
+        return f"local-hashing-{self.ngram}gram-{self.size}"
+
+    def _normalized_bytes(self, text: str) -> bytes:
+        words = (
+            text.lower()
+            .encode("utf-8", "ignore")
+            .translate(_HASHING_FOLD)
+            .split()
+        )
+        return b" " + b" ".join(words) + b" "
+
+    def embed_matrix(self, texts: list) -> np.ndarray:
+        """Embed `texts` into a (len(texts), size) float32 matrix."""
+        n = self.ngram
+        out = np.zeros((len(texts), self.size), dtype=np.float32)
+        if not texts:
+            return out
+        # Documents are joined by NUL bytes; windows containing one span
+        # two documents and are dropped.
+        data = np.frombuffer(
+            b"\0".join(self._normalized_bytes(t) for t in texts),
+            dtype=np.uint8,
+        )
+        if len(data) < n:
+            return out
+        starts = len(data) - n + 1
+        # FNV-1a over each window, then the murmur3 finalizer so that
+        # neighbouring windows land in unrelated buckets. uint32 arithmetic
+        # wraps, which is exactly what both hashes want.
+        h = np.full(starts, 2166136261, dtype=np.uint32)
+        for i in range(n):
+            h ^= data[i:i + starts]
+            h *= np.uint32(16777619)
+        h ^= h >> 16
+        h *= np.uint32(0x85EBCA6B)
+        h ^= h >> 13
+        h *= np.uint32(0xC2B2AE35)
+        h ^= h >> 16
+
+        separators = np.concatenate(
+            ([0], np.cumsum(data == 0, dtype=np.int32))
+        )
+        valid = separators[n:n + starts] == separators[:starts]
+        doc = separators[:starts][valid].astype(np.int64)
+        h = h[valid]
+        sign = np.where(h >> 31, 1.0, -1.0)
+        out += np.bincount(
+            doc * self.size + h % self.size,
+            weights=sign,
+            minlength=len(texts) * self.size,
+        ).reshape(len(texts), self.size)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+    def embed_documents(self, texts: list) -> list:
+        return self.embed_matrix(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_matrix([text])[0].tolist()
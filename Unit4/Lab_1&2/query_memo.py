@@ -0,0 +1,53 @@
+"""
+LRU memo of query embeddings.
+
+This file is kept identical in Unit4/Lab_1&2 and Unit4/Lab_3&4 so that
+each lab runs on its own; change both copies together.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+# Distinct query strings whose embeddings each memo keeps in memory.
+QUERY_EMBEDDING_MEMO_SIZE = int(
+    os.getenv("QUERY_EMBEDDING_MEMO_SIZE", "1024")
+)
+
+
+class QueryEmbeddingMemo:
+    """Small in-process LRU of query text -> embedding, with hit counters."""
+
+    def __init__(self, max_entries: int = QUERY_EMBEDDING_MEMO_SIZE):
+        self.max_entries = max_entries
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str):
+        with self._lock:
+            vector = self._vectors.get(text)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._vectors.move_to_end(text)
+            self.hits += 1
+            return vector
+
+    def put(self, text: str, vector):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._vectors[text] = vector
+            self._vectors.move_to_end(text)
+            while len(self._vectors) > self.max_entries:
+                self._vectors.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._vectors),
+        }
@@ -0,0 +1,124 @@
+import pytest
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import InMemoryVectorStore
+from langchain_openai import OpenAIEmbeddings
+
+from app import (
+    QueryEmbeddingMemo,
+    build_search_engine,
+    cosine_similarity,
+    embeds_queries_like_documents,
+    search_sentences,
+    stored_text_ids,
+)
+from hashing_embeddings import HashingEmbeddings
+
+SENTENCES = [
+    "The cat sat on the mat.",
+    "Dogs love to play fetch in the park.",
+    "The stock market closed higher today.",
+    "A kitten napped on the rug.",
+]
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    """HashingEmbeddings that counts `embed_query` calls."""
+
+    def __init__(self):
+        super().__init__(64)
+        self.queries = 0
+
+    def embed_query(self, text):
+        self.queries += 1
+        return super().embed_query(text)
+
+
+@pytest.fixture
+def store():
+    store = InMemoryVectorStore(CountingEmbeddings())
+    store.add_texts(SENTENCES)
+    return store
+
+
+def test_engine_search_matches_the_store(store, capsys):
+    engine = build_search_engine(store)
+    assert len(engine) == len(SENTENCES)
+    query = "Where did the cat sit?"
+    fast = search_sentences(store, query, k=3, engine=engine)
+    plain = search_sentences(store, query, k=3)
+    assert [t for t, _ in fast] == [t for t, _ in plain]
+    assert [s for _, s in fast] == pytest.approx(
+        [s for _, s in plain], abs=1e-6
+    )
+    assert capsys.readouterr().out.startswith("Rank 1: Score ")
+
+
+def test_empty_store_builds_an_empty_engine():
+    store = InMemoryVectorStore(HashingEmbeddings(64))
+    assert len(build_search_engine(store)) == 0
+
+
+def test_memo_and_stored_texts_skip_embedding_calls(store):
+    engine = build_search_engine(store)
+    memo = QueryEmbeddingMemo()
+    text_ids = stored_text_ids(store)
+    assert set(text_ids) == set(SENTENCES)
+
+    embeddings = store.embeddings
+    search_sentences(
+        store, SENTENCES[0], engine=engine, memo=memo, text_ids=text_ids
+    )
+    assert embeddings.queries == 0
+    for _ in range(3):
+        results = search_sentences(
+            store, "a sleepy cat", engine=engine, memo=memo, text_ids=text_ids
+        )
+    assert embeddings.queries == 1
+    assert memo.stats()["hits"] == 2 and memo.stats()["misses"] == 1
+    assert results[0][0] in SENTENCES
+
+
+def test_memo_evicts_least_recently_used():
+    memo = QueryEmbeddingMemo(max_entries=2)
+    memo.put("a", [1.0])
+    memo.put("b", [2.0])
+    assert memo.get("a") == [1.0]
+    memo.put("c", [3.0])
+    assert memo.get("b") is None and memo.get("a") == [1.0]
+    assert memo.stats()["entries"] == 2
+    disabled = QueryEmbeddingMemo(max_entries=0)
+    disabled.put("a", [1.0])
+    assert disabled.get("a") is None
+
+
+def test_only_symmetric_embeddings_reuse_stored_vectors():
+    assert embeds_queries_like_documents(HashingEmbeddings())
+    assert embeds_queries_like_documents(
+        OpenAIEmbeddings(model="text-embedding-3-small", api_key="test")
+    )
+    assert not embeds_queries_like_documents(
+        OpenAIEmbeddings(model="text-embedding-ada-002", api_key="test")
+    )
+
+    class PrefixedEmbeddings(Embeddings):
+        """Embeds queries with an instruction prefix, like E5 or BGE."""
+
+        hashing = HashingEmbeddings(64)
+
+        def embed_documents(self, texts):
+            return self.hashing.embed_documents(texts)
+
+        def embed_query(self, text):
+            return self.hashing.embed_query("query: " + text)
+
+    store = InMemoryVectorStore(PrefixedEmbeddings())
+    store.add_texts(SENTENCES)
+    assert stored_text_ids(store) == {}
+
+
+def test_cosine_similarity():
+    assert cosine_similarity([1, 0], [1, 0]) == pytest.approx(1.0)
+    assert cosine_similarity([1, 0], [0, 2]) == pytest.approx(0.0)
+    assert cosine_similarity([0, 0], [1, 1]) == 0.0
+    with pytest.raises(ValueError):
+        cosine_similarity([1], [1, 2])
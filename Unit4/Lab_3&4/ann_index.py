@@ -0,0 +1,478 @@
+"""
+Approximate nearest-neighbour indexes for `VectorSearchEngine`.
+
+Every index exposes `trained`, `rebuild(matrix, removed)`,
+`add(matrix, start, removed)`, `remove(rows)` and `candidates(query, k)`;
+the engine rescores the candidates exactly. Removed rows keep their row
+numbers (the engine tombstones them) and must never come back as
+candidates, including after an `add` that re-fits the index: `removed`
+is the engine's current set of dead rows.
+"""
+import math
+import os
+
+import numpy as np
+
+from search_engine import VectorSearchEngine
+
+
+# Which index sits behind the vector store: "exact" (brute-force matmul),
+# "ivf" (approximate, for large corpora), "int8" (quantized first pass,
+# for memory) or "pca"/"truncate" (two-stage: coarse pass on COARSE_DIM
+# dimensions, then full-dimension rescoring of COARSE_SHORTLIST rows).
+# IVF_NPROBE trades recall for speed; QUANTIZED_RERANK is how many int8
+# candidates get rescored at full precision.
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "exact")
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+QUANTIZED_RERANK = int(os.getenv("QUANTIZED_RERANK", "100"))
+COARSE_DIM = int(os.getenv("COARSE_DIM", "256"))
+COARSE_SHORTLIST = int(os.getenv("COARSE_SHORTLIST", "500"))
+
+
+def _best_rows(scores: np.ndarray, count: int, removed: np.ndarray):
+    """Row numbers of the `count` best `scores`, skipping `removed` rows."""
+    if len(removed):
+        scores[removed] = -np.inf
+    live = len(scores) - len(removed)
+    if count >= live:
+        return np.setdiff1d(
+            np.arange(len(scores)), removed, assume_unique=True
+        )
+    return np.argpartition(-scores, count - 1)[:count]
+
+
+class IVFIndex:
+    """
+    Inverted-file (IVF) approximate nearest-neighbour index.
+
+    The corpus is clustered with spherical k-means into `nlist` cells; each
+    cell keeps the row numbers of its members. A query is compared with the
+    centroids first and only the rows in the `nprobe` closest cells are
+    scored exactly, so search touches roughly nprobe/nlist of the corpus.
+    Raise `nprobe` for recall, lower it for latency.
+
+    The index is built incrementally: new rows are assigned to their nearest
+    centroid as they arrive. Nothing is trained until `min_train_size` rows
+    exist (brute force is cheap below that), and the centroids are re-fitted
+    whenever the corpus has grown by `retrain_growth` since the last fit so
+    cell quality keeps up with the data.
+    """
+
+    def __init__(
+        self,
+        nlist: int = None,
+        nprobe: int = IVF_NPROBE,
+        min_train_size: int = 2048,
+        retrain_growth: float = 2.0,
+        iterations: int = 10,
+        seed: int = 0,
+    ):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.retrain_growth = retrain_growth
+        self.iterations = iterations
+        self.seed = seed
+        self.reset()
+
+    def reset(self):
+        self.centroids = None
+        self.lists = []
+        # Cell of every assigned row, by row number.
+        self._cell_of = []
+        self._list_arrays = None
+        self.trained_at = 0
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def _kmeans(
+        self, data: np.ndarray, nlist: int, live: np.ndarray
+    ) -> np.ndarray:
+        """Spherical k-means on the `live` rows of `data` (unit vectors);
+        returns unit-length centroids."""
+        rng = np.random.default_rng(self.seed)
+        # Fitting on a sample is plenty for centroids and keeps training
+        # time flat as the corpus grows.
+        sample_size = min(len(live), nlist * 64)
+        sample = np.asarray(
+            data[np.sort(rng.choice(live, sample_size, replace=False))]
+        )
+        centroids = sample[
+            rng.choice(len(sample), nlist, replace=False)
+        ].copy()
+        for _ in range(self.iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            # Re-seed empty cells with random points so none go to waste.
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = VectorSearchEngine.normalize(sums)
+        return centroids
+
+    def _assign(self, rows: np.ndarray, offset: int, dead: np.ndarray = None):
+        assign = np.argmax(rows @ self.centroids.T, axis=1)
+        if dead is not None:
+            # A removed row keeps its row number but joins no cell.
+            assign[dead] = -1
+        assign = assign.tolist()
+        for i, cell in enumerate(assign):
+            if cell >= 0:
+                self.lists[cell].append(offset + i)
+        self._cell_of.extend(assign)
+        self._list_arrays = None
+
+    def rebuild(self, matrix: np.ndarray, removed: np.ndarray = None):
+        """Re-fit centroids on the rows of `matrix` not in `removed` (or
+        drop them if there are too few)."""
+        self.reset()
+        n = len(matrix)
+        dead = np.zeros(n, dtype=bool)
+        if removed is not None:
+            dead[removed] = True
+        live = np.flatnonzero(~dead)
+        if len(live) < self.min_train_size:
+            return
+        nlist = self.nlist or max(1, int(math.sqrt(len(live))))
+        self.centroids = self._kmeans(matrix, min(nlist, len(live)), live)
+        self.lists = [[] for _ in range(len(self.centroids))]
+        # Assign in blocks to keep the temporary score matrix small.
+        for start in range(0, n, 65536):
+            self._assign(
+                np.asarray(matrix[start:start + 65536]),
+                start,
+                dead[start:start + 65536],
+            )
+        self.trained_at = n
+
+    def add(
+        self, matrix: np.ndarray, start: int, removed: np.ndarray = None
+    ):
+        """Index rows `start:` of `matrix`, which were just appended."""
+        n = len(matrix)
+        if not self.trained or n >= self.trained_at * self.retrain_growth:
+            if n >= self.min_train_size:
+                self.rebuild(matrix, removed)
+            return
+        self._assign(np.asarray(matrix[start:]), start)
+
+    def remove(self, rows: np.ndarray):
+        """Take `rows` out of their cells."""
+        if not self.trained:
+            return
+        by_cell = {}
+        for row in rows.tolist():
+            if self._cell_of[row] < 0:
+                continue
+            by_cell.setdefault(self._cell_of[row], set()).add(row)
+        for cell, drop in by_cell.items():
+            self.lists[cell] = [r for r in self.lists[cell] if r not in drop]
+            if self._list_arrays is not None:
+                self._list_arrays[cell] = np.asarray(
+                    self.lists[cell], dtype=np.int64
+                )
+
+    def candidates(self, query: np.ndarray, k: int = None) -> np.ndarray:
+        """Return the row numbers in the `nprobe` cells closest to `query`."""
+        if self._list_arrays is None:
+            self._list_arrays = [
+                np.asarray(cell, dtype=np.int64) for cell in self.lists
+            ]
+        nprobe = min(self.nprobe, len(self.centroids))
+        cells = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self._list_arrays[c] for c in cells])
+
+
+class Int8Index:
+    """
+    Scalar-quantized copy of the matrix: one int8 code per dimension.
+
+    Each dimension gets a symmetric scale (its largest |value| / 127), so a
+    1536-dim embedding costs 1536 bytes instead of 6144 as float32. A query
+    is scored against the codes (with the scales folded into the query, so
+    only the stored side is approximated) and the best `rerank` rows go
+    back to the engine, which rescores them against the full-precision
+    matrix. Keep that matrix on disk (`MmapVectorStore` maps a loaded
+    snapshot and spills added rows to a file) and only the codes plus the
+    rerank rows ever need to be in RAM.
+
+    Codes are appended as rows arrive; the scales are re-fitted whenever
+    the corpus has grown by `retrain_growth`, since rows larger than the
+    fitted scale get clipped.
+    """
+
+    def __init__(
+        self,
+        rerank: int = QUANTIZED_RERANK,
+        retrain_growth: float = 2.0,
+        block_rows: int = 65536,
+        score_block_rows: int = 256,
+    ):
+        self.rerank = rerank
+        self.retrain_growth = retrain_growth
+        self.block_rows = block_rows
+        self.score_block_rows = score_block_rows
+        self.reset()
+
+    def reset(self):
+        self.scale = None
+        self._codes = None
+        self.size = 0
+        self.trained_at = 0
+        self.removed = np.zeros(0, dtype=np.int64)
+
+    @property
+    def trained(self) -> bool:
+        return self.scale is not None
+
+    @property
+    def codes(self) -> np.ndarray:
+        return (
+            self._codes[: self.size]
+            if self._codes is not None
+            else np.zeros((0, 0), dtype=np.int8)
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the codes and scales."""
+        return self.codes.nbytes + (
+            self.scale.nbytes if self.scale is not None else 0
+        )
+
+    def _quantize(self, rows: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(rows / self.scale), -127, 127).astype(np.int8)
+
+    def _append(self, matrix: np.ndarray, start: int):
+        needed = len(matrix)
+        if self._codes is None or len(self._codes) < needed:
+            codes = np.empty(
+                (max(needed, 2 * self.size, 1024), matrix.shape[1]),
+                dtype=np.int8,
+            )
+            if self.size:
+                codes[:self.size] = self._codes[:self.size]
+            self._codes = codes
+        for block in range(start, needed, self.block_rows):
+            end = min(block + self.block_rows, needed)
+            self._codes[block:end] = self._quantize(
+                np.asarray(matrix[block:end])
+            )
+        self.size = needed
+
+    def rebuild(self, matrix: np.ndarray, removed: np.ndarray = None):
+        """Re-fit the scales on `matrix` and quantize every row; `removed`
+        rows stay excluded from the candidates."""
+        self.reset()
+        if removed is not None:
+            self.removed = np.asarray(removed, dtype=np.int64)
+        n = len(matrix)
+        if n == 0:
+            return
+        peak = np.zeros(matrix.shape[1], dtype=np.float32)
+        for block in range(0, n, self.block_rows):
+            np.maximum(
+                peak,
+                np.abs(
+                    np.asarray(matrix[block : block + self.block_rows])
+                ).max(axis=0),
+                out=peak,
+            )
+        peak[peak == 0] = 1.0
+        self.scale = peak / 127.0
+        self._append(matrix, 0)
+        self.trained_at = n
+
+    def add(
+        self, matrix: np.ndarray, start: int, removed: np.ndarray = None
+    ):
+        """Quantize rows `start:` of `matrix`, which were just appended."""
+        n = len(matrix)
+        if not self.trained or n >= self.trained_at * self.retrain_growth:
+            self.rebuild(matrix, removed)
+            return
+        self._append(matrix, start)
+
+    def remove(self, rows: np.ndarray):
+        """Stop returning `rows` as candidates."""
+        self.removed = np.union1d(self.removed, rows)
+
+    def candidates(self, query: np.ndarray, k: int = None) -> np.ndarray:
+        """Rows of the best `max(rerank, k)` int8-approximate scores."""
+        scaled = (query * self.scale).astype(np.float32)
+        codes = self.codes
+        scores = np.empty(len(codes), dtype=np.float32)
+        # NumPy has no int8 matmul, so codes are widened into a small float32
+        # buffer a block at a time; at a few hundred rows the buffer stays in
+        # cache and the scan runs about as fast as a float32 matmul.
+        buffer = np.empty(
+            (self.score_block_rows, codes.shape[1]), dtype=np.float32
+        )
+        for block in range(0, len(codes), self.score_block_rows):
+            end = min(block + self.score_block_rows, len(codes))
+            rows = buffer[:end - block]
+            np.copyto(rows, codes[block:end], casting="unsafe")
+            np.dot(rows, scaled, out=scores[block:end])
+        return _best_rows(scores, max(self.rerank, k or 0), self.removed)
+
+
+class ReducedDimIndex:
+    """
+    Two-stage search: a coarse pass in `dim` dimensions, then exact
+    full-dimension rescoring of the best `shortlist` rows by the engine.
+
+    `method="pca"` projects onto the top `dim` principal components, fitted
+    on a sample of the corpus (at most `sample_size` rows) when the index is
+    built; "truncate" keeps the first `dim` coordinates, re-normalized,
+    which suits embeddings trained to be truncated (text-embedding-3-*).
+    The coarse scan reads dim/full_dim of the bytes an exact scan would.
+
+    Nothing is fitted until `min_train_size` rows exist (brute force is
+    cheap below that); the projection is re-fitted whenever the corpus has
+    grown by `retrain_growth`, like `IVFIndex`.
+    """
+
+    def __init__(
+        self,
+        dim: int = COARSE_DIM,
+        shortlist: int = COARSE_SHORTLIST,
+        method: str = "pca",
+        min_train_size: int = 2048,
+        retrain_growth: float = 2.0,
+        sample_size: int = 8192,
+        seed: int = 0,
+    ):
+        if method not in ("pca", "truncate"):
+            raise ValueError(
+                f"Unknown reduction '{method}' (expected 'pca' or 'truncate')"
+            )
+        self.dim = dim
+        self.shortlist = shortlist
+        self.method = method
+        self.min_train_size = min_train_size
+        self.retrain_growth = retrain_growth
+        self.sample_size = sample_size
+        self.seed = seed
+        self.reset()
+
+    def reset(self):
+        self.components = None
+        self._reduced = None
+        self.size = 0
+        self.trained_at = 0
+        self.removed = np.zeros(0, dtype=np.int64)
+
+    @property
+    def trained(self) -> bool:
+        return self._reduced is not None
+
+    @property
+    def reduced(self) -> np.ndarray:
+        return self._reduced[:self.size]
+
+    def _fit(self, matrix: np.ndarray):
+        dim = min(self.dim, matrix.shape[1])
+        if self.method == "truncate":
+            self.components = dim
+            return
+        rng = np.random.default_rng(self.seed)
+        sample = np.asarray(
+            matrix[
+                np.sort(
+                    rng.choice(
+                        len(matrix),
+                        min(len(matrix), self.sample_size),
+                        replace=False,
+                    )
+                )
+            ],
+            dtype=np.float64,
+        )
+        sample -= sample.mean(axis=0)
+        # Eigenvectors of the d x d covariance: cheaper than an SVD of the
+        # sample when there are more sample rows than dimensions.
+        _, vectors = np.linalg.eigh(sample.T @ sample)
+        self.components = np.ascontiguousarray(
+            vectors[:, ::-1][:, :dim], dtype=np.float32
+        )
+
+    def project(self, rows: np.ndarray) -> np.ndarray:
+        """Map full-dimension `rows` (or one vector) into the coarse space."""
+        rows = np.asarray(rows, dtype=np.float32)
+        if self.method == "truncate":
+            return VectorSearchEngine.normalize(rows[..., :self.components])
+        # No centering needed: it shifts every row's score by the same
+        # mean . query term, which doesn't change the ranking.
+        return rows @ self.components
+
+    def _append(self, matrix: np.ndarray, start: int):
+        needed = len(matrix)
+        if self._reduced is None or len(self._reduced) < needed:
+            width = (
+                self.components
+                if self.method == "truncate"
+                else self.components.shape[1]
+            )
+            reduced = np.empty(
+                (max(needed, 2 * self.size, 1024), width), dtype=np.float32
+            )
+            if self.size:
+                reduced[:self.size] = self._reduced[:self.size]
+            self._reduced = reduced
+        for block in range(start, needed, 65536):
+            end = min(block + 65536, needed)
+            self._reduced[block:end] = self.project(
+                np.asarray(matrix[block:end])
+            )
+        self.size = needed
+
+    def rebuild(self, matrix: np.ndarray, removed: np.ndarray = None):
+        """Re-fit the projection on `matrix` (or drop it if too small);
+        `removed` rows stay excluded from the candidates."""
+        self.reset()
+        if removed is not None:
+            self.removed = np.asarray(removed, dtype=np.int64)
+        if len(matrix) < self.min_train_size:
+            return
+        self._fit(matrix)
+        self._append(matrix, 0)
+        self.trained_at = len(matrix)
+
+    def add(
+        self, matrix: np.ndarray, start: int, removed: np.ndarray = None
+    ):
+        """Project rows `start:` of `matrix`, which were just appended."""
+        n = len(matrix)
+        if not self.trained or n >= self.trained_at * self.retrain_growth:
+            if n >= self.min_train_size:
+                self.rebuild(matrix, removed)
+            return
+        self._append(matrix, start)
+
+    def remove(self, rows: np.ndarray):
+        """Stop returning `rows` as candidates."""
+        self.removed = np.union1d(self.removed, rows)
+
+    def candidates(self, query: np.ndarray, k: int = None) -> np.ndarray:
+        """Rows of the best `max(shortlist, k)` scores in the coarse space."""
+        scores = self.reduced @ self.project(query).ravel()
+        return _best_rows(scores, max(self.shortlist, k or 0), self.removed)
+
+
+def create_index(name: str = VECTOR_INDEX, **params):
+    """Return the ANN index for `name` ("exact" means no index, i.e. None)."""
+    if name in (None, "", "exact"):
+        return None
+    if name == "ivf":
+        return IVFIndex(**params)
+    if name == "int8":
+        return Int8Index(**params)
+    if name in ("pca", "truncate"):
+        return ReducedDimIndex(method=name, **params)
+    raise ValueError(
+        f"Unknown vector index '{name}' (expected 'exact', 'ivf', "
+        "'int8', 'pca' or 'truncate')"
+    )
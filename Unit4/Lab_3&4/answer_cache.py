@@ -0,0 +1,193 @@
+"""
+Semantic cache of agent answers, keyed by question embedding.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from search_engine import VectorSearchEngine
+from tracing import trace_span
+
+
+# Semantic answer cache: a repeated (or reworded) question whose embedding
+# is at least ANSWER_CACHE_THRESHOLD cosine-similar to an earlier one, and
+# that retrieves exactly the same chunks, reuses the earlier answer instead
+# of calling the chat model again. ANSWER_CACHE=0 disables it.
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "1") != "0"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256"))
+
+
+class SemanticAnswerCache:
+    """
+    In-memory cache of agent answers keyed by question embedding.
+
+    `lookup()` returns a stored answer when an earlier question's vector is
+    at least `threshold` cosine-similar to the new one *and* the search
+    retrieved the same chunk ids for both, so a near-duplicate question that
+    lands on different handbook sections still goes to the model. Entries
+    expire after `ttl` seconds (0 = never) and the least recently used ones
+    are evicted beyond `max_entries`. `invalidate_chunks()` drops every
+    answer built from the given chunks; hook it to the store's change
+    listener so re-ingested chunks never serve stale answers.
+
+    Questions answered without an embedding (the keyword fast path of
+    `retrieve_with_score`) are stored with `query_vector=None` and only match
+    the same question text, compared case- and whitespace-insensitively.
+    """
+
+    def __init__(
+        self,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (unit question vector or None, frozenset of chunk ids,
+        #         answer, created at, question key)
+        self._entries = OrderedDict()
+        # Keys in creation order. `_entries` is in LRU order, so a hit can
+        # move an old entry past newer ones; with one ttl for all entries
+        # the oldest created is always the next to expire, so expiry pops
+        # from the head of this queue. Keys evicted or invalidated in the
+        # meantime are skipped when they reach the head.
+        self._expiry = deque()
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expire(self, now: float):
+        if not self.ttl:
+            return
+        while self._expiry:
+            entry = self._entries.get(self._expiry[0])
+            if entry is not None:
+                if now - entry[3] <= self.ttl:
+                    return
+                del self._entries[self._expiry[0]]
+                self.evictions += 1
+            self._expiry.popleft()
+
+    @staticmethod
+    def _question_key(question: str) -> str:
+        return " ".join((question or "").lower().split())
+
+    def lookup(self, query_vector, chunk_ids, question: str = None):
+        """(answer, similarity) for a matching earlier question, else None."""
+        with trace_span("answer_cache.lookup") as span:
+            hit = self._lookup(query_vector, chunk_ids, question)
+            span.set(cache_hit=hit is not None)
+            return hit
+
+    def _lookup(self, query_vector, chunk_ids, question: str):
+        chunks = frozenset(chunk_ids)
+        with self._lock:
+            self._expire(time.time())
+            if query_vector is None:
+                wanted = self._question_key(question)
+                for key, entry in reversed(self._entries.items()):
+                    if (
+                        entry[0] is None
+                        and entry[1] == chunks
+                        and entry[4] == wanted
+                    ):
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        return entry[2], 1.0
+                self.misses += 1
+                return None
+            query = VectorSearchEngine.normalize(query_vector)[0]
+            candidates = [
+                (key, entry)
+                for key, entry in self._entries.items()
+                if entry[0] is not None and entry[1] == chunks
+            ]
+            if candidates:
+                scores = (
+                    np.stack([entry[0] for _, entry in candidates]) @ query
+                )
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key, entry = candidates[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2], float(scores[best])
+            self.misses += 1
+            return None
+
+    def store(
+        self, query_vector, chunk_ids, answer: str, question: str = None
+    ):
+        """Remember `answer` for the question embedded as `query_vector`.
+
+        Without a vector the answer is keyed by the `question` text.
+        """
+        vector = (
+            None
+            if query_vector is None
+            else VectorSearchEngine.normalize(query_vector)[0]
+        )
+        entry = (
+            vector,
+            frozenset(chunk_ids),
+            answer,
+            time.time(),
+            self._question_key(question),
+        )
+        with self._lock:
+            self._entries[self._next_key] = entry
+            self._expiry.append(self._next_key)
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            if len(self._expiry) > 2 * self.max_entries:
+                # Drop the keys that are gone, keeping creation order.
+                self._expiry = deque(
+                    key for key in self._expiry if key in self._entries
+                )
+
+    def invalidate_chunks(self, chunk_ids=None) -> int:
+        """Drop answers built from any of `chunk_ids` (all if None).
+
+        Returns how many answers were dropped.
+        """
+        with self._lock:
+            if chunk_ids is None:
+                stale = list(self._entries)
+            else:
+                changed = set(chunk_ids)
+                stale = [
+                    key
+                    for key, entry in self._entries.items()
+                    if entry[1] & changed
+                ]
+            for key in stale:
+                del self._entries[key]
+            if chunk_ids is None:
+                self._expiry.clear()
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
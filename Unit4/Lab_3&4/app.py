@@ -1,11 +1,14 @@
 import os
 import math
-from datetime import datetime
+import asyncio
+import contextvars
+import time
+import hashlib
+import threading
+import weakref
 from dotenv import load_dotenv
 from langchain_openai import OpenAIEmbeddings
-from langchain_core.vectorstores import InMemoryVectorStore
 from langchain_core.documents import Document
-from langchain_text_splitters import CharacterTextSplitter, RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter
 try:
     from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 except Exception:
@@ -22,73 +25,192 @@ except Exception:
             self.content = content
 # Older helper functions like `create_react_agent` may be absent in newer
 # langchain versions; we'll implement a tiny compatibility agent below.
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, SystemMessagePromptTemplate, HumanMessagePromptTemplate
+from langchain_core.prompts import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    MessagesPlaceholder,
+    SystemMessagePromptTemplate,
+)
+from langchain_core.tools import StructuredTool
 try:
     from langchain.chat_models import ChatOpenAI
 except Exception:
     ChatOpenAI = None
 
-def create_chat_model(**kwargs):
-    """Return a chat model instance. Prefer LangChain's `ChatOpenAI` if
-    available; otherwise fall back to a minimal wrapper around the
-    `openai` package's ChatCompletion API.
-    """
-    if ChatOpenAI is not None:
-        return ChatOpenAI(**kwargs)
+try:
+    import openai
+except Exception:
+    openai = None
 
-    try:
-        import openai
-    except Exception:
-        raise ImportError("Neither `langchain.chat_models.ChatOpenAI` is available nor the `openai` package is installed. Install `openai` or use a LangChain version that provides ChatOpenAI.")
+# Load environment variables before the local modules below read their
+# settings from them.
+load_dotenv()
 
-    class ChatOpenAICompat:
-        def __init__(self, temperature=0, model_name="gpt-3.5-turbo", api_key_env="OPENAI_API_KEY", **_):
-            self.temperature = temperature
-            self.model = model_name
-            # Prefer the named env var, but fall back to GITHUB_TOKEN (used
-            # earlier for embeddings) or other common OpenAI env vars.
-            possible_vars = [api_key_env, "GITHUB_TOKEN", "OPENAI_API_KEY", "OPENAI_API_KEY_V1"]
-            self.api_key = None
-            for var in possible_vars:
-                self.api_key = os.getenv(var)
-                if self.api_key:
-                    break
-            if not self.api_key:
-                raise EnvironmentError(f"OpenAI API key not found in env vars: {possible_vars}")
+from ann_index import VECTOR_INDEX
+from answer_cache import ANSWER_CACHE, SemanticAnswerCache
+from chunking import HIERARCHICAL_CHUNKS
+from conversation import (
+    HISTORY_QUERY_REWRITE,
+    ConversationMemory,
+    is_follow_up,
+    rewrite_query,
+)
+from embedding_cache import EMBEDDING_CACHE_PATH, CachedEmbeddings
+from hashing_embeddings import HashingEmbeddings
+from ingest import (
+    INGEST_DIR,
+    ingest_directory,
+    list_ingest_files,
+    reindex_document,
+)
+from retrieval import (
+    CONTEXT_RETRIEVAL_K,
+    CONTEXT_TOKEN_BUDGET,
+    aretrieve_with_score,
+    build_context,
+    format_search_results,
+    result_score_kind,
+    retrieve_with_score,
+)
+from tokens import count_tokens
+from tracing import TRACE_EXPORT, TRACER, trace_span
+from vector_store import MmapVectorStore
+
+
+def _openai_has_client_api() -> bool:
+    """True for openai>=1.0 (client objects), False for the module API."""
+    ver = getattr(openai, "__version__", None)
+    if ver:
+        try:
+            return int(ver.split(".")[0]) >= 1
+        except Exception:
+            pass
+    return hasattr(openai, "OpenAI")
+
+
+# openai>=1.0 clients own an httpx connection pool; building one per call
+# throws away warm keep-alive connections and pays a fresh TCP + TLS
+# handshake every turn. Clients are therefore built once per
+# (api_key, base_url) and shared by every ChatOpenAICompat in the process.
+# The sync client is thread-safe. Async clients are bound to the event loop
+# whose connections they pool, so they are cached per loop.
+_OPENAI_CLIENTS = {}
+_OPENAI_ASYNC_CLIENTS = weakref.WeakKeyDictionary()
+_OPENAI_CLIENTS_LOCK = threading.Lock()
+
+
+def get_shared_openai_client(api_key: str, base_url: str = None):
+    """Return the process-wide pooled `openai.OpenAI` client for a key/URL."""
+    key = (api_key, base_url)
+    with _OPENAI_CLIENTS_LOCK:
+        client = _OPENAI_CLIENTS.get(key)
+        if client is None:
+            client = openai.OpenAI(api_key=api_key, base_url=base_url)
+            _OPENAI_CLIENTS[key] = client
+        return client
+
+
+def get_shared_async_openai_client(api_key: str, base_url: str = None):
+    """Return the pooled `openai.AsyncOpenAI` client for the running loop."""
+    loop = asyncio.get_running_loop()
+    with _OPENAI_CLIENTS_LOCK:
+        clients = _OPENAI_ASYNC_CLIENTS.setdefault(loop, {})
+        client = clients.get((api_key, base_url))
+        if client is None:
+            client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url)
+            clients[(api_key, base_url)] = client
+        return client
+
+
+class ChatOpenAICompat:
+    """Minimal chat model on top of the `openai` package, used when
+    LangChain's `ChatOpenAI` is unavailable. Works with both the 1.x client
+    API (through a shared, pooled client) and the pre-1.0 module API.
+    """
+    def __init__(
+        self,
+        temperature=0,
+        model_name="gpt-3.5-turbo",
+        api_key_env="OPENAI_API_KEY",
+        api_key=None,
+        base_url=None,
+        **_,
+    ):
+        self.temperature = temperature
+        self.model = model_name
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL") or None
+        # Prefer the named env var, but fall back to GITHUB_TOKEN (used
+        # earlier for embeddings) or other common OpenAI env vars.
+        possible_vars = [
+            api_key_env,
+            "GITHUB_TOKEN",
+            "OPENAI_API_KEY",
+            "OPENAI_API_KEY_V1",
+        ]
+        self.api_key = api_key
+        for var in possible_vars:
+            if self.api_key:
+                break
+            self.api_key = os.getenv(var)
+        if not self.api_key:
+            raise EnvironmentError(
+                f"OpenAI API key not found in env vars: {possible_vars}"
+            )
+        # Detect the openai package version once instead of on every message.
+        self.use_client_api = _openai_has_client_api()
+        if self.use_client_api:
+            self.client = get_shared_openai_client(self.api_key, self.base_url)
+        else:
+            self.client = None
             openai.api_key = self.api_key
 
-        def __call__(self, messages):
-            # Convert message objects to OpenAI-compatible dicts
-            openai_messages = []
-            for m in messages:
-                role = getattr(m, "role", None)
-                content = getattr(m, "content", None)
-                if role is None:
-                    # Heuristic: SystemMessage => system, HumanMessage => user, AIMessage => assistant
-                    tname = type(m).__name__.lower()
-                    if "system" in tname:
-                        role = "system"
-                    elif "human" in tname:
-                        role = "user"
-                    else:
-                        role = "assistant"
-                openai_messages.append({"role": role, "content": content})
-
-            # Detect openai package version and pick the correct API.
-            ver = getattr(openai, "__version__", None)
-            use_new = None
-            if ver:
-                try:
-                    major = int(ver.split(".")[0])
-                    use_new = major >= 1
-                except Exception:
-                    use_new = hasattr(openai, "OpenAI")
-            else:
-                use_new = hasattr(openai, "OpenAI")
-
-            if use_new:
-                client = openai.OpenAI(api_key=self.api_key)
-                resp = client.chat.completions.create(model=self.model, messages=openai_messages, temperature=self.temperature)
+    @staticmethod
+    def _to_openai_messages(messages) -> list:
+        # Convert message objects to OpenAI-compatible dicts
+        openai_messages = []
+        for m in messages:
+            role = getattr(m, "role", None)
+            content = getattr(m, "content", None)
+            if role is None:
+                # Heuristic: SystemMessage => system, HumanMessage => user,
+                # AIMessage => assistant
+                tname = type(m).__name__.lower()
+                if "system" in tname:
+                    role = "system"
+                elif "human" in tname:
+                    role = "user"
+                else:
+                    role = "assistant"
+            openai_messages.append({"role": role, "content": content})
+        return openai_messages
+
+    @staticmethod
+    def _trace_usage(span, resp):
+        usage = getattr(resp, "usage", None) or (
+            resp.get("usage") if isinstance(resp, dict) else None
+        )
+        if usage is not None:
+            get = (
+                usage.get
+                if isinstance(usage, dict)
+                else lambda key: getattr(usage, key, None)
+            )
+            span.set(
+                prompt_tokens=get("prompt_tokens"),
+                completion_tokens=get("completion_tokens"),
+            )
+
+    def __call__(self, messages):
+        openai_messages = self._to_openai_messages(messages)
+
+        with trace_span("llm.request", model=self.model) as span:
+            if self.use_client_api:
+                resp = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=openai_messages,
+                    temperature=self.temperature,
+                )
+                self._trace_usage(span, resp)
                 try:
                     return resp.choices[0].message.content
                 except Exception:
@@ -96,13 +218,133 @@ def create_chat_model(**kwargs):
             else:
                 # Older openai package (pre-1.0) — safe to call ChatCompletion
                 resp = openai.ChatCompletion.create(model=self.model, messages=openai_messages, temperature=self.temperature)
+                self._trace_usage(span, resp)
                 return resp["choices"][0]["message"]["content"]
 
+    def invoke(self, messages):
+        return self(messages)
+
+    def stream(self, messages):
+        """Yield the completion text piece by piece as the API streams it."""
+        openai_messages = self._to_openai_messages(messages)
+        started = time.perf_counter()
+        trace = {"model": self.model, "stream": True, "pieces": 0}
+        try:
+            if self.use_client_api:
+                chunks = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=openai_messages,
+                    temperature=self.temperature,
+                    stream=True,
+                )
+                for chunk in chunks:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        trace["pieces"] += 1
+                        trace.setdefault(
+                            "ttft_ms", (time.perf_counter() - started) * 1000
+                        )
+                        yield chunk.choices[0].delta.content
+            else:
+                chunks = openai.ChatCompletion.create(
+                    model=self.model,
+                    messages=openai_messages,
+                    temperature=self.temperature,
+                    stream=True,
+                )
+                for chunk in chunks:
+                    content = (
+                        chunk["choices"][0].get("delta", {}).get("content")
+                    )
+                    if content:
+                        trace["pieces"] += 1
+                        trace.setdefault(
+                            "ttft_ms", (time.perf_counter() - started) * 1000
+                        )
+                        yield content
+        finally:
+            TRACER.record_span(
+                "llm.request", time.perf_counter() - started, **trace
+            )
+
+    async def ainvoke(self, messages):
+        """Async chat completion via the shared `openai.AsyncOpenAI` client.
+
+        Falls back to `openai.ChatCompletion.acreate` on pre-1.0 openai.
+        """
+        openai_messages = self._to_openai_messages(messages)
+        with trace_span("llm.request", model=self.model) as span:
+            if self.use_client_api:
+                client = get_shared_async_openai_client(
+                    self.api_key, self.base_url
+                )
+                resp = await client.chat.completions.create(
+                    model=self.model,
+                    messages=openai_messages,
+                    temperature=self.temperature,
+                )
+                self._trace_usage(span, resp)
+                return resp.choices[0].message.content
+            resp = await openai.ChatCompletion.acreate(
+                model=self.model,
+                messages=openai_messages,
+                temperature=self.temperature,
+            )
+            self._trace_usage(span, resp)
+            return resp["choices"][0]["message"]["content"]
+
+
+def create_chat_model(**kwargs):
+    """Return a chat model instance. Prefer LangChain's `ChatOpenAI` if
+    available; otherwise fall back to `ChatOpenAICompat`, a minimal wrapper
+    around the `openai` package's chat completions API.
+    """
+    if ChatOpenAI is not None:
+        return ChatOpenAI(**kwargs)
+
+    if openai is None:
+        raise ImportError("Neither `langchain.chat_models.ChatOpenAI` is available nor the `openai` package is installed. Install `openai` or use a LangChain version that provides ChatOpenAI.")
+
     return ChatOpenAICompat(**kwargs)
-from langchain_core.tools import tool
 
-# Load environment variables
-load_dotenv()
+
+# Embedding backend used by `main()`: "openai" (text-embedding-3-small via
+# GitHub Models, needs GITHUB_TOKEN) or "local" (`HashingEmbeddings`, no
+# network), e.g. for load tests and offline benchmarks.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+
+
+def create_embeddings(backend: str = EMBEDDING_BACKEND):
+    """
+    Build the embeddings for `backend` ("openai" or "local"). Returns
+    (embeddings, model name); the name keys the embedding cache and the
+    snapshot fingerprint so vectors from different models never mix.
+    """
+    if backend == "local":
+        embeddings = HashingEmbeddings()
+        return embeddings, embeddings.model_name
+    if backend != "openai":
+        raise ValueError(
+            f"Unknown EMBEDDING_BACKEND '{backend}' "
+            "(expected 'openai' or 'local')."
+        )
+    embeddings = OpenAIEmbeddings(
+        model="text-embedding-3-small",
+        base_url="https://models.inference.ai.azure.com",
+        api_key=os.getenv("GITHUB_TOKEN"),
+        check_embedding_ctx_length=False,
+    )
+    return embeddings, "text-embedding-3-small"
+
+
+# Snapshot location for the persisted vector store. Point
+# VECTOR_STORE_SNAPSHOT at an empty string to always rebuild in memory.
+VECTOR_STORE_SNAPSHOT = os.getenv(
+    "VECTOR_STORE_SNAPSHOT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".vector_store"),
+)
+# Bump whenever chunking or metadata changes so old snapshots get rebuilt.
+INGEST_PIPELINE_VERSION = "5"
+
 
 def cosine_similarity(vector_a, vector_b):
     """
@@ -150,237 +392,108 @@ def search_sentences(vector_store, query: str, k: int = 3):
     return output
 
 
-def load_document(vector_store, file_path: str):
-    """
-    Load a document from `file_path`, create a LangChain `Document`, add it
-    to `vector_store`, and return the created document ID (if available).
-    """
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
-    except FileNotFoundError:
-        print(f"❌ File not found: {file_path}")
-        return None
-    except Exception as e:
-        err_str = str(e).lower()
-        if "maximum context length" in err_str or "token" in err_str:
-            print("⚠️ This document is too large to embed as a single chunk.")
-            print("Token limit exceeded. The embedding model can only process up to 8,191 tokens at once.")
-            print("Solution: The document needs to be split into smaller chunks.")
-        else:
-            print(f"❌ Error reading file {file_path}: {e}")
-        return None
-
-    metadata = {
-        "fileName": os.path.basename(file_path),
-        "createdAt": datetime.now().isoformat(),
-    }
-
-    document = Document(page_content=text, metadata=metadata)
-
-    try:
-        result = vector_store.add_documents([document])
-        doc_id = None
-        if isinstance(result, list) and result:
-            # Many vector stores return a list of inserted IDs
-            doc_id = result[0]
-
-        print(f"✅ Added document '{metadata['fileName']}' ({len(text)} chars) to vector store.")
-        return doc_id
-    except Exception as e:
-        print(f"❌ Error adding document to vector store: {e}")
-        return None
-
-
-def load_document_with_chunks(vector_store, file_path: str, chunks: list):
-    """
-    Add pre-split LangChain `Document` chunks to the `vector_store`.
-
-    Each chunk's metadata will be updated with fileName (including chunk X/Total),
-    createdAt timestamp, and chunkIndex. Prints progress and returns total stored.
-    """
-    total = len(chunks)
-    file_base = os.path.basename(file_path)
-    stored = 0
-
-    for idx, chunk in enumerate(chunks, start=1):
-        try:
-            meta = getattr(chunk, "metadata", None)
-            if meta is None:
-                meta = {}
-                chunk.metadata = meta
-
-            meta.update({
-                "fileName": f"{file_base} (Chunk {idx}/{total})",
-                "createdAt": datetime.now().isoformat(),
-                "chunkIndex": idx,
-            })
-
-            vector_store.add_documents([chunk])
-            stored += 1
-            print(f"Stored chunk {idx}/{total} for '{file_base}'.")
-        except FileNotFoundError:
-            print(f"❌ File not found when storing chunk {idx}/{total}: {file_path}")
-        except Exception as e:
-            err_str = str(e).lower()
-            if "maximum context length" in err_str or "token" in err_str:
-                print("⚠️ Chunk too large to embed. Split it into smaller parts.")
-            else:
-                print(f"❌ Error storing chunk {idx}/{total}: {e}")
-
-    return stored
-
-
-def load_with_fixed_size_chunking(vector_store, file_path: str):
-    """
-    Read `file_path`, split into fixed-size chunks using `CharacterTextSplitter`,
-    create Documents, and add them to `vector_store` via
-    `load_document_with_chunks`. Prints chunk statistics and returns number stored.
-    """
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
-    except FileNotFoundError:
-        print(f"❌ File not found: {file_path}")
-        return 0
-    except Exception as e:
-        print(f"❌ Error reading file {file_path}: {e}")
-        return 0
-
-    splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0, separator=" ")
-    # create_documents expects a list of texts
-    docs = splitter.create_documents([text])
-
-    num_chunks = len(docs)
-    avg_size = sum(len(d.page_content) for d in docs) / num_chunks if num_chunks else 0
-
-    print(f"Created {num_chunks} chunks (avg size: {avg_size:.1f} chars) for '{os.path.basename(file_path)}'.")
-
-    stored = load_document_with_chunks(vector_store, file_path, docs)
-    return stored
-
-
-def load_with_paragraph_chunking(vector_store, file_path: str):
-    """
-    Read `file_path`, split into paragraph-preserving chunks using
-    `RecursiveCharacterTextSplitter`, create Documents, compare to fixed-size
-    chunking, add paragraph chunks to the vector store, and return number stored.
-    """
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
-    except FileNotFoundError:
-        print(f"❌ File not found: {file_path}")
-        return 0
-    except Exception as e:
-        print(f"❌ Error reading file {file_path}: {e}")
-        return 0
-
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=0, separators=["\n\n", "\n", " ", ""])
-    docs = splitter.create_documents([text])
-
-    num_chunks = len(docs)
-    sizes = [len(d.page_content) for d in docs]
-    smallest = min(sizes) if sizes else 0
-    largest = max(sizes) if sizes else 0
-    starts_with_newline = sum(1 for d in docs if d.page_content.startswith("\n"))
-
-    # Compare to fixed-size chunking (without storing)
-    fixed_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0, separator=" ")
-    fixed_docs = fixed_splitter.create_documents([text])
-    fixed_sizes = [len(d.page_content) for d in fixed_docs]
-
-    print("=== Paragraph Chunking vs Fixed-Size Chunking ===")
-    print(f"Paragraph chunking: total={num_chunks}, smallest={smallest}, largest={largest}, starts_with_newline={starts_with_newline}")
-    print(f"Fixed-size chunking: total={len(fixed_docs)}, smallest={min(fixed_sizes) if fixed_sizes else 0}, largest={max(fixed_sizes) if fixed_sizes else 0}")
-
-    # Store the paragraph chunks
-    stored = load_document_with_chunks(vector_store, file_path, docs)
-    return stored
-
-
-def load_with_markdown_header_chunking(vector_store, file_path: str):
-    """
-    Split the markdown file by headers using `MarkdownHeaderTextSplitter`, then
-    apply `RecursiveCharacterTextSplitter` with overlap to each section to
-    produce chunks. Store chunks using `load_document_with_chunks` and return
-    the number stored.
-    """
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
-    except FileNotFoundError:
-        print(f"❌ File not found: {file_path}")
-        return 0
-    except Exception as e:
-        print(f"❌ Error reading file {file_path}: {e}")
-        return 0
-
-    header_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=[("#", "Header 1"), ("##", "Header 2")])
-    sections = header_splitter.split_text(text)
-
-    chunker = RecursiveCharacterTextSplitter(chunk_size=8000, chunk_overlap=200)
-    docs = []
-    for sec in sections:
-        # `sections` may contain `Document` objects or plain strings depending
-        # on the installed splitter version. Normalize to string content.
-        sec_text = getattr(sec, "page_content", None) or getattr(sec, "text", None) or sec
-        docs_for_section = chunker.create_documents([sec_text])
-        docs.extend(docs_for_section)
-
-    sizes = [len(d.page_content) for d in docs]
-    num_chunks = len(docs)
-    smallest = min(sizes) if sizes else 0
-    largest = max(sizes) if sizes else 0
-
-    print("=== Markdown-Header Chunking ===")
-    print(f"Total chunks created: {num_chunks}")
-    print(f"Smallest chunk: {smallest} chars, Largest chunk: {largest} chars")
-
-    stored = load_document_with_chunks(vector_store, file_path, docs)
-    return stored
-
-
 def create_search_tool(vector_store):
     """Create a LangChain tool that searches the vector store.
 
     Returns a tool-wrapped function that accepts a query string and returns
-    top-3 search results formatted with their scores.
+    top-3 search results formatted with their scores. Optional `source`
+    and `section` arguments pre-filter the chunks through the store's
+    metadata filter index. The tool has both a sync and an async
+    implementation, so `await tool.ainvoke(query)` embeds the query and
+    searches without blocking the event loop.
     """
-    @tool
-    def search_documents(query: str) -> str:
-        """Searches the company document repository for relevant information based on the given query. Use this to find information about company policies, benefits, and procedures."""
-        try:
-            results = vector_store.similarity_search_with_score(query, k=3)
-        except Exception as e:
-            return f"Error during search: {e}"
-
-        lines = []
-        for idx, item in enumerate(results, start=1):
+    def search_filter(source: str = None, section: str = None) -> dict:
+        return {
+            key: value
+            for key, value in (("source", source), ("section", section))
+            if value
+        }
+
+    def search_documents(
+        query: str, source: str = None, section: str = None
+    ) -> str:
+        """Searches the company document repository for relevant information
+        based on the given query. Use this to find information about company
+        policies, benefits, and procedures. Optionally restrict the search to
+        one `source` file (e.g. "HealthInsuranceBrochure.md") or to a
+        `section` heading (e.g. "Benefits").
+        """
+        with trace_span("tool.search_documents"):
             try:
-                doc, score = item
-            except Exception:
-                doc = item[0]
-                score = item[1] if len(item) > 1 else 0.0
-
-            content = getattr(doc, "page_content", None)
-            if content is None:
-                content = getattr(doc, "text", None) or (doc if isinstance(doc, str) else str(doc))
-
-            lines.append(f"Result {idx} (Score: {score:.4f}): {content}")
-
-        return "\n\n".join(lines)
+                vector, results = retrieve_with_score(
+                    vector_store,
+                    query,
+                    k=3,
+                    filter=search_filter(source, section),
+                )
+            except Exception as e:
+                return f"Error during search: {e}"
+            return format_search_results(
+                results, result_score_kind(vector_store, vector)
+            )
+
+    async def asearch_documents(
+        query: str, source: str = None, section: str = None
+    ) -> str:
+        with trace_span("tool.search_documents"):
+            try:
+                vector, results = await aretrieve_with_score(
+                    vector_store,
+                    query,
+                    k=3,
+                    filter=search_filter(source, section),
+                )
+            except Exception as e:
+                return f"Error during search: {e}"
+            return format_search_results(
+                results, result_score_kind(vector_store, vector)
+            )
 
-    return search_documents
+    return StructuredTool.from_function(
+        func=search_documents, coroutine=asearch_documents
+    )
 
 
-def create_agent_executor(vector_store, chat_model=None):
+# Upper bound on questions answered concurrently by one executor's
+# `ainvoke`/`abatch`.
+AGENT_MAX_CONCURRENCY = int(os.getenv("AGENT_MAX_CONCURRENCY", "16"))
+# Stream answers token by token in the chat loop (AGENT_STREAMING=0 to
+# wait for the full answer instead).
+AGENT_STREAMING = os.getenv("AGENT_STREAMING", "1") != "0"
+
+# Per-request agent state. Concurrent requests run in their own contexts
+# (asyncio tasks copy the context, threads start with an empty one), so
+# one request never sees or overwrites another's numbers.
+_LAST_TIMING = contextvars.ContextVar("agent_last_timing", default=None)
+_LAST_ERROR = contextvars.ContextVar("agent_last_error", default=None)
+_LAST_PROMPT = contextvars.ContextVar("agent_last_prompt", default=None)
+_LAST_SEARCH_QUERY = contextvars.ContextVar(
+    "agent_last_search_query", default=None
+)
+
+
+def create_agent_executor(
+    vector_store,
+    chat_model=None,
+    answer_cache=None,
+    rewrite_queries: bool = HISTORY_QUERY_REWRITE,
+):
     """Create a ReAct agent executor that can use the search tool to answer queries.
 
     If `chat_model` is None, a default `ChatOpenAI` instance is created.
+    Pass a `SemanticAnswerCache` as `answer_cache` to reuse answers to
+    repeated questions; it is invalidated whenever chunks of `vector_store`
+    are replaced or deleted. `chat_history` in the inputs (a
+    `ConversationMemory` or a list of messages) goes into the prompt; with
+    `rewrite_queries`, follow-up questions are rewritten into standalone
+    queries for retrieval.
     """
     if chat_model is None:
         chat_model = create_chat_model(temperature=0)
+    if answer_cache is not None and hasattr(
+        vector_store, "add_change_listener"
+    ):
+        vector_store.add_change_listener(answer_cache.invalidate_chunks)
 
     search_tool = create_search_tool(vector_store)
 
@@ -397,112 +510,817 @@ def create_agent_executor(vector_store, chat_model=None):
     # then asks the chat model to produce a final answer including the
     # tool output. This avoids depending on `create_react_agent`.
     class SimpleAgent:
-        def __init__(self, llm, tool_fn, system_message: str):
+
+        def __init__(
+            self,
+            llm,
+            tool_fn,
+            system_message: str,
+            vector_store=None,
+            k: int = CONTEXT_RETRIEVAL_K,
+            context_tokens: int = CONTEXT_TOKEN_BUDGET,
+        ):
             self.llm = llm
             self.tool_fn = tool_fn
             self.system_message = system_message
-
-        def run(self, user_input: str) -> str:
+            self.vector_store = vector_store
+            self.k = k
+            self.context_tokens = context_tokens
+
+        @property
+        def last_search_query(self) -> str:
+            """
+            Standalone query the latest follow-up in the current context was
+            rewritten to, if any.
+            """
+            return _LAST_SEARCH_QUERY.get()
+
+        @last_search_query.setter
+        def last_search_query(self, query: str):
+            _LAST_SEARCH_QUERY.set(query)
+
+        @property
+        def last_prompt(self) -> dict:
+            """
+            Token accounting of the latest prompt in the current context
+            (see `context_for`). Updated in place while the prompt is built.
+            """
+            prompt = _LAST_PROMPT.get()
+            if prompt is None:
+                prompt = {}
+                _LAST_PROMPT.set(prompt)
+            return prompt
+
+        @last_prompt.setter
+        def last_prompt(self, prompt: dict):
+            _LAST_PROMPT.set(prompt)
+
+        @property
+        def last_timing(self) -> dict:
+            """Timing of the latest `stream()` in the current context."""
+            return _LAST_TIMING.get() or {}
+
+        @last_timing.setter
+        def last_timing(self, timing: dict):
+            _LAST_TIMING.set(timing)
+
+        @property
+        def last_error(self) -> str:
+            """
+            Why the latest answer in the current context failed, else None.
+            A failed answer still reads like text (it carries an "(LLM
+            error: ...)" note), so callers check this before reusing it.
+            """
+            return _LAST_ERROR.get()
+
+        def _messages(
+            self, user_input: str, tool_output: str, history: list = None
+        ) -> list:
+            # Compose messages for the chat model:
+            # system + history + tool output + user question
+            history = list(history or [])
+            messages = (
+                [SystemMessage(content=self.system_message)]
+                + history
+                + [
+                    HumanMessage(
+                        content=(
+                            f"Search results:\n{tool_output}\n\n"
+                            f"User question: {user_input}"
+                        )
+                    ),
+                ]
+            )
+            self.last_prompt["history_tokens"] = sum(
+                count_tokens(m.content) for m in history
+            )
+            self.last_prompt["prompt_tokens"] = sum(
+                count_tokens(m.content) for m in messages
+            )
+            return messages
+
+        def context_for(self, results) -> str:
+            """
+            Pack retrieved (doc, score) results with `build_context` and
+            record in `last_prompt` the context tokens next to `raw_tokens`,
+            what pasting the raw formatted results would have cost.
+            """
+            context, info = build_context(results, self.context_tokens)
+            info["raw_tokens"] = count_tokens(format_search_results(results))
+            self.last_prompt = info
+            return context
+
+        @staticmethod
+        def _text(response) -> str:
+            # `response` may be an AIMessage or an object with `content`
+            if hasattr(response, "content"):
+                return response.content
+            # Some LangChain versions return a dict-like result
+            if isinstance(response, dict) and "output_text" in response:
+                return response["output_text"]
+            return str(response)
+
+        def _search(self, user_input: str) -> str:
             try:
-                tool_output = self.tool_fn(user_input)
+                if self.vector_store is not None:
+                    return self.context_for(self.retrieve(user_input)[1])
+                self.last_prompt = {}
+                # LangChain tools are invoked with `.invoke`; plain
+                # callables work too.
+                if hasattr(self.tool_fn, "invoke"):
+                    return self.tool_fn.invoke(user_input)
+                return self.tool_fn(user_input)
             except Exception as e:
-                tool_output = f"(search tool error: {e})"
-
-            # Compose messages for the chat model: system + tool output + user question
-            messages = [
-                SystemMessage(content=self.system_message),
-                HumanMessage(content=f"Search results:\n{tool_output}\n\nUser question: {user_input}"),
-            ]
-
-            try:
-                response = self.llm(messages)
-                # `response` may be an AIMessage or an object with `content`
-                if hasattr(response, "content"):
-                    return response.content
-                # Some LangChain versions return a dict-like result
-                if isinstance(response, dict) and "output_text" in response:
-                    return response["output_text"]
-                return str(response)
-            except Exception as e:
-                return f"(LLM error: {e})"
-
-    agent = SimpleAgent(llm=chat_model, tool_fn=search_tool, system_message=system_msg)
+                return f"(search tool error: {e})"
+
+        def retrieve(self, user_input: str):
+            """
+            Embed `user_input` at most once and search with that vector.
+            Returns (query vector or None, [(doc, score)]) so callers can
+            reuse the embedding, e.g. as a semantic cache key.
+            """
+            return retrieve_with_score(self.vector_store, user_input, k=self.k)
+
+        async def aretrieve(self, user_input: str):
+            """Async `retrieve`."""
+            return await aretrieve_with_score(
+                self.vector_store, user_input, k=self.k
+            )
+
+        def run(
+            self,
+            user_input: str,
+            tool_output: str = None,
+            history: list = None,
+            search_query: str = None,
+        ) -> str:
+            """
+            Answer `user_input` given prior `history` messages. `tool_output`
+            skips the search when already retrieved; otherwise the search
+            uses `search_query` (default: `user_input`).
+            """
+            _LAST_ERROR.set(None)
+            if tool_output is None:
+                tool_output = self._search(search_query or user_input)
+            messages = self._messages(user_input, tool_output, history)
+            with trace_span(
+                "agent.llm",
+                prompt_tokens=self.last_prompt.get("prompt_tokens"),
+            ):
+                try:
+                    return self._text(self.llm(messages))
+                except Exception as e:
+                    _LAST_ERROR.set(str(e))
+                    return f"(LLM error: {e})"
+
+        def stream(
+            self,
+            user_input: str,
+            tool_output: str = None,
+            history: list = None,
+            search_query: str = None,
+        ):
+            """
+            Like `run`, but yield the answer in pieces as the model produces
+            them. Timing lands in `last_timing` (per context, so
+            concurrent requests keep their own): `ttft` (seconds from the
+            call to the first piece, search included), `total` and whether
+            the backend actually `streamed`. Backends without `stream()`, or
+            whose stream fails before the first token, fall back to one
+            blocking call whose whole answer is yielded at once.
+            """
+            started = time.perf_counter()
+            timing = {"ttft": None, "total": None, "streamed": False}
+            self.last_timing = timing
+            _LAST_ERROR.set(None)
+            if tool_output is None:
+                tool_output = self._search(search_query or user_input)
+            messages = self._messages(user_input, tool_output, history)
+            llm_started = time.perf_counter()
+
+            def mark_first():
+                if timing["ttft"] is None:
+                    timing["ttft"] = time.perf_counter() - started
+
+            got_token = False
+            if hasattr(self.llm, "stream"):
+                try:
+                    for piece in self.llm.stream(messages):
+                        text = (
+                            self._text(piece)
+                            if not isinstance(piece, str)
+                            else piece
+                        )
+                        if not text:
+                            continue
+                        mark_first()
+                        got_token = True
+                        timing["streamed"] = True
+                        yield text
+                except Exception as e:
+                    if got_token:
+                        # The answer so far was already yielded; flag it as
+                        # truncated so it is not reused.
+                        _LAST_ERROR.set(str(e))
+                        yield f"\n(LLM error: {e})"
+            if not got_token:
+                try:
+                    text = self._text(self.llm(messages))
+                except Exception as e:
+                    _LAST_ERROR.set(str(e))
+                    text = f"(LLM error: {e})"
+                mark_first()
+                yield text
+            timing["total"] = time.perf_counter() - started
+            TRACER.record_span(
+                "agent.llm",
+                time.perf_counter() - llm_started,
+                prompt_tokens=self.last_prompt.get("prompt_tokens"),
+                streamed=timing["streamed"],
+            )
+
+        async def arun(
+            self,
+            user_input: str,
+            tool_output: str = None,
+            history: list = None,
+            search_query: str = None,
+        ) -> str:
+            """Async `run`: embedding, search and chat completion awaited."""
+            _LAST_ERROR.set(None)
+            if tool_output is None:
+                query = search_query or user_input
+                try:
+                    if self.vector_store is not None:
+                        tool_output = self.context_for(
+                            (await self.aretrieve(query))[1]
+                        )
+                    elif hasattr(self.tool_fn, "ainvoke"):
+                        tool_output = await self.tool_fn.ainvoke(query)
+                    else:
+                        tool_output = await asyncio.to_thread(
+                            self.tool_fn, query
+                        )
+                except Exception as e:
+                    tool_output = f"(search tool error: {e})"
+
+            messages = self._messages(user_input, tool_output, history)
+            with trace_span(
+                "agent.llm",
+                prompt_tokens=self.last_prompt.get("prompt_tokens"),
+            ):
+                try:
+                    # Both langchain's ChatOpenAI and ChatOpenAICompat expose
+                    # `ainvoke`; anything else runs on a worker thread.
+                    if hasattr(self.llm, "ainvoke"):
+                        response = await self.llm.ainvoke(messages)
+                    else:
+                        response = await asyncio.to_thread(self.llm, messages)
+                    return self._text(response)
+                except Exception as e:
+                    _LAST_ERROR.set(str(e))
+                    return f"(LLM error: {e})"
+
+    agent = SimpleAgent(
+        llm=chat_model,
+        tool_fn=search_tool,
+        system_message=system_msg,
+        vector_store=vector_store,
+    )
 
     class AgentExecutorCompat:
         """Compatibility wrapper that provides a minimal `invoke()` API
         similar to older `AgentExecutor`. It calls the underlying agent's
         `run()` method with the user's input and returns a dict with
         an `output` key to match the existing usage in this script.
+
+        `ainvoke()` is the async counterpart and `abatch()` answers many
+        questions concurrently; at most `max_concurrency` of them are in
+        flight at once so a burst of users cannot exhaust rate limits.
+
+        With an `answer_cache`, every call embeds the question once, searches
+        with that vector and asks the cache before the chat model; results
+        then carry `cached: True` (and `stream()` records it in
+        `agent.last_timing`).
+
+        `chat_history` in the inputs is passed to the model: a
+        `ConversationMemory` as its bounded summary + window, a plain list
+        of messages trimmed to its most recent `HISTORY_TOKEN_BUDGET`
+        tokens. Follow-up questions (`is_follow_up`) bypass the answer
+        cache, since their answer depends on the conversation, unless
+        `rewrite_queries` has turned them into standalone queries first.
         """
-        def __init__(self, agent, tools=None, verbose=False):
+        def __init__(
+            self,
+            agent,
+            tools=None,
+            verbose=False,
+            max_concurrency: int = AGENT_MAX_CONCURRENCY,
+            answer_cache=None,
+            rewrite_queries: bool = HISTORY_QUERY_REWRITE,
+        ):
             self.agent = agent
             self.tools = tools or []
             self.verbose = verbose
+            self.max_concurrency = max_concurrency
+            self.answer_cache = answer_cache
+            self.rewrite_queries = rewrite_queries
+            # One concurrency limit per event loop: an asyncio.Semaphore
+            # belongs to the loop it first waits on, and every
+            # `asyncio.run` starts a new one.
+            self._semaphores = weakref.WeakKeyDictionary()
+            self._semaphores_lock = threading.Lock()
+
+        def _semaphore(self) -> asyncio.Semaphore:
+            """This executor's concurrency limit on the running loop."""
+            loop = asyncio.get_running_loop()
+            with self._semaphores_lock:
+                semaphore = self._semaphores.get(loop)
+                if semaphore is None:
+                    semaphore = asyncio.Semaphore(self.max_concurrency)
+                    self._semaphores[loop] = semaphore
+                return semaphore
+
+        @staticmethod
+        def _user_input(inputs):
+            if isinstance(inputs, dict):
+                return inputs.get("input")
+            return inputs
+
+        @staticmethod
+        def _history(inputs) -> list:
+            history = (
+                inputs.get("chat_history")
+                if isinstance(inputs, dict)
+                else None
+            )
+            if not history:
+                return []
+            if isinstance(history, ConversationMemory):
+                return history.history_messages()
+            return ConversationMemory.bounded(history)
+
+        def _plan(
+            self, user_input: str, history: list, rewritten: str = None
+        ) -> dict:
+            """Retrieval query for this turn and whether to use the cache."""
+            follow_up = bool(history) and is_follow_up(user_input)
+            query = rewritten or user_input
+            # A cached answer calls no model; don't report an earlier error.
+            _LAST_ERROR.set(None)
+            self.agent.last_search_query = (
+                query if query != user_input else None
+            )
+            return {
+                "query": query,
+                "cacheable": self.answer_cache is not None
+                and (not follow_up or query != user_input),
+            }
+
+        def _needs_rewrite(self, user_input: str, history: list) -> bool:
+            return (
+                self.rewrite_queries
+                and bool(history)
+                and is_follow_up(user_input)
+            )
+
+        def _prepare(self, inputs):
+            user_input = self._user_input(inputs)
+            history = self._history(inputs)
+            rewritten = (
+                rewrite_query(self.agent.llm, history, user_input)
+                if self._needs_rewrite(user_input, history)
+                else None
+            )
+            return (
+                user_input,
+                history,
+                self._plan(user_input, history, rewritten),
+            )
+
+        async def _aprepare(self, inputs):
+            user_input = self._user_input(inputs)
+            history = self._history(inputs)
+            rewritten = None
+            if self._needs_rewrite(user_input, history):
+                rewritten = await asyncio.to_thread(
+                    rewrite_query, self.agent.llm, history, user_input
+                )
+            return (
+                user_input,
+                history,
+                self._plan(user_input, history, rewritten),
+            )
+
+        def _check_cache(self, plan: dict, retrieved):
+            """
+            Look `retrieved` = (query vector, results) up in the answer cache.
+            Returns (cached answer or None, cache context).
+            """
+            vector, results = retrieved
+            chunk_ids = [getattr(doc, "id", None) for doc, _ in results]
+            context = {
+                "vector": vector,
+                "chunk_ids": chunk_ids,
+                "tool_output": self.agent.context_for(results),
+                "question": plan["query"],
+            }
+            if None in chunk_ids:
+                # Without chunk ids the cache can't tell what an answer was
+                # built from; answer from the retrieved results uncached.
+                return None, dict(context, cacheable=False)
+            hit = self.answer_cache.lookup(
+                vector, chunk_ids, question=plan["query"]
+            )
+            return (hit[0] if hit else None), dict(context, cacheable=True)
+
+        def _remember(self, context, answer: str):
+            # Call right after the agent answered, in the same context.
+            if (
+                context is not None
+                and context["cacheable"]
+                and self.agent.last_error is None
+            ):
+                self.answer_cache.store(
+                    context["vector"],
+                    context["chunk_ids"],
+                    answer,
+                    question=context["question"],
+                )
+
+        def _lookup(self, plan: dict):
+            if not plan["cacheable"]:
+                return None, None
+            try:
+                return self._check_cache(
+                    plan, self.agent.retrieve(plan["query"])
+                )
+            except Exception:
+                # Fall back to the plain search-tool path.
+                return None, None
+
+        async def _alookup(self, plan: dict):
+            if not plan["cacheable"]:
+                return None, None
+            try:
+                return self._check_cache(
+                    plan, await self.agent.aretrieve(plan["query"])
+                )
+            except Exception:
+                return None, None
+
+        @staticmethod
+        def _run_kwargs(history: list, plan: dict, context) -> dict:
+            return {
+                "tool_output": context["tool_output"] if context else None,
+                "history": history,
+                "search_query": plan["query"],
+            }
 
         def invoke(self, inputs):
-            if isinstance(inputs, dict):
-                user_input = inputs.get("input")
-            else:
-                user_input = inputs
+            user_input, history, plan = self._prepare(inputs)
+            cached, context = self._lookup(plan)
+            if cached is not None:
+                self.agent.last_prompt["prompt_tokens"] = 0
+                return {"output": cached, "cached": True}
+            result = self.agent.run(
+                user_input, **self._run_kwargs(history, plan, context)
+            )
+            self._remember(context, result)
+            return {"output": result}
 
-            result = self.agent.run(user_input)
+        def stream(self, inputs):
+            """Yield the answer text as it arrives.
+
+            Timing ends up in `self.agent.last_timing`.
+            """
+            started = time.perf_counter()
+            user_input, history, plan = self._prepare(inputs)
+            cached, context = self._lookup(plan)
+            if cached is not None:
+                elapsed = time.perf_counter() - started
+                self.agent.last_timing = {
+                    "ttft": elapsed,
+                    "total": elapsed,
+                    "streamed": False,
+                    "cached": True,
+                }
+                self.agent.last_prompt["prompt_tokens"] = 0
+                yield cached
+                return
+            pieces = []
+            for piece in self.agent.stream(
+                user_input, **self._run_kwargs(history, plan, context)
+            ):
+                pieces.append(piece)
+                yield piece
+            self._remember(context, "".join(pieces))
+
+        async def ainvoke(self, inputs):
+            async with self._semaphore():
+                user_input, history, plan = await self._aprepare(inputs)
+                cached, context = await self._alookup(plan)
+                if cached is not None:
+                    return {"output": cached, "cached": True}
+                result = await self.agent.arun(
+                    user_input, **self._run_kwargs(history, plan, context)
+                )
+            self._remember(context, result)
             return {"output": result}
 
-    executor = AgentExecutorCompat(agent=agent, tools=[search_tool], verbose=True)
+        async def abatch(self, inputs_list: list) -> list:
+            """Answer every item of `inputs_list` concurrently, in order."""
+            return await asyncio.gather(
+                *(self.ainvoke(inputs) for inputs in inputs_list)
+            )
+
+    executor = AgentExecutorCompat(
+        agent=agent,
+        tools=[search_tool],
+        verbose=True,
+        answer_cache=answer_cache,
+        rewrite_queries=rewrite_queries,
+    )
     return executor
 
-def main():
-    print("🤖 Python LangChain Agent Starting...\n")
 
-    # Check for GitHub token
-    if not os.getenv("GITHUB_TOKEN"):
-        print("❌ Error: GITHUB_TOKEN not found in environment variables.")
-        print("Please create a .env file with your GitHub token:")
-        print("GITHUB_TOKEN=your-github-token-here")
-        print("\nGet your token from: https://github.com/settings/tokens")
-        print("Or use GitHub Models: https://github.com/marketplace/models")
-        return
-    
-    # Create OpenAIEmbeddings instance for GitHub Models API
-    embeddings = OpenAIEmbeddings(
-        model="text-embedding-3-small",
-        base_url="https://models.inference.ai.azure.com",
-        api_key=os.getenv("GITHUB_TOKEN"),
-        check_embedding_ctx_length=False,
+def compute_source_fingerprint(paths: list, model_name: str) -> str:
+    """
+    Hash the ingest pipeline version, the embedding model name, and the name
+    and bytes of every file in `paths`. A snapshot built from the same inputs
+    has the same fingerprint, so it can be reused instead of re-embedding.
+    """
+    digest = hashlib.sha256(
+        f"{INGEST_PIPELINE_VERSION}\n{model_name}".encode("utf-8")
     )
+    for path in paths:
+        digest.update(os.path.basename(path).encode("utf-8"))
+        try:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        except OSError:
+            digest.update(b"<missing>")
+    return digest.hexdigest()
 
-    print("✅ OpenAIEmbeddings instance created (GitHub Models API).")
-    # Create an in-memory vector store using the embeddings instance
-    vector_store = InMemoryVectorStore(embeddings)
-    print("=== Embedding Inspector Lab ===")
-    print("Removed sample sentences, add_texts usage, and the Lab 2 search loop per request.")
-    print("Vector store is initialized and ready for adding documents programmatically.")
 
-    # Load a brochure document into the vector DB
+def sync_bundled_documents(vector_store, brochure_path: str, emp_path: str):
+    """
+    Bring the health insurance brochure and employee handbook in
+    `vector_store` up to date, embedding only chunks that changed.
+    """
     print("=== Loading Documents into Vector Database ===")
-    brochure_path = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "HealthInsuranceBrochure.md"))
-    doc_id = load_document(vector_store, brochure_path)
-    if doc_id is not None:
-        print(f"Loaded '{os.path.basename(brochure_path)}' successfully into vector store (id: {doc_id}).")
+    if HIERARCHICAL_CHUNKS:
+        # Both files are read once into sections and their passages.
+        reindex_document(vector_store, brochure_path)
+        reindex_document(vector_store, emp_path)
+        return
+    # The brochure is small enough to embed whole, as `load_document` does.
+    try:
+        with open(brochure_path, "r", encoding="utf-8") as f:
+            brochure = Document(page_content=f.read())
+    except OSError as e:
+        print(f"Failed to load '{os.path.basename(brochure_path)}': {e}")
     else:
-        print(f"Failed to load '{os.path.basename(brochure_path)}'.")
-    
-    # Also load the employee handbook
-    emp_path = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "EmployeeHandbook.md"))
-    # Load the employee handbook using markdown-header-aware chunking
-    chunks_stored = load_with_markdown_header_chunking(vector_store, emp_path)
-    if chunks_stored and chunks_stored > 0:
-        print(f"Loaded '{os.path.basename(emp_path)}' successfully into vector store ({chunks_stored} chunks stored).")
+        reindex_document(vector_store, brochure_path, [brochure])
+
+    # The employee handbook uses markdown-header-aware chunking
+    reindex_document(vector_store, emp_path)
+
+
+def _chat_turn(agent_executor, chat_history, user_input: str, turn):
+    """
+    Answer one chat-loop question, print the answer and its stats, and add
+    the exchange to `chat_history`. Failures are recorded on the `turn`
+    span (`error`), so a turn that failed is not traced as a success.
+    """
+    # Invoke the agent executor with the user's input and chat history
+    inputs = {
+        "input": user_input,
+        "chat_history": chat_history,
+    }
+    if AGENT_STREAMING:
+        # Print tokens as they arrive so the answer starts appearing
+        # after time-to-first-token, not after the whole generation.
+        print("Agent: ", end="", flush=True)
+        pieces = []
+        try:
+            for piece in agent_executor.stream(inputs):
+                print(piece, end="", flush=True)
+                pieces.append(piece)
+        except Exception as e:
+            print(f"\nAgent error: {e}")
+            turn.set(error=type(e).__name__)
+            return
+        print()
+        response = "".join(pieces)
+        timing = agent_executor.agent.last_timing
+        if timing.get("cached"):
+            mode = "answer cache hit"
+        else:
+            mode = (
+                "streamed" if timing["streamed"] else "non-streaming fallback"
+            )
+        print(
+            f"(first token after {timing['ttft'] * 1000:.0f} ms, "
+            f"total {timing['total']:.2f}s, {mode})"
+        )
     else:
-        print(f"Failed to load '{os.path.basename(emp_path)}' into vector store.")
+        try:
+            result = agent_executor.invoke(inputs)
+        except Exception as e:
+            print(f"Agent error: {e}")
+            turn.set(error=type(e).__name__)
+            return
+
+        # Extract and display the agent response
+        response = result.get("output") if isinstance(result, dict) else result
+        print(f"Agent: {response}")
+        if isinstance(result, dict) and result.get("cached"):
+            print("(answer cache hit)")
+    if agent_executor.agent.last_error is not None:
+        # The model call failed; the answer is only an error note.
+        turn.set(error="llm")
+
+    if agent_executor.agent.last_search_query:
+        print(f"(searched for: {agent_executor.agent.last_search_query})")
+    prompt = agent_executor.agent.last_prompt
+    if prompt.get("prompt_tokens"):
+        context_note = ""
+        if "raw_tokens" in prompt:
+            context_note = (
+                f"; context {prompt['context_tokens']} tokens in "
+                f"{prompt['blocks']} blocks from {prompt['chunks']} "
+                f"chunks, raw results {prompt['raw_tokens']}"
+            )
+        print(
+            f"(prompt {prompt['prompt_tokens']} tokens, history "
+            f"{prompt.get('history_tokens', 0)}{context_note})"
+        )
+
+    # Update chat history
+    chat_history.add_turn(user_input, response)
+
+
+def main():
+    print("🤖 Python LangChain Agent Starting...\n")
+
+    # Check for GitHub token (the chat model always needs it; embeddings
+    # only with the default "openai" backend)
+    if not os.getenv("GITHUB_TOKEN"):
+        if EMBEDDING_BACKEND == "local":
+            print(
+                "⚠️ GITHUB_TOKEN not set: documents are embedded locally "
+                "and the chat shows search results only."
+            )
+        else:
+            print("❌ Error: GITHUB_TOKEN not found in environment variables.")
+            print("Please create a .env file with your GitHub token:")
+            print("GITHUB_TOKEN=your-github-token-here")
+            print("\nGet your token from: https://github.com/settings/tokens")
+            print(
+                "Or use GitHub Models: https://github.com/marketplace/models"
+            )
+            print("(Or set EMBEDDING_BACKEND=local to embed without the API.)")
+            return
+
+    embeddings, embedding_model = create_embeddings(EMBEDDING_BACKEND)
+    if EMBEDDING_BACKEND == "local":
+        print(
+            f"✅ Local hashing embeddings created ({embedding_model}); "
+            "no embedding API calls."
+        )
+    else:
+        print("✅ OpenAIEmbeddings instance created (GitHub Models API).")
+        if EMBEDDING_CACHE_PATH:
+            embeddings = CachedEmbeddings(
+                embeddings,
+                cache_path=EMBEDDING_CACHE_PATH,
+                model_name=embedding_model,
+            )
+            print(f"✅ Embedding cache enabled at '{EMBEDDING_CACHE_PATH}'.")
+    print("=== Embedding Inspector Lab ===")
+    print(
+        "Removed sample sentences, add_texts usage, and the Lab 2 search "
+        "loop per request."
+    )
+
+    docs_dir = os.path.join(os.path.dirname(__file__), "..")
+    brochure_path = os.path.normpath(
+        os.path.join(docs_dir, "HealthInsuranceBrochure.md")
+    )
+    emp_path = os.path.normpath(os.path.join(docs_dir, "EmployeeHandbook.md"))
+
+    # Reuse the on-disk snapshot when the source documents are unchanged;
+    # opening it is just an mmap, no embedding calls at all.
+    extra_files = list_ingest_files(INGEST_DIR) if INGEST_DIR else []
+    fingerprint = compute_source_fingerprint(
+        [brochure_path, emp_path] + extra_files, embedding_model
+    )
+    pipeline = f"{INGEST_PIPELINE_VERSION}:{embedding_model}" + (
+        ":hierarchical" if HIERARCHICAL_CHUNKS else ""
+    )
+    extra = (
+        MmapVectorStore.read_snapshot_extra(VECTOR_STORE_SNAPSHOT)
+        if VECTOR_STORE_SNAPSHOT
+        else {}
+    )
+
+    # Open the snapshot (just an mmap) whenever it was built by this
+    # pipeline version and model; if the documents changed since, only the
+    # changed chunks get re-embedded below.
+    vector_store = None
+    if extra.get("pipeline") == pipeline:
+        try:
+            vector_store = MmapVectorStore.load(
+                VECTOR_STORE_SNAPSHOT, embeddings
+            )
+            print(
+                f"✅ Loaded vector store snapshot ({len(vector_store)} "
+                f"vectors, index: {VECTOR_INDEX}) "
+                f"from '{VECTOR_STORE_SNAPSHOT}'."
+            )
+        except Exception as e:
+            print(
+                f"⚠️ Could not load vector store snapshot ({e}); rebuilding."
+            )
+
+    if vector_store is None or extra.get("fingerprint") != fingerprint:
+        if vector_store is None:
+            vector_store = MmapVectorStore(embeddings)
+            print(
+                f"Vector store is initialized (index: {VECTOR_INDEX}) and "
+                "ready for adding documents programmatically."
+            )
+        sync_bundled_documents(vector_store, brochure_path, emp_path)
+        if INGEST_DIR:
+            ingest_directory(vector_store, INGEST_DIR)
+
+        if isinstance(embeddings, CachedEmbeddings):
+            stats = embeddings.stats()
+            print(
+                f"Embedding cache: {stats['hits']} hits, "
+                f"{stats['misses']} misses ({stats['hit_rate']:.0%} hit "
+                f"rate), {stats['requests']} embedding calls, "
+                f"{stats['entries']} cached vectors."
+            )
+
+        if VECTOR_STORE_SNAPSHOT:
+            try:
+                vector_store.save(
+                    VECTOR_STORE_SNAPSHOT,
+                    extra={"fingerprint": fingerprint, "pipeline": pipeline},
+                )
+                print(
+                    "✅ Saved vector store snapshot to "
+                    f"'{VECTOR_STORE_SNAPSHOT}'."
+                )
+            except Exception as e:
+                print(f"⚠️ Could not save vector store snapshot: {e}")
+
+    if not os.getenv("GITHUB_TOKEN"):
+        # Offline run: no chat model, so show what the agent would retrieve.
+        print("=== Offline Search ===")
+        print(
+            "Type a question to see the matching chunks. "
+            "Type 'quit' or 'exit' to stop."
+        )
+        while True:
+            try:
+                query = input("You: ").strip()
+            except (KeyboardInterrupt, EOFError):
+                print("\nExiting search.")
+                break
+            if query.lower() in ("quit", "exit"):
+                print("Goodbye.")
+                break
+            if query:
+                with trace_span("search.turn") as turn:
+                    vector, results = retrieve_with_score(
+                        vector_store, query, k=3
+                    )
+                print(
+                    format_search_results(
+                        results, result_score_kind(vector_store, vector)
+                    )
+                )
+                if TRACER.enabled:
+                    print(f"(trace: {TRACER.breakdown(turn)})")
+        return
 
     # Create agent executor for conversational QA
-    agent_executor = create_agent_executor(vector_store)
+    answer_cache = SemanticAnswerCache() if ANSWER_CACHE else None
+    agent_executor = create_agent_executor(
+        vector_store, answer_cache=answer_cache
+    )
 
-    # Chat loop
-    chat_history = []
+    # Chat loop; the memory keeps the history part of each prompt bounded.
+    chat_history = ConversationMemory(llm=agent_executor.agent.llm)
     print("=== Interactive Agent Chat ===")
-    print("You can ask the agent about company policies, benefits, and procedures. Type 'quit' or 'exit' to stop.")
+    print(
+        "You can ask the agent about company policies, benefits, and "
+        "procedures. Type 'quit' or 'exit' to stop."
+    )
     while True:
         try:
             user_input = input("You: ")
@@ -517,23 +1335,25 @@ def main():
         if not user_input.strip():
             continue
 
-        # Invoke the agent executor with the user's input and chat history
+        with trace_span("chat.turn") as turn:
+            _chat_turn(agent_executor, chat_history, user_input, turn)
+        if TRACER.enabled:
+            print(f"(trace: {TRACER.breakdown(turn)})")
+
+    if answer_cache is not None:
+        stats = answer_cache.stats()
+        print(
+            f"Answer cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} "
+            f"entries, {stats['evictions']} evicted, "
+            f"{stats['invalidations']} invalidated."
+        )
+    if TRACER.enabled and TRACE_EXPORT:
         try:
-            result = agent_executor.invoke({
-                "input": user_input,
-                "chat_history": chat_history,
-            })
+            TRACER.export(TRACE_EXPORT)
+            print(f"✅ Wrote trace metrics to '{TRACE_EXPORT}'.")
         except Exception as e:
-            print(f"Agent error: {e}")
-            continue
-
-        # Extract and display the agent response
-        response = result.get("output") if isinstance(result, dict) else result
-        print(f"Agent: {response}")
-
-        # Update chat history
-        chat_history.append(HumanMessage(content=user_input))
-        chat_history.append(AIMessage(content=response))
+            print(f"⚠️ Could not write trace metrics: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,1029 @@
+"""
+Offline benchmarks for the Lab 3 & 4 retrieval pipeline.
+
+Run from this folder, e.g.:
+
+    python benchmark.py search --sizes 1000 10000 100000
+
+Every benchmark uses synthetic or local data, so no GITHUB_TOKEN or network
+access is needed (`hybrid` uses the real embedding model when GITHUB_TOKEN
+is set, for meaningful vector relevance numbers).
+"""
+import argparse
+import contextlib
+import ctypes
+import ctypes.util
+import gc
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from ann_index import Int8Index, IVFIndex, ReducedDimIndex
+from app import ChatOpenAICompat, HumanMessage, cosine_similarity, openai
+from hashing_embeddings import HashingEmbeddings
+from ingest import (
+    load_with_fixed_size_chunking,
+    load_with_hierarchical_chunking,
+    load_with_markdown_header_chunking,
+    load_with_paragraph_chunking,
+)
+from query_memo import QueryEmbeddingMemo
+from retrieval import retrieve_with_score
+from search_engine import VectorSearchEngine
+from vector_store import MmapVectorStore
+
+HANDBOOK_PATH = os.path.normpath(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "EmployeeHandbook.md"
+    )
+)
+BROCHURE_PATH = os.path.normpath(
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "..",
+        "HealthInsuranceBrochure.md",
+    )
+)
+
+# (question, substring of the headerPath of the chunk that answers it)
+HANDBOOK_QUERIES = [
+    ("FMLA", "5. Time Off and Leaves"),
+    ("401(k)", "4. Compensation and Benefits"),
+    ("USERRA", "5. Time Off and Leaves"),
+    ("EAP", "4. Compensation and Benefits"),
+    ("10.1", "10. Separation of Employment"),
+    ("5.9 sabbatical", "5. Time Off and Leaves"),
+    (
+        "How much notice do I give when I resign?",
+        "10. Separation of Employment",
+    ),
+    ("Can I wear jeans on Fridays?", "3. Workplace Standards"),
+    ("What counts as sexual harassment?", "8. Workplace Behavior and Conduct"),
+    ("How do I file a grievance with HR?", "9. Employee Relations"),
+    (
+        "Can I post about work on social media?",
+        "7. Technology and Data Security",
+    ),
+    ("When are performance reviews held?", "6. Performance and Development"),
+]
+
+
+def random_unit_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Return `n` random float32 vectors of size `dim` (not yet normalized)."""
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((n, dim), dtype=np.float32)
+
+
+def time_per_pair_search(
+    vectors: np.ndarray, query: np.ndarray, sample: int
+) -> float:
+    """
+    Time the pure-Python `cosine_similarity` loop over the corpus.
+
+    Scoring 100k x 1536-dim pairs in the interpreter takes minutes, so only
+    the first `sample` rows are scored and the time is scaled up linearly
+    (the loop is strictly O(N*d), so the extrapolation is fair).
+    """
+    n = len(vectors)
+    rows = min(n, sample)
+    corpus = vectors[:rows].tolist()
+    q = query.tolist()
+    started = time.perf_counter()
+    scores = [cosine_similarity(q, row) for row in corpus]
+    sorted(range(rows), key=lambda i: -scores[i])[:3]
+    elapsed = time.perf_counter() - started
+    return elapsed * (n / rows)
+
+
+def time_engine_search(
+    engine: VectorSearchEngine, queries: np.ndarray, k: int, repeats: int
+) -> float:
+    """Return the median seconds per single-query `engine.search` call."""
+    timings = []
+    for i in range(repeats):
+        q = queries[i % len(queries)]
+        started = time.perf_counter()
+        engine.search(q, k)
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings))
+
+
+def run_search_benchmark(args):
+    """Compare per-pair `cosine_similarity` with `VectorSearchEngine`.
+
+    Runs at each corpus size in `args.sizes`.
+    """
+    print(
+        f"=== Top-{args.k} search: per-pair cosine_similarity vs "
+        f"VectorSearchEngine (dim={args.dim}) ==="
+    )
+    print(
+        f"{'chunks':>8} | {'per-pair (s)':>12} | {'engine 1q (ms)':>14} | "
+        f"{'engine batch/q (ms)':>19} | {'speedup':>8}"
+    )
+    queries = random_unit_vectors(args.batch, args.dim, seed=1)
+    for n in args.sizes:
+        vectors = random_unit_vectors(n, args.dim)
+        per_pair = time_per_pair_search(vectors, queries[0], args.pair_sample)
+
+        engine = VectorSearchEngine()
+        engine.add(list(range(n)), vectors)
+        del vectors
+        single = time_engine_search(engine, queries, args.k, args.repeats)
+
+        started = time.perf_counter()
+        engine.search_batch(queries, args.k)
+        batch_per_query = (time.perf_counter() - started) / len(queries)
+
+        print(
+            f"{n:>8} | {per_pair:>12.3f} | {single * 1000:>14.3f} | "
+            f"{batch_per_query * 1000:>19.3f} | {per_pair / single:>7.0f}x"
+        )
+    if max(args.sizes) > args.pair_sample:
+        print(
+            f"(per-pair times above {args.pair_sample} chunks are "
+            f"extrapolated from a {args.pair_sample}-chunk sample)"
+        )
+
+
+def clustered_vectors(
+    n: int, dim: int, clusters: int, seed: int = 0
+) -> np.ndarray:
+    """
+    Return `n` vectors drawn around `clusters` random topic centres.
+
+    Real embedding corpora are clustered by topic; uniformly random vectors
+    are a worst case no ANN index is designed for, so the ANN benchmark uses
+    this instead.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim), dtype=np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    return centres[labels] + 1.5 * rng.standard_normal(
+        (n, dim), dtype=np.float32
+    )
+
+
+def latency_percentiles(timings: list) -> tuple:
+    """Return (p50, p99) of `timings` in milliseconds."""
+    arr = np.asarray(timings) * 1000
+    return float(np.percentile(arr, 50)), float(np.percentile(arr, 99))
+
+
+def recall_at_k(approx: list, exact: list) -> float:
+    """Fraction of the exact top-k ids that the approximate search found."""
+    hits = sum(
+        len({i for i, _ in a} & {i for i, _ in e})
+        for a, e in zip(approx, exact)
+    )
+    total = sum(len(e) for e in exact)
+    return hits / total if total else 1.0
+
+
+def timed_searches(
+    engine: VectorSearchEngine, queries: np.ndarray, k: int
+) -> tuple:
+    """Run one search per query; return (results, per-query seconds)."""
+    results, timings = [], []
+    for q in queries:
+        started = time.perf_counter()
+        results.append(engine.search(q, k))
+        timings.append(time.perf_counter() - started)
+    return results, timings
+
+
+def run_ann_benchmark(args):
+    """Recall@k and p50/p99 latency of IVFIndex vs exact search per nprobe."""
+    print(
+        f"=== IVF ANN vs exact search (n={args.n}, dim={args.dim}, "
+        f"k={args.k}) ==="
+    )
+    data = clustered_vectors(args.n + args.queries, args.dim, args.clusters)
+    corpus, queries = data[:args.n], data[args.n:]
+    ids = list(range(args.n))
+
+    exact = VectorSearchEngine()
+    exact.add(ids, corpus)
+    exact_results, exact_timings = timed_searches(exact, queries, args.k)
+    p50, p99 = latency_percentiles(exact_timings)
+    print(
+        f"{'mode':>12} | {'recall@' + str(args.k):>9} | "
+        f"{'p50 (ms)':>9} | {'p99 (ms)':>9}"
+    )
+    print(f"{'exact':>12} | {1.0:>9.3f} | {p50:>9.3f} | {p99:>9.3f}")
+
+    index = IVFIndex(nlist=args.nlist)
+    ann = VectorSearchEngine(index=index)
+    started = time.perf_counter()
+    # Feed the corpus in slices, the way load_document_with_chunks would.
+    for start in range(0, args.n, args.add_batch):
+        ann.add(
+            ids[start : start + args.add_batch],
+            corpus[start : start + args.add_batch],
+        )
+    print(
+        "(IVF built incrementally in "
+        f"{time.perf_counter() - started:.2f}s, "
+        f"{len(index.centroids)} cells)"
+    )
+
+    for nprobe in args.nprobe:
+        index.nprobe = nprobe
+        results, timings = timed_searches(ann, queries, args.k)
+        p50, p99 = latency_percentiles(timings)
+        print(
+            f"{'nprobe=' + str(nprobe):>12} | "
+            f"{recall_at_k(results, exact_results):>9.3f} | "
+            f"{p50:>9.3f} | {p99:>9.3f}"
+        )
+
+
+def python_list_bytes(dim: int) -> int:
+    """Approximate bytes of one embedding held as a Python list of floats.
+
+    That is how `InMemoryVectorStore` keeps its vectors.
+    """
+    return sys.getsizeof([0.0] * dim) + dim * sys.getsizeof(1.5)
+
+
+def process_memory() -> dict:
+    """VmRSS, RssAnon and RssFile of this process, in bytes.
+
+    Read from /proc/self/status; {} where that file does not exist.
+    """
+    memory = {}
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "RssAnon", "RssFile"):
+                    memory[name] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return memory
+
+
+def release_freed_memory():
+    """
+    Collect garbage and hand freed heap pages back to the OS, so RSS
+    readings show live data only. Without the glibc `malloc_trim` call the
+    per-batch temporaries of a build stay counted in RssAnon after they are
+    freed; elsewhere only `gc.collect()` runs.
+    """
+    gc.collect()
+    libc = ctypes.util.find_library("c")
+    if libc:
+        with contextlib.suppress(OSError, AttributeError):
+            ctypes.CDLL(libc).malloc_trim(0)
+
+
+def format_memory(memory: dict, baseline: dict = None) -> str:
+    """`memory` in MiB, with the change since `baseline` if given."""
+    if not memory:
+        return "n/a (no /proc/self/status)"
+    baseline = baseline or {}
+    return ", ".join(
+        f"{name} {value / 2**20:,.1f} MiB"
+        + (
+            f" ({(value - baseline[name]) / 2**20:+,.1f})"
+            if name in baseline
+            else ""
+        )
+        for name, value in memory.items()
+    )
+
+
+def run_quantized_benchmark(args):
+    """Memory, recall@k and latency of int8 codes + full-precision rerank.
+
+    The full-precision rows are appended to a spill file and read back
+    through a memory map, as `MmapVectorStore` does with index="int8".
+    Memory is the process RSS from /proc/self/status, each reading shown
+    against the RSS before any vectors existed: RssAnon is what the process
+    holds in RAM, RssFile the spill-file pages currently mapped (page
+    cache, which the kernel can drop at any time).
+    """
+    print(
+        f"=== int8 quantized search vs exact (n={args.n}, dim={args.dim}, "
+        f"k={args.k}) ==="
+    )
+    release_freed_memory()
+    baseline = process_memory()
+    print(f"RSS before any vectors: {format_memory(baseline)}")
+    data = VectorSearchEngine.normalize(
+        clustered_vectors(args.n + args.queries, args.dim, args.clusters)
+    )
+    queries = data[args.n:].copy()
+    ids = list(range(args.n))
+
+    exact = VectorSearchEngine()
+    exact.add(ids, data[:args.n])
+    # The engine holds its own copy; keep only that one.
+    del data
+    release_freed_memory()
+    exact_results, exact_timings = timed_searches(exact, queries, args.k)
+    float_memory = process_memory()
+    print(
+        "RSS, float32 matrix in RAM: "
+        f"{format_memory(float_memory, baseline)}"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = Int8Index()
+        quantized = VectorSearchEngine(
+            index=index, spill_path=os.path.join(tmp, "vectors.f32")
+        )
+        started = time.perf_counter()
+        # Rows arrive in ingest-sized batches and go straight to the file.
+        for start in range(0, args.n, 4096):
+            end = min(start + 4096, args.n)
+            quantized.add(ids[start:end], exact.matrix[start:end])
+        print(
+            "(int8 codes and spill file built in "
+            f"{time.perf_counter() - started:.2f}s)"
+        )
+        # Drop the in-RAM float32 matrix, so RSS shows the int8 engine alone.
+        del exact
+        release_freed_memory()
+        int8_memory = process_memory()
+        print(
+            "RSS, int8 codes + spill file: "
+            f"{format_memory(int8_memory, baseline)}"
+        )
+        if int8_memory and float_memory:
+            fell = float_memory["VmRSS"] - int8_memory["VmRSS"]
+            print(
+                f"resident memory fell by {fell / 2**20:,.1f} MiB once the "
+                "float32 matrix was dropped"
+            )
+
+        float_row = args.dim * 4
+        print(
+            "memory per chunk: Python list "
+            f"~{python_list_bytes(args.dim):,} B | float32 row "
+            f"{float_row:,} B | int8 codes {index.nbytes / args.n:,.0f} B "
+            f"({float_row / (index.nbytes / args.n):.1f}x smaller than "
+            "float32)"
+        )
+        print(
+            f"{'mode':>14} | {'recall@' + str(args.k):>9} | "
+            f"{'p50 (ms)':>9} | {'p99 (ms)':>9}"
+        )
+        p50, p99 = latency_percentiles(exact_timings)
+        print(
+            f"{'exact float32':>14} | {1.0:>9.3f} | {p50:>9.3f} | {p99:>9.3f}"
+        )
+        for rerank in args.rerank:
+            index.rerank = rerank
+            results, timings = timed_searches(quantized, queries, args.k)
+            p50, p99 = latency_percentiles(timings)
+            print(
+                f"{'rerank=' + str(rerank):>14} | "
+                f"{recall_at_k(results, exact_results):>9.3f} | "
+                f"{p50:>9.3f} | {p99:>9.3f}"
+            )
+        print(
+            "RSS after the searches: "
+            f"{format_memory(process_memory(), baseline)}"
+        )
+        del quantized
+    print(
+        f"(rerank={args.k} is ranking by the int8 codes alone; larger "
+        "values rescore that many candidates from the mmap'd float32 file)"
+    )
+
+
+def run_twostage_benchmark(args):
+    """Recall@k and latency of a reduced-dimension coarse pass vs exact.
+
+    The shortlist is rescored at full dimension.
+    """
+    print(
+        f"=== Two-stage search vs exact (n={args.n}, dim={args.dim}, "
+        f"k={args.k}, shortlist={args.shortlist}) ==="
+    )
+    data = VectorSearchEngine.normalize(
+        clustered_vectors(args.n + args.queries, args.dim, args.clusters)
+    )
+    corpus, queries = data[:args.n], data[args.n:]
+    ids = list(range(args.n))
+
+    exact = VectorSearchEngine()
+    exact.add(ids, corpus)
+    exact_results, exact_timings = timed_searches(exact, queries, args.k)
+    print(
+        f"{'mode':>16} | {'fit (s)':>7} | {'recall@' + str(args.k):>9} | "
+        f"{'p50 (ms)':>9} | {'p99 (ms)':>9}"
+    )
+    p50, p99 = latency_percentiles(exact_timings)
+    print(f"{'exact':>16} | {'':>7} | {1.0:>9.3f} | {p50:>9.3f} | {p99:>9.3f}")
+    for method in args.methods:
+        for dim in args.coarse_dims:
+            index = ReducedDimIndex(
+                dim=dim, shortlist=args.shortlist, method=method
+            )
+            engine = VectorSearchEngine(index=index)
+            started = time.perf_counter()
+            engine.set_matrix(ids, corpus)
+            fit = time.perf_counter() - started
+            results, timings = timed_searches(engine, queries, args.k)
+            p50, p99 = latency_percentiles(timings)
+            print(
+                f"{f'{method} {dim}':>16} | {fit:>7.2f} | "
+                f"{recall_at_k(results, exact_results):>9.3f} | "
+                f"{p50:>9.3f} | {p99:>9.3f}"
+            )
+    print(
+        "(fit = building the coarse vectors, incl. PCA; raise --shortlist "
+        "for recall, lower the coarse dim for latency)"
+    )
+
+
+# (question, evidence): a retrieved chunk is relevant when it contains any
+# of the evidence strings, which keeps the labels independent of how a
+# strategy happens to cut the documents.
+RAG_QUESTIONS = [
+    (
+        "How much does the employer put into my HSA each year?",
+        ["employer HSA contribution", "$1,000/$2,000 employer contribution"],
+    ),
+    (
+        "What does the vision plan pay toward frames?",
+        ["$130 toward frames", "$130 frame allowance"],
+    ),
+    (
+        "Is the dental HMO free for employees?",
+        ["100% FREE** - No employee cost"],
+    ),
+    (
+        "How long does short-term disability pay last?",
+        [
+            "60% salary replacement for up to 26 weeks",
+            "60% salary, up to 26 weeks",
+        ],
+    ),
+    ("When is annual open enrollment?", ["Annual Open Enrollment"]),
+    (
+        "What is the monthly family premium for the PPO High plan?",
+        ["| Family | $295"],
+    ),
+    (
+        "How many free counseling sessions does the employee assistance "
+        "program include?",
+        ["6 free counseling sessions", "6 sessions/year"],
+    ),
+    (
+        "When does health coverage start for part-time employees?",
+        ["Coverage starts first of month after 60 days"],
+    ),
+    (
+        "What is the 401(k) employer match?",
+        ["100% match on first 3% of salary"],
+    ),
+    (
+        "How does vesting of the employer 401(k) match work?",
+        ["Employer match vests over 5 years"],
+    ),
+    ("How many paid holidays does the company observe?", ["11 paid holidays"]),
+    (
+        "Can I wear jeans on casual Fridays?",
+        ["Jeans and company-branded casual wear"],
+    ),
+    (
+        "How many weeks of notice should I give when I resign?",
+        ["Professional/managerial employees: 4 weeks"],
+    ),
+    (
+        "What is the overtime pay rate for hourly employees?",
+        ["1.5x pay for hours over 40/week"],
+    ),
+    (
+        "How many sick days do full-time employees get per year?",
+        ["12 days/year for all full-time employees"],
+    ),
+    (
+        "How long is paid parental leave for the primary caregiver?",
+        [
+            "12 weeks paid (primary caregiver)",
+            "Primary Caregiver:** 12 weeks paid",
+        ],
+    ),
+    (
+        "What are the steps to file a formal grievance?",
+        ["Submit Written Grievance to HR"],
+    ),
+    (
+        "How much vacation do employees accrue in their first three years?",
+        ["15 days/year (10 hrs/month)"],
+    ),
+]
+
+CHUNKING_STRATEGIES = {
+    "fixed": load_with_fixed_size_chunking,
+    "paragraph": load_with_paragraph_chunking,
+    "markdown": load_with_markdown_header_chunking,
+    "sections": load_with_hierarchical_chunking,
+}
+
+
+def ingest_strategy(loader, embeddings) -> tuple:
+    """Load both bundled documents with `loader` into a fresh store.
+
+    Returns (store, seconds).
+    """
+    store = MmapVectorStore(embeddings)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for path in (HANDBOOK_PATH, BROCHURE_PATH):
+            loader(store, path)
+    return store, time.perf_counter() - started
+
+
+def store_bytes(store: MmapVectorStore) -> int:
+    """Bytes held by the vectors plus the UTF-8 chunk and section texts."""
+    texts = [doc.page_content for doc in store.iter_documents()] + [
+        text for text, _ in store.parents.values()
+    ]
+    return int(store.engine.matrix.nbytes) + sum(
+        len(text.encode("utf-8")) for text in texts
+    )
+
+
+def evidence_rank(results: list, evidence: list) -> int:
+    """1-based rank of the first result with any `evidence` string, or 0."""
+    for rank, (doc, _) in enumerate(results, start=1):
+        if any(e in doc.page_content for e in evidence):
+            return rank
+    return 0
+
+
+def run_chunking_benchmark(args):
+    """Ingest time, chunks, memory, recall@k/MRR and latency per strategy."""
+    embeddings = HashingEmbeddings(args.dim)
+    print(
+        "=== Chunking strategies over both bundled documents "
+        f"({len(RAG_QUESTIONS)} labeled questions, k={args.k}, "
+        f"hashing embeddings dim={args.dim}) ==="
+    )
+    print(
+        f"{'strategy':>10} | {'ingest (ms)':>11} | {'chunks':>6} | "
+        f"{'peak MB':>7} | {'store MB':>8} | "
+        f"{'recall@' + str(args.k):>8} | {'MRR':>5} | {'p50 (ms)':>8} | "
+        f"{'p95 (ms)':>8} | {'p99 (ms)':>8}"
+    )
+    for name, loader in CHUNKING_STRATEGIES.items():
+        # Timing and memory come from separate runs: tracemalloc slows
+        # allocation-heavy code down considerably.
+        ingest_times = []
+        for _ in range(args.repeats):
+            store, seconds = ingest_strategy(loader, embeddings)
+            ingest_times.append(seconds)
+        tracemalloc.start()
+        ingest_strategy(loader, embeddings)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # No query memo: every search pays for its (local) query embedding.
+        store.query_memo = QueryEmbeddingMemo(max_entries=0)
+        ranks, timings = [], []
+        for _ in range(args.repeats):
+            for question, evidence in RAG_QUESTIONS:
+                started = time.perf_counter()
+                _, results = retrieve_with_score(
+                    store, question, k=args.k, mode="vector"
+                )
+                timings.append(time.perf_counter() - started)
+                ranks.append(evidence_rank(results, evidence))
+        recall = sum(1 for r in ranks if r) / len(ranks)
+        mrr = sum(1 / r for r in ranks if r) / len(ranks)
+        arr = np.asarray(timings) * 1000
+        p50, p95, p99 = (float(np.percentile(arr, q)) for q in (50, 95, 99))
+        print(
+            f"{name:>10} | {np.median(ingest_times) * 1000:>11.1f} | "
+            f"{len(store):>6} | {peak / 2**20:>7.2f} | "
+            f"{store_bytes(store) / 2**20:>8.3f} | {recall:>8.2f} | "
+            f"{mrr:>5.2f} | {p50:>8.3f} | {p95:>8.3f} | {p99:>8.3f}"
+        )
+    print(
+        "(recall@k: share of questions whose evidence is in the top k; "
+        "ingest time is the median of --repeats runs)"
+    )
+
+
+class CountingEmbeddings:
+    """Wraps an embeddings model and counts the query calls that reach it."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.query_calls = 0
+
+    def embed_documents(self, texts):
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text):
+        self.query_calls += 1
+        return self.inner.embed_query(text)
+
+
+def handbook_embeddings():
+    """The real embedding model with GITHUB_TOKEN set, else local hashing."""
+    if os.getenv("GITHUB_TOKEN"):
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(
+            model="text-embedding-3-small",
+            base_url="https://models.inference.ai.azure.com",
+            api_key=os.getenv("GITHUB_TOKEN"),
+            check_embedding_ctx_length=False,
+        ), True
+    return HashingEmbeddings(), False
+
+
+def rank_of(results: list, expected: str, k: int) -> int:
+    """1-based rank of the first result under `expected` headers, or 0."""
+    for rank, (doc, _) in enumerate(results[:k], start=1):
+        if expected in doc.metadata.get("headerPath", ""):
+            return rank
+    return 0
+
+
+def run_hybrid_benchmark(args):
+    """Vector vs BM25 vs fused retrieval on the bundled handbook.
+
+    Reports hit@1, MRR@k, latency and embedding calls per mode.
+    """
+    embeddings, real = handbook_embeddings()
+    counting = CountingEmbeddings(embeddings)
+    store = MmapVectorStore(counting)
+    load_with_markdown_header_chunking(store, HANDBOOK_PATH)
+
+    modes = {
+        "vector": lambda q: store.similarity_search_with_score(q, k=args.k),
+        "bm25": lambda q: [
+            (store._document(i), sc)
+            for i, sc in store.lexical.search(q, args.k)
+        ],
+        "hybrid (RRF)": lambda q: store.hybrid_search_with_score_by_vector(
+            q, store.embed_query(q), args.k
+        ),
+        "auto": lambda q: retrieve_with_score(
+            store, q, k=args.k, mode="hybrid"
+        )[1],
+    }
+    print(
+        f"\n=== Handbook retrieval ({len(HANDBOOK_QUERIES)} labeled "
+        f"questions, k={args.k}, "
+        f"{'text-embedding-3-small' if real else 'local hashing embeddings'}"
+        ") ==="
+    )
+    print(
+        f"{'mode':>13} | {'hit@1':>6} | {'MRR@' + str(args.k):>6} | "
+        f"{'mean (ms)':>9} | {'p50 (ms)':>9} | {'embed calls':>11}"
+    )
+    for name, search in modes.items():
+        # Fresh memo per mode so every mode pays for its own query embeddings.
+        store.query_memo = QueryEmbeddingMemo()
+        counting.query_calls = 0
+        ranks, timings = [], []
+        for question, expected in HANDBOOK_QUERIES:
+            started = time.perf_counter()
+            results = search(question)
+            timings.append(time.perf_counter() - started)
+            ranks.append(rank_of(results, expected, args.k))
+        hit1 = sum(r == 1 for r in ranks) / len(ranks)
+        mrr = sum(1 / r for r in ranks if r) / len(ranks)
+        p50, _ = latency_percentiles(timings)
+        print(
+            f"{name:>13} | {hit1:>6.2f} | {mrr:>6.2f} | "
+            f"{np.mean(timings) * 1000:>9.3f} | {p50:>9.3f} | "
+            f"{counting.query_calls:>11}"
+        )
+    print(
+        "(auto = keyword-like queries answered by BM25 alone, the rest "
+        "fused; it is what the search tool uses)"
+    )
+
+
+class StubChatHandler(BaseHTTPRequestHandler):
+    """Answers every POST with a canned chat completion (keep-alive HTTP)."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without TCP_NODELAY,
+    # Nagle + delayed ACKs add ~40 ms to every response.
+    disable_nagle_algorithm = True
+    connections = 0
+    BODY = json.dumps(
+        {
+            "id": "stub",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "stub",
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "ok"},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": 1,
+                "completion_tokens": 1,
+                "total_tokens": 2,
+            },
+        }
+    ).encode("utf-8")
+
+    def setup(self):
+        # One handler instance per TCP connection, so this counts connections.
+        type(self).connections += 1
+        super().setup()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.BODY)))
+        self.end_headers()
+        self.wfile.write(self.BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_client_benchmark(args):
+    """Per-call client construction (old ChatOpenAICompat) vs the pool."""
+    if openai is None or not hasattr(openai, "OpenAI"):
+        print("This benchmark needs openai>=1.0 installed.")
+        return
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubChatHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    messages = [HumanMessage(content="ping")]
+    payload = [{"role": "user", "content": "ping"}]
+
+    def new_client_call():
+        # What ChatOpenAICompat used to do on every message.
+        client = openai.OpenAI(api_key="stub", base_url=base_url)
+        client.chat.completions.create(
+            model="stub", messages=payload, temperature=0
+        )
+
+    shared = ChatOpenAICompat(
+        model_name="stub", api_key="stub", base_url=base_url
+    )
+
+    print(
+        f"=== ChatOpenAICompat per-call overhead ({args.calls} calls "
+        "against a local stub server) ==="
+    )
+    print(
+        f"{'mode':>18} | {'mean (ms)':>9} | {'p50 (ms)':>9} | "
+        f"{'p99 (ms)':>9} | {'new conns':>9}"
+    )
+    for name, call in (
+        ("new client/call", new_client_call),
+        ("shared client", lambda: shared(messages)),
+    ):
+        call()  # warm-up (imports, first connection)
+        StubChatHandler.connections = 0
+        timings = []
+        for _ in range(args.calls):
+            started = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - started)
+        p50, p99 = latency_percentiles(timings)
+        print(
+            f"{name:>18} | {np.mean(timings) * 1000:>9.3f} | {p50:>9.3f} | "
+            f"{p99:>9.3f} | {StubChatHandler.connections:>9}"
+        )
+    print(
+        "(plain HTTP on localhost: against the real HTTPS endpoint every "
+        "new connection also pays a TLS handshake)"
+    )
+    server.shutdown()
+
+
+def synthetic_chunks(n: int, chars: int) -> list:
+    """`n` chunk texts of about `chars` characters cut from the handbook."""
+    with open(HANDBOOK_PATH, "r", encoding="utf-8") as f:
+        text = f.read()
+    step = max(1, (len(text) - chars) // 997)
+    return [
+        text[(i * step) % (len(text) - chars) :][:chars] + f" #{i}"
+        for i in range(n)
+    ]
+
+
+def run_embed_benchmark(args):
+    """Throughput of the local hashing embeddings.
+
+    Measures the raw matrix, the list API, and a full store ingest.
+    """
+    embeddings = HashingEmbeddings(args.dim, args.ngram)
+    texts = synthetic_chunks(args.n, args.chars)
+    print(
+        f"=== Local hashing embeddings ({embeddings.model_name}): "
+        f"{args.n} chunks of ~{args.chars} chars ==="
+    )
+
+    def measure(label, fn):
+        best = min(timed(fn) for _ in range(args.repeats))
+        print(
+            f"{label:>28}: {best * 1000:8.1f} ms  "
+            f"({args.n / best:10,.0f} chunks/sec)"
+        )
+
+    def timed(fn):
+        started = time.perf_counter()
+        fn()
+        return time.perf_counter() - started
+
+    measure("embed_matrix", lambda: embeddings.embed_matrix(texts))
+    measure(
+        "embed_documents (lists)", lambda: embeddings.embed_documents(texts)
+    )
+    measure(
+        "MmapVectorStore.add_texts",
+        lambda: MmapVectorStore(embeddings).add_texts(texts),
+    )
+    print("(add_texts also builds the BM25 index; best of --repeats runs)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    search = sub.add_parser(
+        "search", help="Exact top-k search: per-pair Python vs NumPy engine"
+    )
+    search.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 10000, 100000]
+    )
+    search.add_argument(
+        "--dim",
+        type=int,
+        default=1536,
+        help="Embedding size (text-embedding-3-small is 1536)",
+    )
+    search.add_argument("--k", type=int, default=3)
+    search.add_argument(
+        "--batch",
+        type=int,
+        default=32,
+        help="Queries scored together in the batch run",
+    )
+    search.add_argument("--repeats", type=int, default=20)
+    search.add_argument(
+        "--pair-sample",
+        type=int,
+        default=2000,
+        help="Rows actually scored by the per-pair loop",
+    )
+    search.set_defaults(func=run_search_benchmark)
+
+    ann = sub.add_parser(
+        "ann", help="IVF approximate search: recall@k and latency vs exact"
+    )
+    ann.add_argument("--n", type=int, default=100000, help="Corpus size")
+    ann.add_argument("--dim", type=int, default=384)
+    ann.add_argument("--k", type=int, default=10)
+    ann.add_argument("--queries", type=int, default=200)
+    ann.add_argument(
+        "--clusters",
+        type=int,
+        default=200,
+        help="Topic centres in the synthetic corpus",
+    )
+    ann.add_argument(
+        "--nlist",
+        type=int,
+        default=None,
+        help="IVF cells (default: sqrt(n) at training time)",
+    )
+    ann.add_argument(
+        "--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32]
+    )
+    ann.add_argument(
+        "--add-batch", type=int, default=1000, help="Rows per incremental add"
+    )
+    ann.set_defaults(func=run_ann_benchmark)
+
+    quantized = sub.add_parser(
+        "quantized",
+        help=(
+            "int8 codes + full-precision rerank: memory per chunk, "
+            "recall@k, latency vs exact"
+        ),
+    )
+    quantized.add_argument("--n", type=int, default=50000, help="Corpus size")
+    quantized.add_argument("--dim", type=int, default=1536)
+    quantized.add_argument("--k", type=int, default=10)
+    quantized.add_argument("--queries", type=int, default=200)
+    quantized.add_argument(
+        "--clusters",
+        type=int,
+        default=200,
+        help="Topic centres in the synthetic corpus",
+    )
+    quantized.add_argument(
+        "--rerank",
+        type=int,
+        nargs="+",
+        default=[10, 25, 50, 100, 200],
+        help="Candidates rescored at full precision",
+    )
+    quantized.set_defaults(func=run_quantized_benchmark)
+
+    twostage = sub.add_parser(
+        "twostage",
+        help=(
+            "Reduced-dimension coarse pass + full rescoring: recall@k and "
+            "latency vs exact"
+        ),
+    )
+    twostage.add_argument("--n", type=int, default=50000, help="Corpus size")
+    twostage.add_argument("--dim", type=int, default=1536)
+    twostage.add_argument("--k", type=int, default=10)
+    twostage.add_argument("--queries", type=int, default=200)
+    twostage.add_argument(
+        "--clusters",
+        type=int,
+        default=200,
+        help="Topic centres in the synthetic corpus",
+    )
+    twostage.add_argument(
+        "--methods",
+        nargs="+",
+        default=["pca", "truncate"],
+        choices=["pca", "truncate"],
+    )
+    twostage.add_argument(
+        "--coarse-dims", type=int, nargs="+", default=[64, 128, 256, 512]
+    )
+    twostage.add_argument(
+        "--shortlist",
+        type=int,
+        default=500,
+        help="Rows rescored at full dimension",
+    )
+    twostage.set_defaults(func=run_twostage_benchmark)
+
+    client = sub.add_parser(
+        "client",
+        help=(
+            "Chat client per-call overhead: new client per call vs "
+            "shared pool"
+        ),
+    )
+    client.add_argument("--calls", type=int, default=200)
+    client.set_defaults(func=run_client_benchmark)
+
+    hybrid = sub.add_parser(
+        "hybrid",
+        help="Vector vs BM25 vs hybrid retrieval on EmployeeHandbook.md",
+    )
+    hybrid.add_argument("--k", type=int, default=3)
+    hybrid.set_defaults(func=run_hybrid_benchmark)
+
+    chunking = sub.add_parser(
+        "chunking",
+        help=(
+            "Fixed vs paragraph vs markdown vs passage->section chunking: "
+            "ingest cost, memory, recall@k/MRR, latency"
+        ),
+    )
+    chunking.add_argument("--k", type=int, default=3)
+    chunking.add_argument(
+        "--dim", type=int, default=1024, help="Size of the hashing embeddings"
+    )
+    chunking.add_argument("--repeats", type=int, default=5)
+    chunking.set_defaults(func=run_chunking_benchmark)
+
+    embed = sub.add_parser(
+        "embed", help="Local hashing embeddings throughput (chunks/sec)"
+    )
+    embed.add_argument("--n", type=int, default=20000, help="Number of chunks")
+    embed.add_argument(
+        "--chars", type=int, default=500, help="Characters per chunk"
+    )
+    embed.add_argument("--dim", type=int, default=512)
+    embed.add_argument("--ngram", type=int, default=4)
+    embed.add_argument("--repeats", type=int, default=3)
+    embed.set_defaults(func=run_embed_benchmark)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
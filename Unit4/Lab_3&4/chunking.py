@@ -0,0 +1,295 @@
+"""
+Streaming chunkers: split files into `Document` chunks without reading
+them into memory whole.
+"""
+import hashlib
+import itertools
+import os
+
+from langchain_core.documents import Document
+from langchain_text_splitters import (
+    CharacterTextSplitter,
+    RecursiveCharacterTextSplitter,
+)
+
+from tokens import (
+    CHUNK_TOKEN_BUDGET,
+    CHUNK_TOKEN_OVERLAP,
+    count_tokens,
+    token_text_splitter,
+)
+
+# Two-level chunking (HIERARCHICAL_CHUNKS=1): only passages of about
+# PASSAGE_TOKEN_BUDGET tokens are embedded and searched; each points at its
+# section-sized parent chunk, which is what retrieval returns.
+HIERARCHICAL_CHUNKS = os.getenv("HIERARCHICAL_CHUNKS", "0") == "1"
+PASSAGE_TOKEN_BUDGET = int(os.getenv("PASSAGE_TOKEN_BUDGET", "200"))
+
+
+def content_hash(text: str) -> str:
+    """Short sha256 digest of chunk text, used to spot unchanged chunks."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+# How much raw text the streaming chunkers read per step and how much they
+# let accumulate before running the splitter. Only this window (plus one
+# batch of chunks) is ever in memory, whatever the file size.
+STREAM_BLOCK_CHARS = 64 * 1024
+STREAM_WINDOW_CHARS = 256 * 1024
+
+
+def iter_text_blocks(f, block_chars: int = STREAM_BLOCK_CHARS):
+    """Yield successive blocks of at most `block_chars` characters of `f`."""
+    for block in iter(lambda: f.read(block_chars), ""):
+        yield block
+
+
+def _overlap_tail(text: str, splitter) -> str:
+    """
+    The longest end of `text` that fits in `splitter`'s chunk overlap
+    (measured with its length function), starting at a word boundary when
+    it contains one.
+    """
+    overlap = getattr(splitter, "_chunk_overlap", 0)
+    if overlap <= 0:
+        return ""
+    length = getattr(splitter, "_length_function", len)
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if length(text[len(text) - mid:]) <= overlap:
+            lo = mid
+        else:
+            hi = mid - 1
+    tail = text[len(text) - lo:]
+    if lo < len(text) and not text[len(text) - lo - 1].isspace():
+        words = tail.split(None, 1)
+        if len(words) == 2:
+            tail = tail[len(tail) - len(words[1]):]
+    return tail
+
+
+def stream_split(blocks, splitter, window_chars: int = STREAM_WINDOW_CHARS):
+    """
+    Run a LangChain text `splitter` over a stream of text `blocks`.
+
+    Text is buffered until the window is full, then split; every chunk but
+    the last is emitted, and the raw text from the start of the last chunk
+    onward is carried into the next window (the last chunk may continue in
+    the next block). The remainder is flushed at the end of the stream.
+
+    A full window the splitter cannot break (fewer than two chunks, e.g.
+    one long run without separators) is flushed as it is, so the buffer
+    never grows past one window plus a block; an overlap's worth of its
+    end (`_overlap_tail`) is carried into the next window, so the chunks
+    on either side still overlap.
+    """
+    buffer = ""
+    for block in blocks:
+        buffer += block
+        if len(buffer) < window_chars:
+            continue
+        pieces = splitter.split_text(buffer)
+        if len(pieces) < 2:
+            yield from pieces
+            buffer = _overlap_tail(buffer, splitter)
+            continue
+        for piece in pieces[:-1]:
+            yield piece
+        # Carry the raw tail (including any whitespace the splitter stripped)
+        # so words split across block boundaries are rejoined correctly.
+        tail_start = buffer.rfind(pieces[-1])
+        buffer = buffer[tail_start:] if tail_start >= 0 else pieces[-1]
+    if buffer.strip():
+        yield from splitter.split_text(buffer)
+
+
+def iter_fixed_size_chunks(f, chunk_size: int = 1000):
+    """Stream fixed-size `Document` chunks (split on spaces) from `f`."""
+    splitter = CharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=0, separator=" "
+    )
+    for piece in stream_split(iter_text_blocks(f), splitter):
+        yield Document(page_content=piece)
+
+
+def iter_paragraph_chunks(f, chunk_size: int = 1500):
+    """Stream paragraph-preserving `Document` chunks from text file `f`."""
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=0,
+        separators=["\n\n", "\n", " ", ""],
+    )
+    for piece in stream_split(iter_text_blocks(f), splitter):
+        yield Document(page_content=piece)
+
+
+def iter_token_chunks(
+    f,
+    chunk_tokens: int = CHUNK_TOKEN_BUDGET,
+    overlap_tokens: int = CHUNK_TOKEN_OVERLAP,
+):
+    """Stream paragraph-preserving `Document` chunks from text file `f`.
+
+    Chunks are packed up to `chunk_tokens` tokens each.
+    """
+    for piece in stream_split(
+        iter_text_blocks(f), token_text_splitter(chunk_tokens, overlap_tokens)
+    ):
+        yield Document(page_content=piece)
+
+
+def _iter_markdown_section_lines(f):
+    """
+    Yield (section number, (Header 1, Header 2), line) for every content
+    line of markdown file `f`.
+
+    A new section starts at each `#` or `##` header, mirroring
+    `MarkdownHeaderTextSplitter` with `#` and `##` in `headers_to_split_on`:
+    the header lines themselves are dropped, deeper headers stay in the text,
+    and `#` lines inside fenced code blocks are not treated as headers.
+    Header texts are "" above the first header of that level.
+    """
+    section = 0
+    headers = ["", ""]
+    in_fence = False
+    for line in f:
+        stripped = line.strip()
+        if stripped.startswith("```") or stripped.startswith("~~~"):
+            in_fence = not in_fence
+        elif not in_fence and (
+            stripped.startswith("# ") or stripped.startswith("## ")
+        ):
+            level = 0 if stripped.startswith("# ") else 1
+            headers[level] = stripped.lstrip("#").strip()
+            if level == 0:
+                headers[1] = ""
+            section += 1
+            continue
+        yield section, tuple(headers), line
+
+
+def iter_markdown_header_chunks(
+    f,
+    chunk_tokens: int = CHUNK_TOKEN_BUDGET,
+    overlap_tokens: int = CHUNK_TOKEN_OVERLAP,
+):
+    """
+    Stream markdown-header-aware `Document` chunks from open text file `f`.
+
+    The file is read line by line; each `#`/`##` section is fed through a
+    token-aware splitter (`token_text_splitter`) with overlap as it is read,
+    so even a single huge section never has to be in memory all at once.
+    Chunks are packed up to `chunk_tokens` tokens. Each chunk carries its
+    section's headers in metadata, as `MarkdownHeaderTextSplitter` names
+    them ("Header 1", "Header 2"), plus the joined `headerPath`, e.g.
+    "Employee Handbook > 4. Compensation and Benefits".
+    """
+    chunker = token_text_splitter(chunk_tokens, overlap_tokens)
+    for (_, headers), lines in itertools.groupby(
+        _iter_markdown_section_lines(f), key=lambda item: item[:2]
+    ):
+        metadata = {
+            name: text
+            for name, text in zip(("Header 1", "Header 2"), headers)
+            if text
+        }
+        metadata["headerPath"] = " > ".join(h for h in headers if h)
+        for piece in stream_split((line for _, _, line in lines), chunker):
+            yield Document(page_content=piece, metadata=dict(metadata))
+
+
+def iter_hierarchical_chunks(
+    f,
+    source: str,
+    markdown: bool = True,
+    passage_tokens: int = PASSAGE_TOKEN_BUDGET,
+):
+    """
+    Stream section- and passage-level `Document` chunks of open text file
+    `f` in a single read.
+
+    Section chunks come from `iter_markdown_header_chunks` (or
+    `iter_token_chunks` when `markdown` is false); each one is yielded
+    first, with `level` "section", a deterministic id derived from `source`
+    and its content, and its own `chunkIndex`/`fileName`. It is followed by
+    its passages (`level` "passage"), split from the section text already in
+    memory at paragraph, line and sentence boundaries up to
+    `passage_tokens` tokens. Passages carry the section's header metadata
+    plus `parentId`; `register_parent_sections` separates the two levels.
+    """
+    passages = RecursiveCharacterTextSplitter(
+        chunk_size=passage_tokens,
+        chunk_overlap=0,
+        length_function=count_tokens,
+        separators=["\n\n", "\n", ". ", " ", ""],
+    )
+    sections = (
+        iter_markdown_header_chunks(f) if markdown else iter_token_chunks(f)
+    )
+    for number, section in enumerate(sections, start=1):
+        digest = content_hash(section.page_content)
+        section.id = f"{source}:section:{digest}"
+        header_meta = dict(section.metadata)
+        section.metadata.update({
+            "level": "section",
+            "source": source,
+            "fileName": f"{source} (Section {number})",
+            "chunkIndex": number,
+            "contentHash": digest,
+        })
+        yield section
+        for piece in passages.split_text(section.page_content):
+            yield Document(
+                page_content=piece,
+                metadata=dict(
+                    header_meta, level="passage", parentId=section.id
+                ),
+            )
+
+
+def register_parent_sections(vector_store, chunks, stats=None):
+    """
+    Pass the passages of an `iter_hierarchical_chunks` stream through,
+    handing each section chunk to `vector_store.add_parents` instead (it is
+    kept as text only, never embedded). `stats` (a `ChunkStats`), if given,
+    counts the sections.
+    """
+    for chunk in chunks:
+        if chunk.metadata.get("level") != "section":
+            yield chunk
+            continue
+        vector_store.add_parents([chunk])
+        if stats is not None:
+            stats.add(chunk)
+
+
+class ChunkStats:
+    """Running count/size statistics over a stream, not keeping the chunks."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_chars = 0
+        self.smallest = 0
+        self.largest = 0
+        self.starts_with_newline = 0
+
+    def add(self, chunk):
+        """Count one chunk."""
+        size = len(chunk.page_content)
+        self.smallest = size if self.count == 0 else min(self.smallest, size)
+        self.largest = max(self.largest, size)
+        self.count += 1
+        self.total_chars += size
+        if chunk.page_content.startswith("\n"):
+            self.starts_with_newline += 1
+
+    def track(self, chunks):
+        """Pass `chunks` through unchanged while updating the statistics."""
+        for chunk in chunks:
+            self.add(chunk)
+            yield chunk
+
+    @property
+    def average(self) -> float:
+        return self.total_chars / self.count if self.count else 0.0
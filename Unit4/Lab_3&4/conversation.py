@@ -0,0 +1,210 @@
+"""
+Bounded conversation memory and follow-up query rewriting.
+"""
+import os
+import re
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from tokens import count_tokens, truncate_to_tokens
+
+
+# Conversation memory: recent turns are kept verbatim up to
+# HISTORY_TOKEN_BUDGET tokens and older turns are folded into a rolling
+# summary of at most HISTORY_SUMMARY_TOKENS, so the history part of the
+# prompt stays the same size however long the session runs.
+# HISTORY_QUERY_REWRITE=1 turns follow-up questions into standalone search
+# queries (one extra chat call per follow-up) before retrieval.
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "300"))
+HISTORY_QUERY_REWRITE = os.getenv("HISTORY_QUERY_REWRITE", "0") == "1"
+
+# Words that make a question lean on earlier turns ("what about part-time
+# employees?", "does it carry over?").
+FOLLOW_UP_RE = re.compile(
+    r"\b(it|its|that|this|those|these|they|them|their|he|she|his|her|there"
+    r"|same|also|else|instead)\b"
+    r"|^\s*(and|but|so|what about|how about)\b",
+    re.IGNORECASE,
+)
+
+
+def is_follow_up(question: str) -> bool:
+    """Heuristic: does `question` refer back to the conversation?"""
+    return bool(FOLLOW_UP_RE.search(question or ""))
+
+
+def _message_text(response) -> str:
+    return response.content if hasattr(response, "content") else str(response)
+
+
+def _transcript(messages) -> str:
+    return "\n".join(
+        f"{'User' if isinstance(m, HumanMessage) else 'Assistant'}: "
+        f"{m.content}"
+        for m in messages
+    )
+
+
+class ConversationMemory:
+    """
+    Bounded chat history: a sliding window of recent turns plus a rolling
+    summary of everything that slid out of it.
+
+    `add_turn()` appends a question/answer pair and, while the window is
+    over `window_tokens`, moves the oldest turns out and folds them into
+    `summary` with one call to `llm` (without an `llm`, or if the call
+    fails, the evicted questions are kept verbatim instead). The summary is
+    capped at `summary_tokens`. `history_messages()` is what goes into the
+    prompt.
+    """
+
+    def __init__(
+        self,
+        llm=None,
+        window_tokens: int = HISTORY_TOKEN_BUDGET,
+        summary_tokens: int = HISTORY_SUMMARY_TOKENS,
+    ):
+        self.llm = llm
+        self.window_tokens = window_tokens
+        self.summary_tokens = summary_tokens
+        self.messages = []
+        self.summary = ""
+        self.summarized_turns = 0
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    @staticmethod
+    def _tokens(messages) -> int:
+        return sum(count_tokens(m.content) for m in messages)
+
+    @classmethod
+    def bounded(
+        cls, messages, window_tokens: int = HISTORY_TOKEN_BUDGET
+    ) -> list:
+        """The most recent `messages` that fit in `window_tokens`.
+
+        For plain message lists, without a running summary.
+        """
+        kept = []
+        used = 0
+        for message in reversed(list(messages)):
+            used += count_tokens(message.content)
+            if used > window_tokens:
+                break
+            kept.append(message)
+        return kept[::-1]
+
+    def add_turn(self, question: str, answer: str):
+        self.messages.extend(
+            [HumanMessage(content=question), AIMessage(content=answer)]
+        )
+        evicted = []
+        # Always keep the latest turn, even if it alone is over budget.
+        while (
+            len(self.messages) > 2
+            and self._tokens(self.messages) > self.window_tokens
+        ):
+            evicted.extend(self.messages[:2])
+            del self.messages[:2]
+        if evicted:
+            self._fold(evicted)
+
+    def _fold(self, evicted: list):
+        summary = None
+        if self.llm is not None:
+            try:
+                summary = _message_text(
+                    self.llm(
+                        [
+                            SystemMessage(
+                                content=(
+                                    "Update the running summary of a "
+                                    "conversation about company policies "
+                                    "with the new turns. Keep facts the "
+                                    "user may refer back to. At most "
+                                    f"{self.summary_tokens * 3 // 4} words; "
+                                    "reply with the summary only."
+                                )
+                            ),
+                            HumanMessage(
+                                content=(
+                                    "Summary so far:\n"
+                                    f"{self.summary or '(none)'}\n\n"
+                                    f"New turns:\n{_transcript(evicted)}"
+                                )
+                            ),
+                        ]
+                    )
+                ).strip()
+            except Exception:
+                summary = None
+        if not summary:
+            questions = [
+                f"User asked: {m.content}"
+                for m in evicted
+                if isinstance(m, HumanMessage)
+            ]
+            summary = "\n".join(filter(None, [self.summary] + questions))
+        if count_tokens(summary) > self.summary_tokens:
+            summary = truncate_to_tokens(
+                summary, self.summary_tokens, keep_end=True
+            )
+        self.summary = summary
+        self.summarized_turns += len(evicted) // 2
+
+    def history_messages(self) -> list:
+        """Summary (as a system message, if any), then the recent turns."""
+        head = (
+            [
+                SystemMessage(
+                    content=(
+                        "Summary of the earlier conversation:\n"
+                        f"{self.summary}"
+                    )
+                )
+            ]
+            if self.summary
+            else []
+        )
+        return head + list(self.messages)
+
+    def clear(self):
+        self.messages = []
+        self.summary = ""
+        self.summarized_turns = 0
+
+
+def rewrite_query(llm, history: list, question: str) -> str:
+    """
+    Ask `llm` to turn follow-up `question` into a standalone search query
+    using `history`. Returns `question` unchanged if there is no history or
+    the call fails.
+    """
+    if not history:
+        return question
+    try:
+        rewritten = _message_text(
+            llm(
+                [
+                    SystemMessage(
+                        content=(
+                            "Rewrite the user's last question as a standalone "
+                            "search query for a company policy knowledge "
+                            "base, resolving references to the conversation. "
+                            "Reply with the query only."
+                        )
+                    ),
+                    HumanMessage(
+                        content=(
+                            f"Conversation:\n{_transcript(history)}\n\n"
+                            f"Last question: {question}"
+                        )
+                    ),
+                ]
+            )
+        ).strip()
+    except Exception:
+        return question
+    return rewritten or question
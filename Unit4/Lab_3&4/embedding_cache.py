@@ -0,0 +1,243 @@
+"""
+Persistent, content-addressed cache in front of an `Embeddings` model.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+from tracing import trace_span
+
+# On-disk embedding cache settings. Point EMBEDDING_CACHE_PATH at an empty
+# string to turn the cache off.
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), ".embedding_cache.sqlite3"
+    ),
+)
+EMBEDDING_CACHE_MAX_ENTRIES = int(
+    os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000")
+)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wrap an `Embeddings` object with a persistent, content-addressed cache.
+
+    Vectors are stored in a small SQLite file keyed by
+    sha256(model name + text), so unchanged chunks cost zero embedding calls
+    on the next run. The cache is size-bounded: once it holds more than
+    `max_entries` vectors, the least recently used ones are evicted.
+    `hits`, `misses` and `requests` (calls to the wrapped model) are counted
+    so callers can see how much work the cache saved.
+
+    The number of cached vectors is counted once when the cache is opened
+    and then kept up to date as vectors are stored and evicted, so storing
+    never has to count the whole table. Rows that other processes add to a
+    shared cache file are only counted after the next reopen.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        cache_path: str = EMBEDDING_CACHE_PATH,
+        model_name: str = None,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+    ):
+        self.embeddings = embeddings
+        self.model_name = (
+            model_name
+            or getattr(embeddings, "model", None)
+            or type(embeddings).__name__
+        )
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+        # SQLite connections are not thread-safe by default; one lock around
+        # every statement keeps this usable from worker threads.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, "
+            "vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_used "
+            "ON embeddings (last_used)"
+        )
+        self._conn.commit()
+        self._entries = self._conn.execute(
+            "SELECT COUNT(*) FROM embeddings"
+        ).fetchone()[0]
+
+    def _key(self, kind: str, text: str) -> str:
+        # `kind` keeps query and document vectors apart for models that embed
+        # them differently.
+        return hashlib.sha256(
+            f"{self.model_name}\n{kind}\n{text}".encode("utf-8")
+        ).hexdigest()
+
+    def _select(self, columns: str, keys: list) -> list:
+        """Fetch `columns` of the rows for `keys`; call with the lock held."""
+        rows = []
+        # Stay under SQLite's bound-parameter limit.
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            marks = ",".join("?" * len(part))
+            rows.extend(
+                self._conn.execute(
+                    f"SELECT {columns} FROM embeddings WHERE key IN ({marks})",
+                    part,
+                )
+            )
+        return rows
+
+    def _lookup(self, keys: list) -> dict:
+        """Return {key: vector} for cached keys and bump their LRU time."""
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for key, blob in self._select("key, vector", unique):
+                vec = array("d")
+                vec.frombytes(blob)
+                found[key] = vec.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in found],
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, pairs: dict):
+        """Persist {key: vector} and evict least recently used overflow."""
+        if not pairs:
+            return
+        now = time.time()
+        with self._lock:
+            # Only keys not stored yet add rows; replacing one does not.
+            replaced = len(self._select("key", list(pairs)))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) "
+                "VALUES (?, ?, ?)",
+                [(k, array("d", v).tobytes(), now) for k, v in pairs.items()],
+            )
+            self._entries += len(pairs) - replaced
+            if self._entries > self.max_entries:
+                evicted = self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM "
+                    "embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (self._entries - self.max_entries,),
+                ).rowcount
+                self._entries -= evicted
+            self._conn.commit()
+
+    def _count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def _split(self, kind: str, texts: list):
+        """Return (keys, cached vectors, texts still missing) for `texts`."""
+        keys = [self._key(kind, t) for t in texts]
+        found = self._lookup(keys)
+        missing = {}
+        hits = 0
+        for key, text in zip(keys, texts):
+            if key in found:
+                hits += 1
+            else:
+                missing.setdefault(key, text)
+        # Worker threads share one cache, so the counters move under the
+        # same lock as the table.
+        with self._lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return keys, found, missing
+
+    def embed_documents(self, texts: list) -> list:
+        """Embed `texts`, only sending cache misses to the wrapped model."""
+        with trace_span("embed.documents", texts=len(texts)) as span:
+            keys, found, missing = self._split("doc", texts)
+            span.set(
+                cache_hits=len(found),
+                cache_misses=len(missing),
+                requests=1 if missing else 0,
+            )
+            if missing:
+                self._count_request()
+                vectors = self.embeddings.embed_documents(
+                    list(missing.values())
+                )
+                fresh = dict(zip(missing.keys(), vectors))
+                self._store(fresh)
+                found.update(fresh)
+            return [found[k] for k in keys]
+
+    def embed_query(self, text: str) -> list:
+        """Embed a single query string, using the cache when possible."""
+        with trace_span("embed.query_cache") as span:
+            keys, found, missing = self._split("query", [text])
+            span.set(cache_hit=not missing)
+            if missing:
+                self._count_request()
+                vector = self.embeddings.embed_query(text)
+                self._store({keys[0]: vector})
+                return vector
+            return found[keys[0]]
+
+    async def aembed_documents(self, texts: list) -> list:
+        """Async `embed_documents`; only misses hit the wrapped model."""
+        with trace_span("embed.documents", texts=len(texts)) as span:
+            keys, found, missing = self._split("doc", texts)
+            span.set(
+                cache_hits=len(found),
+                cache_misses=len(missing),
+                requests=1 if missing else 0,
+            )
+            if missing:
+                self._count_request()
+                vectors = await self.embeddings.aembed_documents(
+                    list(missing.values())
+                )
+                fresh = dict(zip(missing.keys(), vectors))
+                self._store(fresh)
+                found.update(fresh)
+            return [found[k] for k in keys]
+
+    async def aembed_query(self, text: str) -> list:
+        """Async `embed_query` backed by the same cache."""
+        with trace_span("embed.query_cache") as span:
+            keys, found, missing = self._split("query", [text])
+            span.set(cache_hit=not missing)
+            if missing:
+                self._count_request()
+                vector = await self.embeddings.aembed_query(text)
+                self._store({keys[0]: vector})
+                return vector
+            return found[keys[0]]
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the number of cached vectors."""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            requests, size = self.requests, self._entries
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "requests": requests,
+            "entries": size,
+        }
+
+    def close(self):
+        """Close the underlying SQLite connection."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,995 @@
+"""
+Ingest: load files into a vector store in token-budgeted batches, keep it
+in sync with edited files, and ingest whole directories in parallel.
+"""
+import contextvars
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from chunking import (
+    HIERARCHICAL_CHUNKS,
+    ChunkStats,
+    content_hash,
+    iter_fixed_size_chunks,
+    iter_hierarchical_chunks,
+    iter_markdown_header_chunks,
+    iter_paragraph_chunks,
+    iter_token_chunks,
+    register_parent_sections,
+)
+from near_duplicates import INGEST_DEDUP, drop_near_duplicates
+from tokens import (
+    CHUNK_TOKEN_BUDGET,
+    EMBEDDING_MAX_TOKENS,
+    count_tokens,
+    token_count_and_bound,
+    token_upper_bound,
+)
+from tracing import TRACER, trace_span
+
+# Limits for batched chunk ingest. One `add_documents` call per batch turns
+# into one embeddings request, so we cap how many chunks and how many
+# (estimated) tokens ride along in each request. 1000 items matches the
+# default `chunk_size` of `OpenAIEmbeddings`, so a batch never gets split
+# into extra requests behind our back.
+EMBED_BATCH_MAX_ITEMS = 1000
+EMBED_BATCH_MAX_TOKENS = 100_000
+
+
+def load_document(vector_store, file_path: str):
+    """
+    Load a document from `file_path`, create a LangChain `Document`, add it
+    to `vector_store`, and return the created document ID (if available).
+    """
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            text = f.read()
+    except FileNotFoundError:
+        print(f"❌ File not found: {file_path}")
+        return None
+    except Exception as e:
+        print(f"❌ Error reading file {file_path}: {e}")
+        return None
+
+    # Check the size up front instead of waiting for the API to reject it.
+    tokens = token_upper_bound(text)
+    if tokens > EMBEDDING_MAX_TOKENS:
+        print(
+            "⚠️ This document is too large to embed as a single chunk "
+            f"(~{tokens} tokens)."
+        )
+        print(
+            "Token limit exceeded. The embedding model can only process "
+            f"up to {EMBEDDING_MAX_TOKENS:,} tokens at once."
+        )
+        print("Solution: The document needs to be split into smaller chunks.")
+        return None
+
+    metadata = {
+        "fileName": os.path.basename(file_path),
+        "createdAt": datetime.now().isoformat(),
+    }
+
+    document = Document(page_content=text, metadata=metadata)
+
+    try:
+        with trace_span(
+            "ingest.file",
+            file=metadata["fileName"],
+            chunks=1,
+            requests=1,
+            tokens=tokens,
+        ):
+            result = vector_store.add_documents([document])
+        doc_id = None
+        if isinstance(result, list) and result:
+            # Many vector stores return a list of inserted IDs
+            doc_id = result[0]
+
+        print(
+            f"✅ Added document '{metadata['fileName']}' ({len(text)} chars) "
+            "to vector store."
+        )
+        return doc_id
+    except Exception as e:
+        print(f"❌ Error adding document to vector store: {e}")
+        return None
+
+
+def fit_token_limit(chunks, max_tokens: int = EMBEDDING_MAX_TOKENS):
+    """
+    Yield `chunks` with every one guaranteed to fit the embedding model's
+    per-input limit, counting each chunk's tokens exactly once.
+
+    The count is stored as `tokenCount` metadata, where batching picks it up
+    instead of counting again. A chunk over `max_tokens` (by
+    `token_upper_bound`) is re-split, measuring pieces by that same upper
+    bound, into pieces carrying copies of its metadata, so no request is
+    ever sent that the API would reject for length.
+    """
+    splitter = None
+    for chunk in chunks:
+        text = chunk.page_content
+        count, bound = token_count_and_bound(text)
+        if bound <= max_tokens:
+            chunk.metadata = dict(chunk.metadata or {}, tokenCount=count)
+            yield chunk
+            continue
+        if splitter is None:
+            splitter = RecursiveCharacterTextSplitter(
+                chunk_size=min(CHUNK_TOKEN_BUDGET, max_tokens),
+                chunk_overlap=0,
+                length_function=token_upper_bound,
+            )
+        for piece in splitter.split_text(text):
+            yield Document(
+                page_content=piece,
+                metadata=dict(
+                    chunk.metadata or {}, tokenCount=count_tokens(piece)
+                ),
+            )
+
+
+def batch_chunks_by_tokens(
+    chunks,
+    max_tokens: int = EMBED_BATCH_MAX_TOKENS,
+    max_items: int = EMBED_BATCH_MAX_ITEMS,
+):
+    """
+    Group `chunks` into consecutive batches whose token total stays under
+    `max_tokens` and whose size stays under `max_items`. A chunk's
+    `tokenCount` metadata (see `fit_token_limit`) is used when present.
+
+    This is a generator and accepts any iterable, so a streamed chunk source
+    is only ever buffered one batch at a time. Order is preserved. A single
+    chunk bigger than the budget still gets its own batch so the embedding
+    call can report the problem for that chunk.
+    """
+    current = []
+    current_tokens = 0
+    for chunk in chunks:
+        meta = getattr(chunk, "metadata", None) or {}
+        tokens = meta.get("tokenCount") or count_tokens(
+            getattr(chunk, "page_content", "") or ""
+        )
+        if current and (
+            current_tokens + tokens > max_tokens or len(current) >= max_items
+        ):
+            yield current
+            current = []
+            current_tokens = 0
+        current.append(chunk)
+        current_tokens += tokens
+    if current:
+        yield current
+
+
+def _store_chunk(vector_store, chunk, idx: int, total, file_path: str) -> bool:
+    """Add one chunk to `vector_store`, printing any error. Returns success."""
+    file_base = os.path.basename(file_path)
+    of_total = f"/{total}" if total else ""
+    try:
+        vector_store.add_documents([chunk])
+        print(f"Stored chunk {idx}{of_total} for '{file_base}'.")
+        return True
+    except FileNotFoundError:
+        print(
+            f"❌ File not found when storing chunk {idx}{of_total}: "
+            f"{file_path}"
+        )
+    except Exception as e:
+        print(f"❌ Error storing chunk {idx}{of_total}: {e}")
+    return False
+
+
+def _with_chunk_metadata(chunks, file_base: str, total):
+    """Stamp fileName/source/createdAt/chunkIndex/contentHash metadata.
+
+    Chunks are updated as they stream by.
+    """
+    for idx, chunk in enumerate(chunks, start=1):
+        meta = getattr(chunk, "metadata", None)
+        if meta is None:
+            meta = {}
+            chunk.metadata = meta
+
+        meta.update(
+            {
+                "fileName": (
+                    f"{file_base} (Chunk {idx}/{total})"
+                    if total
+                    else f"{file_base} (Chunk {idx})"
+                ),
+                "source": file_base,
+                "createdAt": datetime.now().isoformat(),
+                "chunkIndex": idx,
+                "contentHash": content_hash(chunk.page_content),
+            }
+        )
+        if "tokenCount" not in meta:
+            meta["tokenCount"] = count_tokens(chunk.page_content)
+        yield chunk
+
+
+def load_document_with_chunks(
+    vector_store,
+    file_path: str,
+    chunks,
+    batched: bool = True,
+    max_batch_tokens: int = EMBED_BATCH_MAX_TOKENS,
+    max_batch_items: int = EMBED_BATCH_MAX_ITEMS,
+    stamp_metadata: bool = True,
+    dedupe: bool = INGEST_DEDUP,
+    failed: list = None,
+):
+    """
+    Add pre-split LangChain `Document` chunks to the `vector_store`.
+
+    Each chunk's metadata will be updated with fileName (including chunk
+    X/Total), createdAt timestamp, and chunkIndex. Prints progress and returns
+    total stored.
+
+    `chunks` may be a list or any iterable, including a generator from the
+    `iter_*_chunks` functions. A generator is consumed lazily: chunks are
+    embedded and stored batch by batch as they are produced, so only one
+    batch is held in memory at a time. The total is unknown up front in that
+    case, so fileName reads "(Chunk X)" instead of "(Chunk X/Total)".
+
+    With `batched=True` (the default) chunks are grouped into token-budgeted
+    batches and each batch is stored with one `add_documents` call, i.e. one
+    embedding request instead of one per chunk. If a batch fails, its chunks
+    are retried one by one so a single bad chunk does not sink its neighbours.
+    Throughput (chunks/sec) and the number of embedding requests are printed.
+    An `MmapVectorStore` also adds every stored batch to its BM25 inverted
+    index, so lexical search is ready as soon as ingest finishes.
+
+    Chunks pass through `fit_token_limit` first, so oversize chunks are
+    split before embedding rather than rejected by the API.
+
+    Pass `stamp_metadata=False` when the caller has already stamped (and
+    fitted) the chunks (e.g. `reindex_document`, which stores only a subset
+    of them).
+
+    With `dedupe=True` (INGEST_DEDUP, the default) chunks that are
+    near-duplicates (SimHash, see `drop_near_duplicates`) of a chunk already
+    in the store or earlier in this file are skipped before embedding (and
+    recorded in their twin's `alsoIn` if it came from another file); the
+    number collapsed is printed. A skipped chunk is offered again by the
+    next `reindex_document` run, so it comes back if its twin is removed.
+
+    The ids of chunks that could not be stored are appended to `failed`
+    when a list is passed.
+    """
+    failed = failed if failed is not None else []
+    total = (
+        len(chunks) if stamp_metadata and hasattr(chunks, "__len__") else None
+    )
+    of_total = f"/{total}" if total else ""
+    file_base = os.path.basename(file_path)
+    stored = 0
+    requests_made = 0
+    started = time.perf_counter()
+
+    if stamp_metadata:
+        chunks = fit_token_limit(chunks)
+        if total is not None:
+            chunks = list(chunks)
+            total = len(chunks)
+            of_total = f"/{total}"
+        chunks = _with_chunk_metadata(chunks, file_base, total)
+    offered = {"count": 0}
+    chunks = _counted(chunks, offered)
+    collapsed = {"count": 0, "merged": 0, "examples": []}
+    if dedupe:
+        chunks = drop_near_duplicates(chunks, vector_store, collapsed)
+    batches = batch_chunks_by_tokens(
+        chunks,
+        max_tokens=max_batch_tokens,
+        max_items=max_batch_items if batched else 1,
+    )
+    with trace_span("ingest.file", file=file_base) as file_span:
+        for batch_no, batch in enumerate(batches, start=1):
+            first = batch[0].metadata["chunkIndex"]
+            last = batch[-1].metadata["chunkIndex"]
+            with trace_span("ingest.batch", chunks=len(batch)) as span:
+                if TRACER.enabled:
+                    span.set(
+                        tokens=sum(
+                            c.metadata.get("tokenCount", 0) for c in batch
+                        )
+                    )
+                if not batched:
+                    requests_made += 1
+                    if _store_chunk(
+                        vector_store, batch[0], first, total, file_path
+                    ):
+                        stored += 1
+                    else:
+                        failed.append(batch[0].id)
+                    continue
+                try:
+                    requests_made += 1
+                    vector_store.add_documents(batch)
+                    stored += len(batch)
+                    print(
+                        f"Stored chunks {first}-{last}{of_total} for "
+                        f"'{file_base}' (batch {batch_no})."
+                    )
+                except Exception as e:
+                    print(
+                        f"⚠️ Batch {batch_no} failed ({e}); retrying its "
+                        "chunks one by one."
+                    )
+                    span.set(retried=True)
+                    for chunk in batch:
+                        requests_made += 1
+                        if _store_chunk(
+                            vector_store,
+                            chunk,
+                            chunk.metadata["chunkIndex"],
+                            total,
+                            file_path,
+                        ):
+                            stored += 1
+                        else:
+                            failed.append(chunk.id)
+        file_span.set(
+            chunks=stored,
+            requests=requests_made,
+            duplicates=collapsed["count"],
+        )
+
+    elapsed = time.perf_counter() - started
+    rate = stored / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Ingested {stored}/{offered['count']} chunks for '{file_base}' in "
+        f"{elapsed:.2f}s ({rate:.1f} chunks/sec, {requests_made} embedding "
+        "requests)."
+    )
+    if collapsed["count"]:
+        examples = "; ".join(
+            f"{skipped} ~ {kept}" for skipped, kept in collapsed["examples"]
+        )
+        print(
+            f"Collapsed {collapsed['count']} near-duplicate chunks for "
+            f"'{file_base}' before embedding ({collapsed['merged']} kept "
+            f"as alsoIn of another file; e.g. {examples})."
+        )
+    return stored
+
+
+def _counted(chunks, counter: dict):
+    """Yield `chunks`, counting them in `counter["count"]`."""
+    for chunk in chunks:
+        counter["count"] += 1
+        yield chunk
+
+
+def _open_text(file_path: str):
+    """Open `file_path` for streaming; print the error and return None."""
+    try:
+        return open(file_path, "r", encoding="utf-8")
+    except FileNotFoundError:
+        print(f"❌ File not found: {file_path}")
+    except Exception as e:
+        print(f"❌ Error reading file {file_path}: {e}")
+    return None
+
+
+def load_with_fixed_size_chunking(vector_store, file_path: str):
+    """
+    Stream `file_path` through fixed-size chunking (`CharacterTextSplitter`)
+    and store the chunks via `load_document_with_chunks` as they are
+    produced. Prints chunk statistics and returns number stored.
+    """
+    f = _open_text(file_path)
+    if f is None:
+        return 0
+
+    stats = ChunkStats()
+    try:
+        with f:
+            stored = load_document_with_chunks(
+                vector_store, file_path, stats.track(iter_fixed_size_chunks(f))
+            )
+    except Exception as e:
+        print(f"❌ Error reading file {file_path}: {e}")
+        return 0
+
+    print(
+        f"Created {stats.count} chunks (avg size: {stats.average:.1f} "
+        f"chars) for '{os.path.basename(file_path)}'."
+    )
+    return stored
+
+
+def load_with_paragraph_chunking(vector_store, file_path: str):
+    """
+    Stream `file_path` through paragraph-preserving chunking
+    (`RecursiveCharacterTextSplitter`), store the chunks as they are
+    produced, print chunk statistics, and return number stored.
+    """
+    f = _open_text(file_path)
+    if f is None:
+        return 0
+
+    stats = ChunkStats()
+    try:
+        with f:
+            stored = load_document_with_chunks(
+                vector_store, file_path, stats.track(iter_paragraph_chunks(f))
+            )
+    except Exception as e:
+        print(f"❌ Error reading file {file_path}: {e}")
+        return 0
+
+    print("=== Paragraph Chunking ===")
+    print(
+        f"Paragraph chunking: total={stats.count}, "
+        f"smallest={stats.smallest}, largest={stats.largest}, "
+        f"starts_with_newline={stats.starts_with_newline}"
+    )
+    return stored
+
+
+def load_with_markdown_header_chunking(vector_store, file_path: str):
+    """
+    Stream the markdown file section by section (split on `#`/`##` headers),
+    apply `RecursiveCharacterTextSplitter` with overlap to each section, and
+    store the chunks via `load_document_with_chunks` as they are produced.
+    Returns the number stored.
+    """
+    f = _open_text(file_path)
+    if f is None:
+        return 0
+
+    stats = ChunkStats()
+    try:
+        with f:
+            stored = load_document_with_chunks(
+                vector_store,
+                file_path,
+                stats.track(iter_markdown_header_chunks(f)),
+            )
+    except Exception as e:
+        print(f"❌ Error reading file {file_path}: {e}")
+        return 0
+
+    print("=== Markdown-Header Chunking ===")
+    print(f"Total chunks created: {stats.count}")
+    print(
+        f"Smallest chunk: {stats.smallest} chars, "
+        f"Largest chunk: {stats.largest} chars"
+    )
+    return stored
+
+
+def load_with_hierarchical_chunking(vector_store, file_path: str):
+    """
+    Read `file_path` once and build both chunk levels from that one pass
+    (`iter_hierarchical_chunks`): section chunks are registered with the
+    store as parents, and only their passages are embedded and stored via
+    `load_document_with_chunks`. Searches on the store then match passages
+    and return their sections. Prints statistics for both levels and
+    returns the number of passages stored.
+    """
+    f = _open_text(file_path)
+    if f is None:
+        return 0
+
+    file_base = os.path.basename(file_path)
+    sections = ChunkStats()
+    passages = ChunkStats()
+    try:
+        with f:
+            chunks = iter_hierarchical_chunks(
+                f, file_base, markdown=file_path.lower().endswith(".md")
+            )
+            stored = load_document_with_chunks(
+                vector_store,
+                file_path,
+                passages.track(
+                    register_parent_sections(vector_store, chunks, sections)
+                ),
+            )
+    except Exception as e:
+        print(f"❌ Error reading file {file_path}: {e}")
+        return 0
+
+    print("=== Hierarchical Chunking ===")
+    print(
+        f"Sections: total={sections.count}, "
+        f"avg={sections.average:.1f} chars, largest={sections.largest}"
+    )
+    print(
+        f"Passages: total={passages.count}, "
+        f"avg={passages.average:.1f} chars, largest={passages.largest}"
+    )
+    return stored
+
+
+def iter_stored_documents(vector_store):
+    """Yield every `Document` held by an `MmapVectorStore` or memory store."""
+    if hasattr(vector_store, "iter_documents"):
+        yield from vector_store.iter_documents()
+    elif hasattr(vector_store, "store"):
+        for entry in list(vector_store.store.values()):
+            yield Document(
+                id=entry["id"],
+                page_content=entry["text"],
+                metadata=entry["metadata"],
+            )
+    else:
+        raise TypeError(
+            f"Cannot list documents in {type(vector_store).__name__}"
+        )
+
+
+def update_stored_metadata(vector_store, doc_id, metadata: dict):
+    """Overwrite the metadata of a stored document without re-embedding it."""
+    if hasattr(vector_store, "update_metadata"):
+        vector_store.update_metadata(doc_id, metadata)
+    elif hasattr(vector_store, "store"):
+        vector_store.store[doc_id]["metadata"] = dict(metadata)
+
+
+def source_of(meta: dict) -> str:
+    """Return the source file a stored chunk came from.
+
+    Also works for chunks stored before `source` metadata existed.
+    """
+    if meta.get("source"):
+        return meta["source"]
+    # Older entries only carry fileName: "<file>" or "<file> (Chunk X/Total)".
+    return meta.get("fileName", "").split(" (Chunk ")[0]
+
+
+def stored_documents_by_source(vector_store) -> dict:
+    """Group every stored document as {source file: {id: Document}}."""
+    grouped = {}
+    for doc in iter_stored_documents(vector_store):
+        grouped.setdefault(source_of(doc.metadata), {})[doc.id] = doc
+    return grouped
+
+
+def drop_also_in(vector_store, source: str) -> int:
+    """
+    Remove the `alsoIn` entries naming `source` from every stored chunk
+    (see `drop_near_duplicates`), e.g. before `source` is re-indexed, which
+    records the near-duplicates it still has again. Returns how many chunks
+    changed.
+    """
+    filters = getattr(vector_store, "filters", None)
+    if filters is not None:
+        # Chunks naming `source` in `alsoIn` are in its source posting.
+        docs = vector_store.get_by_ids(
+            list(filters.postings["source"].get(source, ()))
+        )
+    else:
+        docs = list(iter_stored_documents(vector_store))
+    changed = 0
+    for doc in docs:
+        also_in = doc.metadata.get("alsoIn")
+        if not also_in:
+            continue
+        kept = [entry for entry in also_in if entry.get("source") != source]
+        if len(kept) == len(also_in):
+            continue
+        meta = dict(doc.metadata)
+        if kept:
+            meta["alsoIn"] = kept
+        else:
+            del meta["alsoIn"]
+        update_stored_metadata(vector_store, doc.id, meta)
+        changed += 1
+    return changed
+
+
+def plan_reindex(vector_store, source: str, chunks, existing: dict = None):
+    """
+    Diff the current `chunks` of `source` against what `vector_store` holds.
+
+    Every chunk gets a deterministic id derived from its source file, header
+    path and content hash (`contentHash` metadata), so an unchanged chunk
+    maps to the id it already has in the store. Unchanged chunks get their
+    position metadata refreshed; the new or changed chunks still need
+    embedding and are returned together with a summary dict and the list
+    of stale ids. Stale ids are left in the store, so the document stays
+    searchable if embedding its new chunks fails; the caller deletes them
+    once the new chunks are stored. They are only taken out of the store's
+    near-duplicate index, so an edited chunk is not collapsed into the
+    version it replaces. `existing` ({id: Document} already stored for
+    `source`) can be passed in to avoid rescanning the store.
+
+    Other chunks' `alsoIn` entries for `source` are dropped
+    (`drop_also_in`); deduplicating the returned chunks records the ones
+    that still hold. Unchanged chunks keep their own `alsoIn`.
+    """
+    chunks = list(fit_token_limit(chunks))
+    chunks = list(_with_chunk_metadata(chunks, source, len(chunks)))
+
+    # Deterministic ids; identical chunks under the same header get an
+    # occurrence suffix so they stay distinct.
+    seen = {}
+    for chunk in chunks:
+        key = content_hash(
+            f"{source}\n{chunk.metadata.get('headerPath', '')}\n"
+            f"{chunk.page_content}"
+        )
+        seen[key] = seen.get(key, 0) + 1
+        chunk.id = (
+            f"{source}:{key}"
+            if seen[key] == 1
+            else f"{source}:{key}#{seen[key]}"
+        )
+
+    if existing is None:
+        existing = stored_documents_by_source(vector_store).get(source, {})
+    wanted = {chunk.id for chunk in chunks}
+
+    stale = [doc_id for doc_id in existing if doc_id not in wanted]
+    near_duplicates = getattr(vector_store, "near_duplicates", None)
+    if stale and near_duplicates is not None:
+        near_duplicates.remove(stale)
+    drop_also_in(vector_store, source)
+
+    summary = {"added": 0, "removed": len(stale), "unchanged": 0}
+    fresh = []
+    for chunk in chunks:
+        if chunk.id in existing:
+            # Keep the original createdAt and the other files merged into
+            # it; refresh where the chunk now sits.
+            meta = dict(chunk.metadata)
+            meta["createdAt"] = existing[chunk.id].metadata.get(
+                "createdAt", meta["createdAt"]
+            )
+            # Read from the store: `existing` may predate merges made since.
+            current = vector_store.get_by_ids([chunk.id])
+            if current and current[0].metadata.get("alsoIn"):
+                meta["alsoIn"] = current[0].metadata["alsoIn"]
+            update_stored_metadata(vector_store, chunk.id, meta)
+            summary["unchanged"] += 1
+        else:
+            fresh.append(chunk)
+    return fresh, summary, stale
+
+
+def reindex_document(
+    vector_store,
+    file_path: str,
+    chunks=None,
+    hierarchical: bool = HIERARCHICAL_CHUNKS,
+) -> dict:
+    """
+    Bring `vector_store` up to date with the current contents of `file_path`,
+    embedding only the chunks that are new or changed (see `plan_reindex`).
+
+    New ids are embedded and added, unchanged chunks only get their
+    position metadata (`chunkIndex`/`fileName`) refreshed, and ids that are
+    no longer produced are deleted once every new chunk is stored (this
+    also clears out chunks stored by the non-versioned loaders, which are
+    recognised by their `fileName`). If some new chunks cannot be stored
+    the stale ones are kept, so the file never drops out of the store; the
+    next run retries.
+
+    `chunks` defaults to markdown-header chunking of the file, or with
+    `hierarchical` to its passages, whose parent sections are registered
+    with the store (`iter_hierarchical_chunks`). Prints and returns a
+    summary dict with added/removed/unchanged counts.
+    """
+    file_base = os.path.basename(file_path)
+    if chunks is None:
+        f = _open_text(file_path)
+        if f is None:
+            return {"added": 0, "removed": 0, "unchanged": 0}
+        with f:
+            if hierarchical:
+                chunks = list(
+                    register_parent_sections(
+                        vector_store, iter_hierarchical_chunks(f, file_base)
+                    )
+                )
+            else:
+                chunks = list(iter_markdown_header_chunks(f))
+
+    fresh, summary, stale = plan_reindex(vector_store, file_base, chunks)
+    failed = []
+    if fresh:
+        summary["added"] = load_document_with_chunks(
+            vector_store, file_path, fresh, stamp_metadata=False, failed=failed
+        )
+    if failed:
+        print(
+            f"⚠️ Kept {len(stale)} old chunks of '{file_base}': "
+            f"{len(failed)} new chunks could not be stored."
+        )
+        summary["removed"] = 0
+    elif stale:
+        vector_store.delete(stale)
+
+    print(
+        f"♻️ Re-indexed '{file_base}': {summary['added']} added, "
+        f"{summary['removed']} removed, {summary['unchanged']} unchanged."
+    )
+    return summary
+
+
+# Directory ingest settings: INGEST_DIR (optional) is a folder of .md/.txt
+# files loaded alongside the bundled documents; INGEST_WORKERS caps the
+# process pool that reads and splits files; INGEST_EMBED_CONCURRENCY caps
+# how many embedding requests are in flight at once.
+INGEST_DIR = os.getenv("INGEST_DIR", "")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0")) or None
+INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+INGEST_EXTENSIONS = (".md", ".txt")
+# Files from INGEST_DIR are stored under "dir:<path relative to the
+# directory>", so they never collide with the bundled documents (which use
+# their bare file names) and the directory's files can be told apart from
+# everything else in the store.
+DIR_SOURCE_PREFIX = "dir:"
+
+
+def list_ingest_files(dir_path: str) -> list:
+    """Return every .md/.txt file under `dir_path`, in a stable order."""
+    found = []
+    for root, dirs, files in os.walk(dir_path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(INGEST_EXTENSIONS):
+                found.append(os.path.join(root, name))
+    return found
+
+
+def directory_source(dir_path: str, file_path: str) -> str:
+    """The `source` of `file_path` ingested from directory `dir_path`."""
+    relative = os.path.relpath(file_path, dir_path).replace(os.sep, "/")
+    return DIR_SOURCE_PREFIX + relative
+
+
+def _read_and_split_file(file_path: str, source: str = None):
+    """
+    Worker-process task: read and split one file.
+
+    Markdown files use header-aware chunking, everything else token-aware
+    paragraph chunking; with HIERARCHICAL_CHUNKS the sections (ids derived
+    from `source`) are followed by their passages. Returns (list of (id,
+    text, metadata), error message or None); plain tuples keep the result
+    cheap to pickle back to the parent.
+    """
+    markdown = file_path.lower().endswith(".md")
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            if HIERARCHICAL_CHUNKS:
+                chunks = iter_hierarchical_chunks(
+                    f, source or os.path.basename(file_path), markdown=markdown
+                )
+            else:
+                chunks = (
+                    iter_markdown_header_chunks(f)
+                    if markdown
+                    else iter_token_chunks(f)
+                )
+            return [(c.id, c.page_content, c.metadata) for c in chunks], None
+    except Exception as e:
+        return [], str(e)
+
+
+def _is_rate_limit_error(error: Exception) -> bool:
+    text = str(error).lower()
+    return (
+        "429" in text
+        or "rate limit" in text
+        or "ratelimit" in type(error).__name__.lower()
+    )
+
+
+def embed_with_backoff(
+    embeddings, texts: list, max_retries: int = 5, base_delay: float = 1.0
+) -> list:
+    """
+    Call `embeddings.embed_documents(texts)` (or `embed_matrix` when the
+    backend has one), retrying rate-limit errors with
+    exponential backoff plus jitter (so parallel workers don't retry in
+    lockstep). Other errors are raised immediately.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            embed_matrix = getattr(embeddings, "embed_matrix", None)
+            return (
+                embed_matrix(texts)
+                if embed_matrix
+                else embeddings.embed_documents(texts)
+            )
+        except Exception as e:
+            if attempt == max_retries or not _is_rate_limit_error(e):
+                raise
+            delay = base_delay * (2 ** attempt) * (0.5 + random.random() / 2)
+            print(
+                f"⏳ Rate limited; retrying in {delay:.1f}s "
+                f"(attempt {attempt + 1}/{max_retries})."
+            )
+            time.sleep(delay)
+
+
+def add_with_vectors(vector_store, chunks: list, vectors: list) -> list:
+    """
+    Store `chunks` with already-computed `vectors`. Stores without an
+    `add_vectors` method fall back to `add_documents`, which re-embeds (a
+    `CachedEmbeddings` wrapper turns that into cache hits).
+    """
+    if hasattr(vector_store, "add_vectors"):
+        return vector_store.add_vectors(
+            [c.page_content for c in chunks], vectors,
+            metadatas=[c.metadata for c in chunks], ids=[c.id for c in chunks],
+        )
+    return vector_store.add_documents(chunks)
+
+
+def ingest_directory(
+    vector_store,
+    dir_path: str,
+    max_workers: int = INGEST_WORKERS,
+    embed_concurrency: int = INGEST_EMBED_CONCURRENCY,
+    max_batch_tokens: int = EMBED_BATCH_MAX_TOKENS,
+    max_batch_items: int = EMBED_BATCH_MAX_ITEMS,
+) -> dict:
+    """
+    Ingest every .md/.txt file under `dir_path` into `vector_store`.
+
+    Pipeline:
+      1. Files are read and split in a process pool (`max_workers`), which
+         keeps CPU-bound splitting off the main interpreter.
+      2. Each file's chunks are diffed against the store with
+         `plan_reindex`, so unchanged chunks are never re-embedded, and
+         near-duplicates of stored or earlier chunks are dropped or, from
+         another file, merged into their twin's `alsoIn`
+         (`drop_near_duplicates`, unless INGEST_DEDUP=0).
+      3. New chunks are packed into token-budgeted batches and embedded on a
+         thread pool with at most `embed_concurrency` requests in flight,
+         retrying rate-limit errors with backoff.
+      4. Batches are stored strictly in submission order (file order, then
+         chunk order), so the resulting store is identical from run to run
+         no matter which request finishes first.
+
+    Chunks are stored under `directory_source` names, and the chunks of
+    directory files that no longer exist are deleted, so the store mirrors
+    the directory. A file's stale chunks are deleted only after all its new
+    chunks are stored, as in `reindex_document`. Returns a summary dict
+    with file, chunk and request counts.
+    """
+    files = list_ingest_files(dir_path)
+    sources = [directory_source(dir_path, path) for path in files]
+    existing = stored_documents_by_source(vector_store)
+    summary = {
+        "files": len(files),
+        "added": 0,
+        "removed": 0,
+        "unchanged": 0,
+        "duplicates": 0,
+        "failed": 0,
+        "requests": 0,
+    }
+    # source -> ids its new chunks replace; deleted once they are stored.
+    stale_ids = {}
+    failed_sources = set()
+    current = set(sources)
+    for source, docs in existing.items():
+        if source.startswith(DIR_SOURCE_PREFIX) and source not in current:
+            vector_store.delete(list(docs))
+            drop_also_in(vector_store, source)
+            summary["removed"] += len(docs)
+            print(f"Removed '{source}': no longer in '{dir_path}'.")
+    if not files:
+        print(f"No .md/.txt files found in '{dir_path}'.")
+        return summary
+
+    with trace_span("ingest.directory", files=len(files)) as dir_span:
+        print(f"=== Ingesting {len(files)} files from '{dir_path}' ===")
+        started = time.perf_counter()
+        embeddings = vector_store.embeddings
+
+        def fresh_chunks(split_results):
+            # Runs on the main thread, interleaved with storing, so the store
+            # is only ever touched from one thread.
+            for path, source, (pieces, error) in zip(
+                files, sources, split_results
+            ):
+                if error:
+                    print(f"❌ Error reading file {path}: {error}")
+                    summary["failed"] += 1
+                    continue
+                chunks = [
+                    Document(id=doc_id, page_content=text, metadata=dict(meta))
+                    for doc_id, text, meta in pieces
+                ]
+                chunks = list(register_parent_sections(vector_store, chunks))
+                fresh, file_summary, stale = plan_reindex(
+                    vector_store, source, chunks, existing.get(source, {})
+                )
+                stale_ids[source] = stale
+                summary["unchanged"] += file_summary["unchanged"]
+                print(
+                    f"Split '{source}': {len(chunks)} chunks, "
+                    f"{len(fresh)} to embed."
+                )
+                yield from fresh
+
+        with ProcessPoolExecutor(
+            max_workers=max_workers
+        ) as processes, ThreadPoolExecutor(
+            max_workers=embed_concurrency
+        ) as threads:
+            chunks = fresh_chunks(
+                processes.map(_read_and_split_file, files, sources)
+            )
+            collapsed = {"count": 0, "merged": 0, "examples": []}
+            if INGEST_DEDUP:
+                chunks = drop_near_duplicates(chunks, vector_store, collapsed)
+            batches = batch_chunks_by_tokens(
+                chunks, max_tokens=max_batch_tokens, max_items=max_batch_items
+            )
+            in_flight = deque()
+
+            def store_oldest():
+                batch, future = in_flight.popleft()
+                try:
+                    add_with_vectors(vector_store, batch, future.result())
+                    summary["added"] += len(batch)
+                except Exception as e:
+                    print(
+                        f"❌ Error embedding batch of {len(batch)} chunks: "
+                        f"{e}"
+                    )
+                    summary["failed"] += len(batch)
+                    failed_sources.update(
+                        c.metadata.get("source") for c in batch
+                    )
+
+            for batch in batches:
+                summary["requests"] += 1
+                in_flight.append(
+                    (
+                        batch,
+                        threads.submit(
+                            contextvars.copy_context().run,
+                            embed_with_backoff,
+                            embeddings,
+                            [c.page_content for c in batch],
+                        ),
+                    )
+                )
+                # Bounded window: never more than `embed_concurrency` requests
+                # (and their vectors) outstanding.
+                while len(in_flight) >= embed_concurrency:
+                    store_oldest()
+            while in_flight:
+                store_oldest()
+            summary["duplicates"] = collapsed["count"]
+        for source, stale in stale_ids.items():
+            if source in failed_sources:
+                print(
+                    f"⚠️ Kept the old chunks of '{source}': some new "
+                    "chunks could not be stored."
+                )
+            elif stale:
+                vector_store.delete(stale)
+                summary["removed"] += len(stale)
+        dir_span.set(chunks=summary["added"], requests=summary["requests"])
+
+    elapsed = time.perf_counter() - started
+    rate = summary["added"] / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Ingested '{dir_path}': {summary['added']} added, "
+        f"{summary['removed']} removed, {summary['unchanged']} unchanged, "
+        f"{summary['duplicates']} near-duplicates skipped, "
+        f"{summary['failed']} failed in {elapsed:.2f}s ({rate:.1f} "
+        f"chunks/sec, {summary['requests']} embedding requests)."
+    )
+    return summary
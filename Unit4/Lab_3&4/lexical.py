@@ -0,0 +1,140 @@
+"""
+Lexical retrieval: BM25 over an inverted index, and rank fusion.
+"""
+import heapq
+import math
+import os
+import re
+
+
+# Terms: section numbers ("5.3"), words with a parenthesised suffix
+# ("401(k)") and plain alphanumeric words, all matched case-insensitively.
+LEXICAL_TOKEN_RE = re.compile(r"\d+(?:\.\d+)+|\w+\(\w+\)|\w+")
+# Queries of at most this many terms that contain an exact-match term
+# (acronym, number, "401(k)") skip the embedding call entirely.
+KEYWORD_QUERY_MAX_TERMS = int(os.getenv("KEYWORD_QUERY_MAX_TERMS", "3"))
+# Question words and function words that do not count towards
+# KEYWORD_QUERY_MAX_TERMS, so "What is the PTO policy?" counts two terms.
+KEYWORD_QUERY_STOP_WORDS = frozenset(
+    """
+    a about am an and any are as at be can could did do does for from get
+    has have how i if in into is many me much my of on or our should
+    tell that the their there these this those to was we were what when
+    where which who why will with would you your
+    """.split()
+)
+
+
+def lexical_tokens(text: str) -> list:
+    """Lower-cased BM25 terms of `text`."""
+    return LEXICAL_TOKEN_RE.findall(text.lower())
+
+
+def is_keyword_query(query: str) -> bool:
+    """
+    True for short queries that name an exact term, such as "FMLA",
+    "401(k)" or "section 5.3": lexical search answers those better than
+    embeddings, and without an API call. Stop-words are not counted.
+    """
+    words = [
+        w
+        for w in LEXICAL_TOKEN_RE.findall(query)
+        if w.lower() not in KEYWORD_QUERY_STOP_WORDS
+    ]
+    if not words or len(words) > KEYWORD_QUERY_MAX_TERMS:
+        return False
+    return any(
+        any(c.isdigit() for c in w) or "(" in w or (len(w) > 1 and w.isupper())
+        for w in words
+    )
+
+
+class BM25Index:
+    """
+    Inverted index with Okapi BM25 scoring, updated incrementally.
+
+    `postings` maps each term to {doc id: term frequency}; only the
+    postings of the query's terms are touched at search time, so a lookup
+    costs O(matching postings), not O(corpus).
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        # id -> (term counts, document length)
+        self._docs = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, ids: list, texts: list):
+        """Index `texts` under `ids`, replacing earlier entries for an id."""
+        self.remove([i for i in ids if i in self._docs])
+        for doc_id, text in zip(ids, texts):
+            terms = lexical_tokens(text)
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+            self._docs[doc_id] = (counts, len(terms))
+            self._total_length += len(terms)
+
+    def remove(self, ids):
+        for doc_id in ids:
+            entry = self._docs.pop(doc_id, None)
+            if entry is None:
+                continue
+            counts, length = entry
+            self._total_length -= length
+            for term in counts:
+                posting = self.postings[term]
+                del posting[doc_id]
+                if not posting:
+                    del self.postings[term]
+
+    def clear(self):
+        self.postings = {}
+        self._docs = {}
+        self._total_length = 0
+
+    def search(self, query: str, k: int = 4, allowed: set = None) -> list:
+        """
+        Return [(id, BM25 score), ...] for the `k` best-matching documents,
+        only among `allowed` ids when given.
+        """
+        n = len(self._docs)
+        if not n:
+            return []
+        avg_length = self._total_length / n
+        scores = {}
+        for term in set(lexical_tokens(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = self.k1 * (
+                    1 - self.b + self.b * self._docs[doc_id][1] / avg_length
+                )
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (
+                    self.k1 + 1
+                ) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 4, c: int = 60) -> list:
+    """
+    Fuse several ranked [(id, score), ...] lists: each id scores
+    sum(1 / (c + rank)) over the lists it appears in. Returns the top `k`
+    as [(id, fused score), ...].
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (c + rank)
+    return heapq.nlargest(k, fused.items(), key=lambda item: item[1])
@@ -0,0 +1,117 @@
+"""
+Inverted index from chunk metadata values to chunk ids.
+"""
+import re
+
+
+# Metadata fields indexed by `MetadataFilterIndex`. "section" in a filter
+# is shorthand for "headerPath".
+FILTER_FIELDS = ("source", "Header 1", "Header 2", "headerPath")
+FILTER_ALIASES = {"section": "headerPath"}
+
+
+class MetadataFilterIndex:
+    """
+    Inverted index from metadata values to chunk ids, for pre-filtering.
+
+    `postings[field][value]` is the set of ids whose metadata has that
+    value, for each of `fields`. `matching()` resolves a filter such as
+    {"source": "HealthInsuranceBrochure.md"} or {"section": "Benefits"} to
+    the set of matching ids by touching only the postings of the matching
+    values, so vector scoring can be restricted to that subset.
+
+    A filter value matches an indexed value that equals it or contains it
+    as whole words (case-insensitive), so "Benefits" selects "4.
+    Compensation and Benefits" and "1" selects "1. Introduction" and "1.2
+    Scope" but not "10. Travel" or "2.1 Pay". {"contains": value} opts into
+    plain substring matching instead. A list of values matches any of
+    them; several fields must all match.
+
+    A chunk's `alsoIn` entries (near-duplicates from other files merged
+    into it at ingest) are indexed too, so filtering on one of those
+    sources or sections finds the chunk.
+    """
+
+    def __init__(self, fields: tuple = FILTER_FIELDS):
+        self.fields = fields
+        self.postings = {field: {} for field in fields}
+        # id -> [(field, value), ...], for removal
+        self._entries = {}
+
+    def add(self, ids: list, metadatas: list):
+        self.remove([i for i in ids if i in self._entries])
+        for doc_id, meta in zip(ids, metadatas):
+            meta = meta or {}
+            entries = list(
+                dict.fromkeys(
+                    (field, str(where[field]))
+                    for where in [meta, *meta.get("alsoIn", ())]
+                    for field in self.fields
+                    if where.get(field)
+                )
+            )
+            for field, value in entries:
+                self.postings[field].setdefault(value, set()).add(doc_id)
+            self._entries[doc_id] = entries
+
+    def remove(self, ids):
+        for doc_id in ids:
+            for field, value in self._entries.pop(doc_id, ()):
+                posting = self.postings[field].get(value)
+                if posting is not None:
+                    posting.discard(doc_id)
+                    if not posting:
+                        del self.postings[field][value]
+
+    def clear(self):
+        self.postings = {field: {} for field in self.fields}
+        self._entries = {}
+
+    def values(self, field: str) -> list:
+        """The distinct indexed values of `field`, e.g. every source file."""
+        return sorted(self.postings.get(FILTER_ALIASES.get(field, field), {}))
+
+    def matching(self, filters: dict) -> set:
+        """Ids matching every field of `filters`."""
+        result = None
+        for field, wanted in filters.items():
+            field = FILTER_ALIASES.get(field, field)
+            if field not in self.postings:
+                raise ValueError(
+                    f"Cannot filter on '{field}' "
+                    f"(indexed fields: {', '.join(self.fields)})."
+                )
+            matches = _value_matcher(wanted)
+            ids = set()
+            for value, posting in self.postings[field].items():
+                if matches(value):
+                    ids |= posting
+            result = ids if result is None else result & ids
+            if not result:
+                return set()
+        return result if result is not None else set(self._entries)
+
+
+def _as_list(wanted) -> list:
+    return [wanted] if isinstance(wanted, str) else list(wanted)
+
+
+def _value_matcher(wanted):
+    """Predicate on indexed values for one field of a filter."""
+    if isinstance(wanted, dict):
+        if set(wanted) != {"contains"}:
+            raise ValueError(
+                f"Unsupported filter operator(s) {sorted(wanted)} "
+                "(expected 'contains')."
+            )
+        needles = [str(w).lower() for w in _as_list(wanted["contains"])]
+        return lambda value: any(n in value.lower() for n in needles)
+    # Whole words: a needle may not continue a word on either side, nor
+    # follow a "." (so "1" skips "2.1").
+    pattern = re.compile(
+        "|".join(
+            rf"(?<![\w.]){re.escape(str(w))}(?!\w)" for w in _as_list(wanted)
+        ),
+        re.IGNORECASE,
+    )
+    return lambda value: pattern.search(value) is not None
@@ -0,0 +1,190 @@
+"""
+SimHash near-duplicate detection for chunks at ingest time.
+"""
+import hashlib
+import os
+import re
+import uuid
+
+import numpy as np
+
+
+# Near-duplicate detection at ingest: chunks whose 64-bit SimHash is within
+# NEAR_DUP_MAX_DISTANCE bits of an already stored (or already seen) chunk
+# are skipped before embedding; one from another source is recorded in the
+# kept chunk's `alsoIn` metadata. Chunks shorter than NEAR_DUP_MIN_WORDS
+# words are always kept. INGEST_DEDUP=0 turns it off.
+INGEST_DEDUP = os.getenv("INGEST_DEDUP", "1") != "0"
+NEAR_DUP_MAX_DISTANCE = int(os.getenv("NEAR_DUP_MAX_DISTANCE", "6"))
+NEAR_DUP_MIN_WORDS = 8
+NEAR_DUP_SHINGLE = 3
+NEAR_DUP_WORD_RE = re.compile(r"\w+")
+
+
+def simhash(text: str, shingle: int = NEAR_DUP_SHINGLE):
+    """
+    64-bit SimHash of the word `shingle`-grams of `text`, or None for texts
+    shorter than NEAR_DUP_MIN_WORDS words. Texts differing in a word or two
+    get fingerprints a few bits apart.
+    """
+    words = NEAR_DUP_WORD_RE.findall(text.lower())
+    if len(words) < NEAR_DUP_MIN_WORDS:
+        return None
+    grams = [
+        " ".join(words[i : i + shingle])
+        for i in range(len(words) - shingle + 1)
+    ]
+    hashes = np.fromiter(
+        (
+            int.from_bytes(
+                hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(),
+                "little",
+            )
+            for g in grams
+        ),
+        dtype=np.uint64,
+        count=len(grams),
+    )
+    # Each bit of the fingerprint is the majority vote of that bit over all
+    # shingle hashes.
+    bits = np.unpackbits(hashes.view(np.uint8)).reshape(-1, 64)
+    return int.from_bytes(
+        np.packbits(2 * bits.sum(axis=0) > len(grams)).tobytes(), "big"
+    )
+
+
+class NearDuplicateIndex:
+    """
+    SimHash fingerprints of stored chunks with a banded lookup table.
+
+    The 64 bits are cut into `max_distance + 1` bands; two fingerprints at
+    most `max_distance` bits apart must agree exactly on at least one band
+    (pigeonhole), so `find()` only compares against ids sharing a band
+    value rather than against every stored chunk.
+    """
+
+    def __init__(self, max_distance: int = NEAR_DUP_MAX_DISTANCE):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        self._bands = [
+            (64 * i // bands, 64 * (i + 1) // bands) for i in range(bands)
+        ]
+        self.tables = [{} for _ in self._bands]
+        self._fingerprints = {}
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def _keys(self, fingerprint: int):
+        for band, (lo, hi) in enumerate(self._bands):
+            yield band, (fingerprint >> lo) & ((1 << (hi - lo)) - 1)
+
+    def add(self, doc_id, fingerprint: int):
+        if fingerprint is None:
+            return
+        self.remove([doc_id])
+        self._fingerprints[doc_id] = fingerprint
+        for band, key in self._keys(fingerprint):
+            self.tables[band].setdefault(key, set()).add(doc_id)
+
+    def add_texts(self, ids: list, texts: list):
+        for doc_id, text in zip(ids, texts):
+            self.add(doc_id, simhash(text))
+
+    def remove(self, ids):
+        for doc_id in ids:
+            fingerprint = self._fingerprints.pop(doc_id, None)
+            if fingerprint is None:
+                continue
+            for band, key in self._keys(fingerprint):
+                bucket = self.tables[band].get(key)
+                if bucket is not None:
+                    bucket.discard(doc_id)
+                    if not bucket:
+                        del self.tables[band][key]
+
+    def clear(self):
+        self.tables = [{} for _ in self._bands]
+        self._fingerprints = {}
+
+    def find(self, fingerprint: int):
+        """A chunk id within `max_distance` bits of `fingerprint`, or None."""
+        if fingerprint is None:
+            return None
+        for band, key in self._keys(fingerprint):
+            for doc_id in self.tables[band].get(key, ()):
+                if (
+                    bin(self._fingerprints[doc_id] ^ fingerprint).count("1")
+                    <= self.max_distance
+                ):
+                    return doc_id
+        return None
+
+
+def drop_near_duplicates(chunks, vector_store=None, collapsed: dict = None):
+    """
+    Yield the chunks of `chunks` that are not near-duplicates of a chunk
+    already in `vector_store` or of an earlier chunk of the same stream.
+
+    A near-duplicate from the same source as its twin is simply dropped.
+    One from another source is merged instead: its source and headerPath
+    are appended to the kept chunk's `alsoIn` list (through
+    `update_metadata` if the kept chunk is already stored, on the pending
+    chunk otherwise), so source filters and citations still find it.
+    Skipped chunks are counted in `collapsed["count"]` (merged ones also in
+    `collapsed["merged"]`), with `collapsed["examples"]` holding up to five
+    (skipped, kept) fileName pairs for the report.
+
+    Chunks without an id are given one, so a later duplicate can find them
+    in the store.
+    """
+    stored = getattr(vector_store, "near_duplicates", None)
+    seen = NearDuplicateIndex(
+        stored.max_distance if stored is not None else NEAR_DUP_MAX_DISTANCE
+    )
+    # id -> metadata of the chunks yielded so far, which may not be stored
+    # yet when their duplicate turns up.
+    pending = {}
+    collapsed = collapsed if collapsed is not None else {}
+    collapsed.setdefault("count", 0)
+    collapsed.setdefault("merged", 0)
+    collapsed.setdefault("examples", [])
+    for chunk in chunks:
+        if not chunk.id:
+            chunk.id = uuid.uuid4().hex
+        fingerprint = simhash(chunk.page_content)
+        match = seen.find(fingerprint)
+        if match is None and stored is not None:
+            match = stored.find(fingerprint)
+        if match is None:
+            seen.add(chunk.id, fingerprint)
+            pending[chunk.id] = chunk.metadata
+            yield chunk
+            continue
+
+        found = vector_store.get_by_ids([match]) if vector_store else []
+        kept = found[0].metadata if found else pending[match]
+        collapsed["count"] += 1
+        if len(collapsed["examples"]) < 5:
+            collapsed["examples"].append(
+                (
+                    chunk.metadata.get("fileName", chunk.id),
+                    kept.get("fileName", match),
+                )
+            )
+        source = chunk.metadata.get("source")
+        if not source or source == kept.get("source"):
+            continue
+        collapsed["merged"] += 1
+        entry = {
+            "source": source,
+            "headerPath": chunk.metadata.get("headerPath", ""),
+        }
+        also_in = list(kept.get("alsoIn") or [])
+        if entry in also_in:
+            continue
+        also_in.append(entry)
+        if match in pending:
+            pending[match]["alsoIn"] = also_in
+        if found and hasattr(vector_store, "update_metadata"):
+            vector_store.update_metadata(match, {**kept, "alsoIn": also_in})
@@ -0,0 +1,323 @@
+"""
+Retrieval for the agent: search a store (hybrid, vector or keyword) and
+pack the hits into a cited, token-budgeted prompt context.
+"""
+import asyncio
+import os
+
+from ingest import source_of
+from tokens import count_tokens, truncate_to_tokens
+from tracing import trace_span
+
+
+# "hybrid" fuses BM25 with vector search; "vector" is embeddings only.
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+
+
+def format_search_results(results, score_kind: str = None) -> str:
+    """Format (doc, score) results the way `search_documents` returns them.
+
+    `score_kind` ("RRF", "BM25" or "cosine", see `result_score_kind`)
+    labels the scores, which are not comparable across kinds.
+    """
+    label = f"Score ({score_kind})" if score_kind else "Score"
+    lines = []
+    for idx, item in enumerate(results, start=1):
+        try:
+            doc, score = item
+        except Exception:
+            doc = item[0]
+            score = item[1] if len(item) > 1 else 0.0
+
+        content = getattr(doc, "page_content", None)
+        if content is None:
+            content = getattr(doc, "text", None) or (
+                doc if isinstance(doc, str) else str(doc)
+            )
+
+        lines.append(f"Result {idx} ({label}: {score:.4f}): {content}")
+
+    return "\n\n".join(lines)
+
+
+# Token budget for the retrieved context pasted into the agent prompt, and
+# how many chunks are retrieved to fill it.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2500"))
+CONTEXT_RETRIEVAL_K = int(os.getenv("CONTEXT_RETRIEVAL_K", "4"))
+
+
+def _strip_overlap(previous: str, text: str, max_overlap: int = 2000) -> str:
+    """Drop the prefix of `text` that repeats the end of `previous`.
+
+    That repeated prefix is the text splitter's chunk overlap.
+    """
+    for size in range(min(len(previous), len(text), max_overlap), 0, -1):
+        if previous.endswith(text[:size]):
+            return text[size:]
+    return text
+
+
+def build_context(
+    results,
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    min_block_tokens: int = 100,
+):
+    """
+    Pack (doc, score) search results into a compact, cited prompt context.
+
+    - Chunks with identical text, or text contained in a better-scoring
+      chunk, are dropped.
+    - Chunks that are adjacent (consecutive `chunkIndex`) in the same
+      source file are merged into one block, minus the text the splitter
+      repeated between them as overlap.
+    - Blocks are added best score first until `token_budget` tokens are
+      used; a block that doesn't fit is truncated if at least
+      `min_block_tokens` tokens remain, otherwise skipped.
+
+    Each block is headed by a citation (file, chunk numbers, section, and
+    the other files a near-duplicate was merged from, see `alsoIn`)
+    instead of a raw similarity score. Returns (context text, info) where
+    info has the `context_tokens` used and how many `chunks` were retrieved,
+    `duplicates` dropped, `blocks` emitted and blocks `skipped` for budget.
+    """
+    ranked = sorted(results, key=lambda item: -item[1])
+    kept = []
+    for doc, score in ranked:
+        text = doc.page_content
+        if any(text in other.page_content for other, _ in kept):
+            continue
+        kept.append((doc, score))
+
+    # Merge runs of adjacent chunks of the same file; the run takes the
+    # best score of its members and the position of its best member.
+    runs = []
+    by_source = {}
+    for doc, score in kept:
+        meta = doc.metadata or {}
+        by_source.setdefault(source_of(meta), []).append((doc, score))
+    for source, docs in by_source.items():
+        docs.sort(
+            key=lambda item: (item[0].metadata or {}).get("chunkIndex", 0)
+        )
+        for doc, score in docs:
+            index = (doc.metadata or {}).get("chunkIndex")
+            run = runs[-1] if runs else None
+            if (
+                run
+                and run["source"] == source
+                and index is not None
+                and run["last"] is not None
+                and index == run["last"] + 1
+            ):
+                run["text"] += _strip_overlap(run["text"], doc.page_content)
+                run["last"] = index
+                run["score"] = max(run["score"], score)
+                run["sections"].append(
+                    (doc.metadata or {}).get("headerPath", "")
+                )
+                run["also_in"] += (doc.metadata or {}).get("alsoIn", [])
+            else:
+                runs.append(
+                    {
+                        "source": source,
+                        "first": index,
+                        "last": index,
+                        "score": score,
+                        "text": doc.page_content,
+                        "sections": [
+                            (doc.metadata or {}).get("headerPath", "")
+                        ],
+                        "also_in": list(
+                            (doc.metadata or {}).get("alsoIn", [])
+                        ),
+                    }
+                )
+    runs.sort(key=lambda run: -run["score"])
+
+    blocks = []
+    used = 0
+    for run in runs:
+        if run["first"] is None:
+            where = run["source"] or "document"
+        elif run["first"] == run["last"]:
+            where = f"{run['source']}, chunk {run['first']}"
+        else:
+            where = f"{run['source']}, chunks {run['first']}-{run['last']}"
+        sections = list(
+            dict.fromkeys(section for section in run["sections"] if section)
+        )
+        also_in = list(
+            dict.fromkeys(entry["source"] for entry in run["also_in"])
+        )
+        citation = (
+            f"[{where}"
+            + (f" | {'; '.join(sections)}" if sections else "")
+            + (f" | also in {', '.join(also_in)}" if also_in else "")
+            + "]"
+        )
+        block = f"{citation}\n{run['text'].strip()}"
+        tokens = count_tokens(block)
+        if used + tokens > token_budget:
+            room = token_budget - used
+            if room < min_block_tokens:
+                continue
+            block = truncate_to_tokens(block, room - 1) + "…"
+            tokens = count_tokens(block)
+        blocks.append(block)
+        used += tokens
+    info = {
+        "context_tokens": used,
+        "chunks": len(results),
+        "duplicates": len(results) - len(kept),
+        "blocks": len(blocks),
+        "skipped": len(runs) - len(blocks),
+    }
+    return "\n\n".join(blocks), info
+
+
+# With parent sections in the store, this many passages are scored per
+# requested result, so `k` distinct sections survive the expansion.
+PARENT_FETCH_FACTOR = 4
+
+
+def _passage_fetch_k(vector_store, k: int) -> int:
+    """How many chunks to score for `k` results.
+
+    More are needed when hits are expanded to their parent sections.
+    """
+    return (
+        PARENT_FETCH_FACTOR * k
+        if getattr(vector_store, "parents", None)
+        else k
+    )
+
+
+def _expand_to_parents(vector_store, results: list, k: int) -> list:
+    """Passage hits -> their best `k` parent sections, if the store has any."""
+    if getattr(vector_store, "parents", None):
+        return vector_store.expand_to_parents(results, k)
+    return results
+
+
+def result_score_kind(
+    vector_store, query_vector, mode: str = RETRIEVAL_MODE
+) -> str:
+    """
+    What the scores from `retrieve_with_score` are, given the query vector
+    it returned: "BM25" for the keyword fast path (no vector), "RRF" for
+    fused hybrid search, "cosine" for plain embedding search.
+    """
+    if query_vector is None:
+        return "BM25"
+    if mode == "hybrid" and hasattr(
+        vector_store, "hybrid_search_with_score_by_vector"
+    ):
+        return "RRF"
+    return "cosine"
+
+
+def retrieve_with_score(
+    vector_store,
+    query: str,
+    k: int = 3,
+    mode: str = RETRIEVAL_MODE,
+    filter: dict = None,
+):
+    """
+    Search `vector_store` for `query`. Returns (query vector, [(doc, score)]).
+    `filter` (e.g. {"source": "HealthInsuranceBrochure.md"}) restricts the
+    search to matching chunks before scoring.
+
+    In "hybrid" mode a store with a BM25 index answers keyword-like queries
+    lexically, with no embedding call (the vector is then None), and fuses
+    BM25 with vector search otherwise. "vector" mode, or a store without a
+    lexical index, is plain embedding search.
+
+    When the store keeps parent sections (hierarchical chunking), the
+    search runs on the small passages and each hit is returned as its
+    parent section, one result per section.
+    """
+    hybrid = mode == "hybrid" and hasattr(
+        vector_store, "hybrid_search_with_score_by_vector"
+    )
+    filtered = {"filter": filter} if filter else {}
+    fetch_k = _passage_fetch_k(vector_store, k)
+    with trace_span(
+        "search.retrieve",
+        mode=mode,
+        k=k,
+        filtered=bool(filter),
+        fetch_k=fetch_k,
+    ) as span:
+        if hybrid:
+            results = vector_store.keyword_search(query, fetch_k, **filtered)
+            if results:
+                span.set(keyword_fast_path=True)
+                return None, _expand_to_parents(vector_store, results, k)
+        embed = (
+            getattr(vector_store, "embed_query", None)
+            or vector_store.embeddings.embed_query
+        )
+        vector = embed(query)
+        with trace_span("search.score", hybrid=hybrid):
+            if hybrid:
+                results = vector_store.hybrid_search_with_score_by_vector(
+                    query, vector, fetch_k, **filtered
+                )
+            else:
+                results = vector_store.similarity_search_with_score_by_vector(
+                    vector, k=fetch_k, **filtered
+                )
+        return vector, _expand_to_parents(vector_store, results, k)
+
+
+async def aretrieve_with_score(
+    vector_store,
+    query: str,
+    k: int = 3,
+    mode: str = RETRIEVAL_MODE,
+    filter: dict = None,
+):
+    """Async `retrieve_with_score`.
+
+    The embedding call is awaited; scoring runs on a worker thread.
+    """
+    hybrid = mode == "hybrid" and hasattr(
+        vector_store, "hybrid_search_with_score_by_vector"
+    )
+    filtered = {"filter": filter} if filter else {}
+    fetch_k = _passage_fetch_k(vector_store, k)
+    with trace_span(
+        "search.retrieve",
+        mode=mode,
+        k=k,
+        filtered=bool(filter),
+        fetch_k=fetch_k,
+    ) as span:
+        if hybrid:
+            results = vector_store.keyword_search(query, fetch_k, **filtered)
+            if results:
+                span.set(keyword_fast_path=True)
+                return None, _expand_to_parents(vector_store, results, k)
+        aembed = (
+            getattr(vector_store, "aembed_query", None)
+            or vector_store.embeddings.aembed_query
+        )
+        vector = await aembed(query)
+        with trace_span("search.score", hybrid=hybrid):
+            if hybrid:
+                results = await asyncio.to_thread(
+                    vector_store.hybrid_search_with_score_by_vector,
+                    query,
+                    vector,
+                    fetch_k,
+                    **filtered,
+                )
+            else:
+                results = await asyncio.to_thread(
+                    vector_store.similarity_search_with_score_by_vector,
+                    vector,
+                    fetch_k,
+                    **filtered,
+                )
+        return vector, _expand_to_parents(vector_store, results, k)
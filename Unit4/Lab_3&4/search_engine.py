@@ -0,0 +1,367 @@
+"""
+NumPy top-k cosine search over one normalized matrix.
+
+This file is kept identical in Unit4/Lab_1&2 and Unit4/Lab_3&4 so that
+each lab runs on its own; change both copies together.
+"""
+import os
+import threading
+
+import numpy as np
+
+
+class VectorSearchEngine:
+    """
+    Brute-force cosine top-k search over one L2-normalized NumPy matrix.
+
+    Every stored vector is a unit-length row of a single float32 matrix, so
+    the cosine similarity of a query against all N rows is one matrix-vector
+    product (a batch of queries is one matrix-matrix product) instead of N
+    interpreted `cosine_similarity` calls. Top-k selection uses
+    `np.argpartition`, which is O(N), and only the k winners get sorted.
+    Rows are addressed by caller-supplied ids kept in `ids`.
+
+    Removing ids only tombstones their rows: they are masked out of every
+    search until more than `compact_ratio` of the rows are dead, and only
+    then is the matrix compacted (and the index rebuilt) in one go.
+
+    An optional ANN `index` (`IVFIndex`, `Int8Index` or `ReducedDimIndex`
+    from Lab_3&4's `ann_index`) narrows each query down to a candidate set
+    of rows before the exact scoring; it is kept up to date as rows are
+    added and removed, and rebuilt when the matrix is compacted. A matrix
+    adopted with `set_matrix(..., defer_index=True)` (a loaded snapshot)
+    only gets its index built by the first search.
+
+    A search can be restricted to some `rows` (a metadata filter). Up to
+    `subset_scan_ratio` of the live rows, just those rows are scored;
+    broader filters take the normal path and mask the other rows out of
+    the result, which avoids copying most of the matrix per query.
+
+    With a `spill_path`, rows are not kept in RAM at all: `add` appends
+    them to that file, `matrix` is a read-only memory map of it (so only
+    the pages a search touches are resident), and compaction rewrites it.
+    Pair it with an index that keeps its own compact copy (`Int8Index`).
+    """
+
+    # Rows copied at a time when the spill file is (re)written.
+    SPILL_BLOCK_ROWS = 4096
+
+    def __init__(
+        self,
+        index=None,
+        compact_ratio: float = 0.25,
+        subset_scan_ratio: float = 0.25,
+        spill_path: str = None,
+    ):
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        # id per row of `matrix`; None for a removed (tombstoned) row.
+        self._row_ids = []
+        self._id_to_row = {}
+        self._dead_rows = np.zeros(0, dtype=np.int64)
+        self.index = index
+        self.compact_ratio = compact_ratio
+        self.subset_scan_ratio = subset_scan_ratio
+        # Growable backing store for `matrix`; None until the first add.
+        self._buffer = None
+        self.spill_path = spill_path
+        # How many rows of `matrix` the spill file holds (None: not ours).
+        self._spilled = None
+        # True while `index` still has to be built for `matrix`.
+        self._index_pending = False
+        self._index_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._id_to_row)
+
+    @property
+    def ids(self) -> list:
+        """The stored ids, in row order."""
+        if not len(self._dead_rows):
+            return list(self._row_ids)
+        return [doc_id for doc_id in self._row_ids if doc_id is not None]
+
+    def __contains__(self, doc_id) -> bool:
+        return doc_id in self._id_to_row
+
+    @staticmethod
+    def normalize(vectors) -> np.ndarray:
+        """Return `vectors` as a float32 2-D array with unit-length rows."""
+        arr = np.asarray(vectors, dtype=np.float32)
+        if arr.ndim == 1:
+            arr = arr.reshape(1, -1)
+        norms = np.linalg.norm(arr, axis=1, keepdims=True)
+        # Zero vectors stay zero instead of turning into NaNs.
+        norms[norms == 0] = 1.0
+        return arr / norms
+
+    def row_of(self, doc_id) -> int:
+        return self._id_to_row[doc_id]
+
+    def set_matrix(self, ids: list, matrix, defer_index: bool = False):
+        """
+        Adopt an already-normalized matrix (e.g. a read-only memmap). With
+        `defer_index`, the index is built by the first search instead of
+        now.
+        """
+        if len(ids) != len(matrix):
+            raise ValueError("Number of ids does not match number of rows")
+        self.matrix = matrix
+        self._buffer = None
+        self._spilled = None
+        self._row_ids = list(ids)
+        self._id_to_row = {doc_id: row for row, doc_id in enumerate(ids)}
+        self._dead_rows = np.zeros(0, dtype=np.int64)
+        self._index_pending = self.index is not None and defer_index
+        if self.index is not None and not defer_index:
+            self.index.rebuild(self.matrix)
+
+    def build_index(self):
+        """Build a deferred index now (see `set_matrix`)."""
+        with self._index_lock:
+            if self._index_pending:
+                self.index.rebuild(self.matrix, self._dead_rows)
+                self._index_pending = False
+
+    def live_matrix(self) -> np.ndarray:
+        """The rows of `ids`, in the same order (tombstones left out)."""
+        if not len(self._dead_rows):
+            return self.matrix
+        live = np.ones(len(self._row_ids), dtype=bool)
+        live[self._dead_rows] = False
+        return np.asarray(self.matrix[live])
+
+    def iter_live_blocks(self, block_rows: int = SPILL_BLOCK_ROWS):
+        """Yield the rows of `live_matrix()` a block at a time."""
+        n = len(self._row_ids)
+        if not len(self._dead_rows):
+            for block in range(0, n, block_rows):
+                yield np.asarray(self.matrix[block:block + block_rows])
+            return
+        live = np.setdiff1d(np.arange(n), self._dead_rows, assume_unique=True)
+        for block in range(0, len(live), block_rows):
+            yield np.asarray(self.matrix[live[block:block + block_rows]])
+
+    def _write_spill(self, blocks):
+        """Replace the spill file with `blocks` of rows; returns the count."""
+        count = 0
+        with open(self.spill_path + ".tmp", "wb") as f:
+            for block in blocks:
+                f.write(np.ascontiguousarray(block, np.float32).tobytes())
+                count += len(block)
+        os.replace(self.spill_path + ".tmp", self.spill_path)
+        return count
+
+    def _map_spill(self, n: int, dim: int) -> np.ndarray:
+        """The first `n` rows of the spill file, memory-mapped read-only."""
+        if n == 0:
+            return np.zeros((0, dim), dtype=np.float32)
+        return np.memmap(
+            self.spill_path, dtype=np.float32, mode="r", shape=(n, dim)
+        )
+
+    def add(self, ids: list, vectors):
+        """Normalize `vectors` and append them as new rows under `ids`."""
+        rows = self.normalize(vectors)
+        if len(rows) != len(ids):
+            raise ValueError("Number of vectors does not match number of ids")
+        start = len(self._row_ids)
+        if start and rows.shape[1] != self.matrix.shape[1]:
+            raise ValueError("Vector dimension does not match the engine")
+        if self.spill_path is not None:
+            self._spill(rows, start)
+        else:
+            self._grow(rows, start)
+        for row, doc_id in enumerate(ids, start=start):
+            self._id_to_row[doc_id] = row
+            self._row_ids.append(doc_id)
+        if self.index is not None and not self._index_pending:
+            # Tombstoned rows are passed along so a re-fit skips them.
+            self.index.add(self.matrix, start, self._dead_rows)
+
+    def _spill(self, rows: np.ndarray, start: int):
+        """Append `rows` to the spill file and re-map `matrix` from it."""
+        if self._spilled != start:
+            # The file doesn't hold the current rows yet (e.g. after a
+            # load); copy them over from disk, a block at a time.
+            self._write_spill(
+                np.asarray(self.matrix[block:block + self.SPILL_BLOCK_ROWS])
+                for block in range(0, start, self.SPILL_BLOCK_ROWS)
+            )
+        with open(self.spill_path, "ab") as f:
+            rows.tofile(f)
+        self.matrix = self._map_spill(start + len(rows), rows.shape[1])
+        self._spilled = start + len(rows)
+
+    def _grow(self, rows: np.ndarray, start: int):
+        """Copy `rows` into the in-memory buffer behind `matrix`."""
+        needed = start + len(rows)
+        # Rows go into a preallocated buffer that doubles when full, so
+        # streaming ingest in many small batches is amortized O(1) per row
+        # rather than copying the whole matrix on every add. The first add
+        # after a load also copies the read-only memmap into this buffer.
+        if self._buffer is None or len(self._buffer) < needed:
+            capacity = max(needed, 2 * start, 1024)
+            buffer = np.empty((capacity, rows.shape[1]), dtype=np.float32)
+            if start:
+                buffer[:start] = self.matrix
+            self._buffer = buffer
+        self._buffer[start:needed] = rows
+        self.matrix = self._buffer[:needed]
+
+    def remove(self, ids) -> list:
+        """Drop the rows for `ids`. Returns the ids actually removed."""
+        drop = sorted(
+            {self._id_to_row.pop(i) for i in ids if i in self._id_to_row}
+        )
+        if not drop:
+            return []
+        removed = [self._row_ids[row] for row in drop]
+        for row in drop:
+            self._row_ids[row] = None
+        self._dead_rows = np.union1d(
+            self._dead_rows, np.array(drop, dtype=np.int64)
+        )
+        if len(self._dead_rows) > self.compact_ratio * len(self._row_ids):
+            self.compact()
+        elif self.index is not None and not self._index_pending:
+            self.index.remove(np.array(drop, dtype=np.int64))
+        return removed
+
+    def compact(self):
+        """Drop tombstoned rows from the matrix and rebuild the index."""
+        if not len(self._dead_rows):
+            return
+        ids = self.ids
+        dim = self.matrix.shape[1]
+        if self.spill_path is not None:
+            count = self._write_spill(self.iter_live_blocks())
+            # Row numbers shift, so the index is rebuilt by `set_matrix`.
+            self.set_matrix(ids, self._map_spill(count, dim))
+            self._spilled = count
+            return
+        matrix = (
+            self.live_matrix()
+            if ids
+            else np.zeros((0, dim), dtype=np.float32)
+        )
+        self.set_matrix(ids, matrix)
+
+    @staticmethod
+    def top_k(scores: np.ndarray, k: int):
+        """
+        Return (row indices, scores) of the `k` best entries per row of the
+        2-D `scores` array, best first. argpartition finds the winners in
+        linear time; only those k get sorted.
+        """
+        n = scores.shape[1]
+        k = min(k, n)
+        if k <= 0:
+            empty = np.zeros((scores.shape[0], 0))
+            return empty.astype(np.int64), empty
+        if k < n:
+            part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            part = np.broadcast_to(np.arange(n), scores.shape).copy()
+        part_scores = np.take_along_axis(scores, part, axis=1)
+        order = np.argsort(-part_scores, axis=1, kind="stable")
+        return np.take_along_axis(part, order, axis=1), np.take_along_axis(
+            part_scores, order, axis=1
+        )
+
+    def _mask_dead(self, scores: np.ndarray) -> int:
+        """Score tombstoned columns -inf; returns how many rows are live."""
+        if len(self._dead_rows):
+            scores[:, self._dead_rows] = -np.inf
+        return len(self._id_to_row)
+
+    def rows_of(self, ids) -> np.ndarray:
+        """Sorted row numbers of the stored ids among `ids`."""
+        rows = np.fromiter(
+            (self._id_to_row[i] for i in ids if i in self._id_to_row),
+            dtype=np.int64,
+        )
+        rows.sort()
+        return rows
+
+    def search_batch(
+        self, queries, k: int = 4, rows: np.ndarray = None
+    ) -> list:
+        """
+        Score every query against every row with one matmul. Returns, per
+        query, [(id, score), ...]. `rows` (sorted live row numbers, see
+        `rows_of`) restricts the results to those rows, a metadata filter.
+        """
+        if len(self) == 0 or (rows is not None and len(rows) == 0):
+            return [[] for _ in range(len(queries))]
+        q = self.normalize(queries)
+        if self._index_pending:
+            self.build_index()
+        allowed = None
+        if rows is not None:
+            if len(rows) <= self.subset_scan_ratio * len(self):
+                # A small subset is cheaper to scan exactly than to probe
+                # the ANN index and throw most candidates away.
+                return self._search_rows(q, k, rows)
+            allowed = np.zeros(len(self._row_ids), dtype=bool)
+            allowed[rows] = True
+        if self.index is not None and self.index.trained:
+            return [
+                self._search_candidates(query, k, allowed, rows)
+                for query in q
+            ]
+        scores = q @ self.matrix.T
+        if allowed is None:
+            live = self._mask_dead(scores)
+        else:
+            scores[:, ~allowed] = -np.inf
+            live = len(rows)
+        hits, scores = self.top_k(scores, min(k, live))
+        return [
+            [
+                (self._row_ids[int(r)], float(sc))
+                for r, sc in zip(row_ids, row_scores)
+            ]
+            for row_ids, row_scores in zip(hits, scores)
+        ]
+
+    def _search_rows(self, q: np.ndarray, k: int, rows: np.ndarray) -> list:
+        """Exact scoring of the normalized queries `q` against `rows` only."""
+        hits, scores = self.top_k(q @ self.matrix[rows].T, k)
+        return [
+            [
+                (self._row_ids[int(rows[r])], float(sc))
+                for r, sc in zip(row_ids, row_scores)
+            ]
+            for row_ids, row_scores in zip(hits, scores)
+        ]
+
+    def _search_candidates(
+        self,
+        query: np.ndarray,
+        k: int,
+        allowed: np.ndarray = None,
+        rows: np.ndarray = None,
+    ) -> list:
+        """
+        Exact scoring restricted to the rows the ANN index proposes, and to
+        the `allowed` rows if given. When the filter leaves fewer than k
+        candidates, the filtered `rows` are scanned exactly instead.
+        """
+        candidates = self.index.candidates(query, k)
+        if allowed is not None:
+            candidates = candidates[allowed[candidates]]
+            if len(candidates) < min(k, len(rows)):
+                return self._search_rows(query[None, :], k, rows)[0]
+        if len(candidates) == 0:
+            return []
+        rows, scores = self.top_k(
+            (self.matrix[candidates] @ query)[None, :], k
+        )
+        return [
+            (self._row_ids[int(candidates[r])], float(sc))
+            for r, sc in zip(rows[0], scores[0])
+        ]
+
+    def search(self, query, k: int = 4, rows: np.ndarray = None) -> list:
+        """Return [(id, score), ...] for the `k` rows closest to `query`."""
+        return self.search_batch([query], k, rows)[0]
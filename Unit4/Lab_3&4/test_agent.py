@@ -0,0 +1,227 @@
+import asyncio
+import gc
+import threading
+import types
+import weakref
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+import app
+from answer_cache import SemanticAnswerCache
+from app import ChatOpenAICompat, create_agent_executor
+from hashing_embeddings import HashingEmbeddings
+from vector_store import MmapVectorStore
+
+
+class FakeChatModel:
+    """Answers with the tail of the last prompt message."""
+
+    def __init__(self):
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def __call__(self, messages):
+        self.calls += 1
+        return AIMessage(content="answer: " + messages[-1].content[-20:])
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return AIMessage(content="answer: " + messages[-1].content[-20:])
+
+
+class BarrierChatModel(FakeChatModel):
+    """Holds every call until `parties` requests are inside the model."""
+
+    def __init__(self, parties):
+        super().__init__()
+        self.barrier = threading.Barrier(parties, timeout=5)
+
+    def __call__(self, messages):
+        self.barrier.wait()
+        return super().__call__(messages)
+
+
+@pytest.fixture
+def store():
+    store = MmapVectorStore(HashingEmbeddings(64))
+    store.add_texts(
+        [
+            "Employees accrue 15 days of paid time off per year.",
+            "Health insurance starts on the first day of employment.",
+        ],
+        metadatas=[{"source": "handbook.md"}, {"source": "benefits.md"}],
+    )
+    return store
+
+
+def test_invoke_answers_with_the_chat_model(store):
+    llm = FakeChatModel()
+    executor = create_agent_executor(store, chat_model=llm)
+    result = executor.invoke({"input": "How much PTO do I get?"})
+    assert result["output"].startswith("answer: ")
+    assert llm.calls == 1
+
+
+def test_abatch_limits_concurrency_on_every_event_loop(store):
+    llm = FakeChatModel()
+    executor = create_agent_executor(store, chat_model=llm)
+    executor.max_concurrency = 2
+    questions = [{"input": f"question {i}"} for i in range(6)]
+    # Each asyncio.run starts a new loop; the limit must follow it there.
+    for _ in range(2):
+        results = asyncio.run(executor.abatch(questions))
+        assert len(results) == 6
+        assert all(r["output"].startswith("answer: ") for r in results)
+    assert llm.max_in_flight == 2
+
+
+def test_stream_timing_is_kept_per_request(store):
+    executor = create_agent_executor(store, chat_model=BarrierChatModel(2))
+    timings = {}
+
+    def ask(question):
+        answer = "".join(executor.stream({"input": question}))
+        timings[question] = (answer, executor.agent.last_timing)
+
+    threads = [
+        threading.Thread(target=ask, args=(q,)) for q in ("PTO?", "Dental?")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Both requests were in flight at once; each still sees its own timing.
+    assert timings["PTO?"][1] is not timings["Dental?"][1]
+    for answer, timing in timings.values():
+        assert answer.startswith("answer: ")
+        assert timing["total"] >= timing["ttft"] > 0
+        assert timing["streamed"] is False
+
+
+class BrokenStreamChatModel(FakeChatModel):
+    """Streams one token, then the connection drops."""
+
+    def stream(self, messages):
+        yield AIMessage(content="Employees accrue")
+        raise ConnectionError("stream reset")
+
+
+def test_truncated_stream_is_not_cached(store):
+    cache = SemanticAnswerCache(threshold=0.9)
+    executor = create_agent_executor(
+        store, chat_model=BrokenStreamChatModel(), answer_cache=cache
+    )
+    answer = "".join(executor.stream({"input": "How much PTO do I get?"}))
+    assert answer.startswith("Employees accrue\n(LLM error: stream reset")
+    assert executor.agent.last_error == "stream reset"
+    assert len(cache) == 0
+
+    # A complete answer to the same question is cached as before.
+    executor.agent.llm = FakeChatModel()
+    assert executor.invoke({"input": "How much PTO do I get?"})["output"]
+    assert executor.agent.last_error is None
+    assert len(cache) == 1
+
+
+def test_prompt_accounting_is_kept_per_request(store):
+    executor = create_agent_executor(store, chat_model=BarrierChatModel(2))
+    prompts = {}
+
+    def ask(question):
+        executor.invoke({"input": question})
+        prompts[question] = executor.agent.last_prompt
+
+    threads = [
+        threading.Thread(target=ask, args=(q,))
+        for q in ("How much paid time off?", "When does insurance start?")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    first, second = prompts.values()
+    assert first is not second
+    for prompt in (first, second):
+        assert prompt["prompt_tokens"] > 0 and prompt["chunks"] > 0
+
+
+def test_rewritten_query_is_kept_per_request(store):
+    executor = create_agent_executor(
+        store, chat_model=FakeChatModel(), rewrite_queries=True
+    )
+    history = [
+        HumanMessage(content="How much PTO do I get?"),
+        AIMessage(content="15 days per year."),
+    ]
+    seen = {}
+
+    def follow_up():
+        executor.invoke(
+            {"input": "Does it roll over?", "chat_history": history}
+        )
+        seen["query"] = executor.agent.last_search_query
+
+    thread = threading.Thread(target=follow_up)
+    thread.start()
+    thread.join()
+    assert seen["query"].startswith("answer: ")
+    # The follow-up ran in another request; this one never rewrote anything.
+    assert executor.agent.last_search_query is None
+    executor.invoke({"input": "When does health insurance start?"})
+    assert executor.agent.last_search_query is None
+
+
+class FakeOpenAIClient:
+    def __init__(self, api_key=None, base_url=None):
+        self.api_key = api_key
+        self.base_url = base_url
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    fake = types.SimpleNamespace(
+        OpenAI=FakeOpenAIClient, AsyncOpenAI=FakeOpenAIClient
+    )
+    monkeypatch.setattr(app, "openai", fake)
+    monkeypatch.setattr(app, "_openai_has_client_api", lambda: True)
+    monkeypatch.setattr(app, "_OPENAI_CLIENTS", {})
+    monkeypatch.setattr(
+        app, "_OPENAI_ASYNC_CLIENTS", weakref.WeakKeyDictionary()
+    )
+    return fake
+
+
+def test_chat_models_share_one_openai_client(fake_openai):
+    first = ChatOpenAICompat(api_key="key", base_url="https://example.test")
+    second = ChatOpenAICompat(
+        api_key="key", base_url="https://example.test", temperature=1
+    )
+    other = ChatOpenAICompat(api_key="other", base_url="https://example.test")
+    assert first.client is second.client
+    assert other.client is not first.client
+    assert (other.client.api_key, other.client.base_url) == (
+        "other",
+        "https://example.test",
+    )
+
+
+def test_async_openai_clients_are_kept_per_event_loop(fake_openai):
+    async def clients():
+        return (
+            app.get_shared_async_openai_client("key"),
+            app.get_shared_async_openai_client("key"),
+        )
+
+    first, again = asyncio.run(clients())
+    assert first is again
+    second, _ = asyncio.run(clients())
+    assert second is not first
+    # Closed loops are dropped with their clients.
+    gc.collect()
+    assert len(app._OPENAI_ASYNC_CLIENTS) == 0
@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+
+from ann_index import Int8Index, IVFIndex, ReducedDimIndex, create_index
+from search_engine import VectorSearchEngine
+
+
+def clustered(n, dim=32, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    points = centers[rng.integers(0, clusters, n)]
+    return points + 0.3 * rng.standard_normal((n, dim))
+
+
+def recall(approx, exact):
+    hits = sum(
+        len({i for i, _ in a} & {i for i, _ in e})
+        for a, e in zip(approx, exact)
+    )
+    return hits / sum(len(e) for e in exact)
+
+
+def make_index(kind):
+    if kind == "ivf":
+        return IVFIndex(nlist=16, nprobe=4, min_train_size=500)
+    if kind == "int8":
+        return Int8Index(rerank=50)
+    return ReducedDimIndex(
+        dim=16, shortlist=100, method=kind, min_train_size=500
+    )
+
+
+KINDS = ["ivf", "int8", "pca", "truncate"]
+
+
+@pytest.mark.parametrize("kind", KINDS)
+def test_recall_against_exact_search(kind):
+    data = clustered(3050)
+    corpus, queries = data[:3000], data[3000:]
+    exact = VectorSearchEngine()
+    exact.add(list(range(3000)), corpus)
+    ann = VectorSearchEngine(index=make_index(kind))
+    ann.add(list(range(3000)), corpus)
+    assert ann.index.trained
+    results = [ann.search(q, k=10) for q in queries]
+    assert recall(results, [exact.search(q, k=10) for q in queries]) > 0.8
+
+
+@pytest.mark.parametrize("kind", KINDS)
+def test_incremental_add_matches_one_shot_build(kind):
+    data = clustered(2000)
+    one_shot = VectorSearchEngine(index=make_index(kind))
+    one_shot.add(list(range(2000)), data)
+    incremental = VectorSearchEngine(index=make_index(kind))
+    for start in range(0, 2000, 64):
+        incremental.add(
+            list(range(start, min(start + 64, 2000))),
+            data[start:start + 64],
+        )
+    assert incremental.index.trained
+    for q in data[:20]:
+        best = incremental.search(q, k=1)[0][0]
+        assert best == one_shot.search(q, k=1)[0][0]
+
+
+@pytest.mark.parametrize("kind", KINDS)
+def test_removed_rows_are_never_candidates(kind):
+    data = clustered(2000)
+    engine = VectorSearchEngine(index=make_index(kind))
+    engine.add(list(range(2000)), data)
+    removed = list(range(0, 2000, 10))
+    engine.remove(removed)
+    # 10% dead: tombstoned, not compacted, so the index was not rebuilt.
+    assert len(engine.matrix) == 2000
+    for q in data[:50]:
+        hits = engine.search(q, k=10)
+        assert len(hits) == 10
+        assert not {i for i, _ in hits} & set(removed)
+
+
+def test_ivf_remove_drops_rows_from_their_cells():
+    data = clustered(1000)
+    index = IVFIndex(nlist=8, min_train_size=100)
+    engine = VectorSearchEngine(index=index)
+    engine.add(list(range(1000)), data)
+    engine.remove([5, 6, 7])
+    listed = sorted(r for cell in index.lists for r in cell)
+    assert listed == [r for r in range(1000) if r not in (5, 6, 7)]
+
+
+def test_compaction_rebuilds_the_index():
+    data = clustered(1000)
+    engine = VectorSearchEngine(index=make_index("int8"))
+    engine.add(list(range(1000)), data)
+    engine.remove(list(range(300)))
+    assert len(engine.matrix) == 700 and len(engine.index.removed) == 0
+    assert engine.search(data[500], k=1)[0][0] == 500
+
+
+def test_create_index():
+    assert create_index("exact") is None
+    assert isinstance(create_index("ivf"), IVFIndex)
+    assert isinstance(create_index("int8"), Int8Index)
+    assert create_index("truncate").method == "truncate"
+    with pytest.raises(ValueError):
+        create_index("hnsw")
+
+
+@pytest.mark.parametrize("kind", KINDS)
+def test_filtered_search_with_an_index(kind):
+    data = clustered(2000)
+    engine = VectorSearchEngine(index=make_index(kind))
+    engine.add(list(range(2000)), data)
+    broad = engine.rows_of(range(0, 2000, 2))
+    narrow = engine.rows_of(range(0, 2000, 100))
+    for q in data[:20]:
+        hits = engine.search(q, k=10, rows=broad)
+        assert len(hits) == 10 and all(i % 2 == 0 for i, _ in hits)
+        hits = engine.search(q, k=10, rows=narrow)
+        assert len(hits) == 10 and all(i % 100 == 0 for i, _ in hits)
+
+
+def test_filter_the_index_misses_falls_back_to_a_scan():
+    data = clustered(2000)
+    engine = VectorSearchEngine(index=make_index("ivf"))
+    engine.add(list(range(2000)), data)
+    # Broad, but the rows furthest from the query: the probed cells hold
+    # fewer than k of them, so the filtered rows are scanned instead.
+    scores = engine.matrix @ engine.normalize(data[0])[0]
+    far = np.argsort(scores)[:1200]
+    hits = engine.search(data[0], k=10, rows=np.sort(far))
+    assert len(hits) == 10 and {i for i, _ in hits} <= set(far.tolist())
+
+
+@pytest.mark.parametrize("kind", KINDS)
+def test_removed_rows_stay_removed_when_growth_refits_the_index(kind):
+    data = clustered(4400)
+    engine = VectorSearchEngine(index=make_index(kind))
+    engine.add(list(range(2000)), data[:2000])
+    removed = list(range(0, 2000, 10))
+    engine.remove(removed)
+    # Doubling the corpus re-fits the index over the tombstoned matrix.
+    engine.add(list(range(2000, 4400)), data[2000:])
+    assert engine.index.trained_at == 4400
+    for q in data[:50]:
+        hits = engine.search(q, k=10)
+        assert len(hits) == 10
+        assert None not in {i for i, _ in hits}
+        assert not {i for i, _ in hits} & set(removed)
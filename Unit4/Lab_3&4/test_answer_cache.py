@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import answer_cache
+from answer_cache import SemanticAnswerCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(answer_cache.time, "time", clock)
+    return clock
+
+
+def vector(i, dim=8):
+    v = np.zeros(dim)
+    v[i] = 1.0
+    return v
+
+
+def test_lookup_needs_similar_question_and_same_chunks():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store(vector(0), ["a", "b"], "15 days")
+    assert cache.lookup(vector(0) + 0.01 * vector(1), ["b", "a"])[0] == (
+        "15 days"
+    )
+    assert cache.lookup(vector(0), ["a"]) is None
+    assert cache.lookup(vector(1), ["a", "b"]) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_keyword_questions_match_on_text():
+    cache = SemanticAnswerCache()
+    cache.store(None, ["a"], "yes", question="PTO  policy")
+    assert cache.lookup(None, ["a"], question="pto policy")[0] == "yes"
+    assert cache.lookup(None, ["a"], question="dental") is None
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = SemanticAnswerCache(ttl=10)
+    cache.store(vector(0), ["a"], "old")
+    clock.now += 6
+    cache.store(vector(1), ["a"], "new")
+    # A hit moves the old entry to the LRU tail; it still expires first.
+    assert cache.lookup(vector(0), ["a"])[0] == "old"
+    clock.now += 5
+    assert cache.lookup(vector(0), ["a"]) is None
+    assert cache.lookup(vector(1), ["a"])[0] == "new"
+    assert len(cache) == 1 and cache.stats()["evictions"] == 1
+    clock.now += 10
+    assert cache.lookup(vector(1), ["a"]) is None and len(cache) == 0
+
+
+def test_lru_eviction_and_invalidation(clock):
+    cache = SemanticAnswerCache(max_entries=2, ttl=10)
+    for i in range(3):
+        cache.store(vector(i), [str(i)], f"answer {i}")
+    assert len(cache) == 2 and cache.lookup(vector(0), ["0"]) is None
+    assert cache.invalidate_chunks(["1"]) == 1
+    for i in range(3, 8):
+        cache.store(vector(i), [str(i)], f"answer {i}")
+    # Keys of evicted entries do not pile up in the expiry queue.
+    assert len(cache._expiry) <= 4
+    clock.now += 11
+    assert cache.lookup(vector(7), ["7"]) is None and len(cache) == 0
+    assert cache.invalidate_chunks() == 0
@@ -0,0 +1,152 @@
+import io
+
+import pytest
+from langchain_text_splitters import (
+    CharacterTextSplitter,
+    MarkdownHeaderTextSplitter,
+    RecursiveCharacterTextSplitter,
+)
+
+from chunking import (
+    iter_fixed_size_chunks,
+    iter_hierarchical_chunks,
+    iter_markdown_header_chunks,
+    iter_paragraph_chunks,
+    iter_text_blocks,
+    stream_split,
+)
+
+PARAGRAPHS = "\n\n".join(
+    " ".join(f"word{p}_{w}" for w in range(40 + 7 * (p % 5)))
+    for p in range(60)
+)
+
+MARKDOWN = """# Handbook
+
+Intro text.
+
+## Vacation
+
+Employees accrue 15 days of paid time off.
+
+```
+# not a header
+```
+
+## Benefits
+
+Health insurance starts on day one.
+
+# Appendix
+
+See HR.
+"""
+
+
+def blocks(text, size):
+    return iter_text_blocks(io.StringIO(text), size)
+
+
+@pytest.mark.parametrize(
+    "splitter",
+    [
+        CharacterTextSplitter(chunk_size=300, chunk_overlap=0, separator=" "),
+        RecursiveCharacterTextSplitter(
+            chunk_size=500,
+            chunk_overlap=0,
+            separators=["\n\n", "\n", " ", ""],
+        ),
+        RecursiveCharacterTextSplitter(
+            chunk_size=500,
+            chunk_overlap=100,
+            separators=["\n\n", "\n", " ", ""],
+        ),
+    ],
+)
+@pytest.mark.parametrize("block_chars", [97, 1024])
+def test_stream_split_matches_the_plain_splitter(splitter, block_chars):
+    streamed = list(
+        stream_split(
+            blocks(PARAGRAPHS, block_chars), splitter, window_chars=2000
+        )
+    )
+    assert streamed == splitter.split_text(PARAGRAPHS)
+
+
+def test_unsplittable_window_is_flushed_with_an_overlap():
+    # No "\n\n" anywhere: the splitter returns the whole window as one chunk.
+    splitter = CharacterTextSplitter(
+        chunk_size=100, chunk_overlap=20, separator="\n\n"
+    )
+    text = " ".join(f"w{i}" for i in range(3000))
+    pieces = list(stream_split(blocks(text, 97), splitter, window_chars=1024))
+    assert len(pieces) > 1
+    assert max(len(piece) for piece in pieces) < 1024 + 97 + 20
+    numbers = [
+        [int(w[1:]) for w in piece.split() if w != "w"] for piece in pieces
+    ]
+    for before, after in zip(numbers, numbers[1:]):
+        # The flushed window may end mid-word; the next one starts with
+        # the last whole words before it again.
+        assert after[0] <= before[-2] < after[-2]
+    assert numbers[0][0] == 0 and numbers[-1][-1] == 2999
+
+
+def test_file_chunkers_match_the_plain_splitters():
+    fixed = CharacterTextSplitter(
+        chunk_size=1000, chunk_overlap=0, separator=" "
+    )
+    paragraphs = RecursiveCharacterTextSplitter(
+        chunk_size=1500, chunk_overlap=0, separators=["\n\n", "\n", " ", ""]
+    )
+    assert [
+        c.page_content for c in iter_fixed_size_chunks(io.StringIO(PARAGRAPHS))
+    ] == fixed.split_text(PARAGRAPHS)
+    assert [
+        c.page_content for c in iter_paragraph_chunks(io.StringIO(PARAGRAPHS))
+    ] == paragraphs.split_text(PARAGRAPHS)
+
+
+def test_markdown_header_chunks_match_the_header_splitter():
+    plain = MarkdownHeaderTextSplitter(
+        headers_to_split_on=[("#", "Header 1"), ("##", "Header 2")]
+    ).split_text(MARKDOWN)
+    streamed = list(iter_markdown_header_chunks(io.StringIO(MARKDOWN)))
+    # The header splitter re-joins lines, so compare the words.
+    assert [c.page_content.split() for c in streamed] == [
+        c.page_content.split() for c in plain
+    ]
+    for ours, theirs in zip(streamed, plain):
+        headers = {k: v for k, v in ours.metadata.items() if k != "headerPath"}
+        assert headers == theirs.metadata
+    assert streamed[1].metadata["headerPath"] == "Handbook > Vacation"
+
+
+def test_hierarchical_passages_point_at_their_section():
+    chunks = list(
+        iter_hierarchical_chunks(
+            io.StringIO(MARKDOWN), "handbook.md", passage_tokens=4
+        )
+    )
+    assert chunks[0].metadata["level"] == "section"
+    section = None
+    passages = {}
+    for chunk in chunks:
+        if chunk.metadata["level"] == "section":
+            section = chunk
+            assert chunk.id.startswith("handbook.md:section:")
+            continue
+        assert chunk.metadata["parentId"] == section.id
+        assert chunk.metadata["headerPath"] == section.metadata["headerPath"]
+        passages.setdefault(section.id, []).append(chunk.page_content)
+    sections = [c for c in chunks if c.metadata["level"] == "section"]
+    assert [c.metadata["chunkIndex"] for c in sections] == [1, 2, 3, 4]
+    assert max(len(p) for p in passages.values()) > 1
+    for section in sections:
+        assert " ".join(passages[section.id]).split() == (
+            section.page_content.split()
+        )
+    again = iter_hierarchical_chunks(io.StringIO(MARKDOWN), "handbook.md")
+    assert [c.id for c in again if c.metadata["level"] == "section"] == [
+        c.id for c in sections
+    ]
@@ -0,0 +1,109 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from conversation import ConversationMemory, rewrite_query
+from tokens import count_tokens
+
+
+class RecordingChatModel:
+    """Replies with `reply` and keeps the prompts it was sent."""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.prompts = []
+
+    def __call__(self, messages):
+        self.prompts.append(messages)
+        return AIMessage(content=self.reply)
+
+
+class FailingChatModel:
+    def __call__(self, messages):
+        raise RuntimeError("chat service unavailable")
+
+
+def turn(n):
+    return f"Question {n} about leave policy?", f"Answer {n}: ten days."
+
+
+def test_window_keeps_the_most_recent_turns():
+    memory = ConversationMemory(window_tokens=40, summary_tokens=200)
+    for n in range(10):
+        memory.add_turn(*turn(n))
+    assert memory._tokens(memory.messages) <= 40
+    assert memory.messages[-2].content == turn(9)[0]
+    assert memory.messages[-1].content == turn(9)[1]
+    assert memory.summarized_turns > 0
+    assert memory.summarized_turns + len(memory) // 2 == 10
+
+    # The latest turn is kept even if it alone is over budget.
+    memory.add_turn("long " * 100, "answer")
+    assert [m.content for m in memory.messages] == ["long " * 100, "answer"]
+
+
+def test_evicted_turns_are_folded_into_the_summary():
+    llm = RecordingChatModel("User asked about leave; ten days.")
+    memory = ConversationMemory(llm, window_tokens=40, summary_tokens=200)
+    for n in range(10):
+        memory.add_turn(*turn(n))
+    assert memory.summary == "User asked about leave; ten days."
+    # Each fold sees the summary so far and only the turns just evicted.
+    prompt = llm.prompts[-1][-1].content
+    assert "User asked about leave; ten days." in prompt
+    assert turn(0)[0] not in prompt
+    assert turn(memory.summarized_turns - 1)[0] in prompt
+
+    history = memory.history_messages()
+    assert isinstance(history[0], SystemMessage)
+    assert memory.summary in history[0].content
+    assert history[1:] == memory.messages
+
+
+def test_summary_without_llm_keeps_questions_within_its_cap():
+    memory = ConversationMemory(window_tokens=40, summary_tokens=30)
+    for n in range(20):
+        memory.add_turn(*turn(n))
+    assert count_tokens(memory.summary) <= 30
+    # The cap keeps the end: the most recently evicted question survives.
+    last = memory.summarized_turns - 1
+    assert memory.summary.endswith(f"User asked: {turn(last)[0]}")
+
+    failing = ConversationMemory(FailingChatModel(), window_tokens=40)
+    for n in range(10):
+        failing.add_turn(*turn(n))
+    assert failing.summary.startswith(f"User asked: {turn(0)[0]}")
+
+    failing.clear()
+    assert failing.history_messages() == [] and failing.summary == ""
+
+
+def test_bounded_keeps_the_newest_messages_that_fit():
+    messages = [HumanMessage(content=f"message {n} " * 5) for n in range(10)]
+    per_message = count_tokens(messages[0].content)
+    kept = ConversationMemory.bounded(messages, per_message * 3)
+    assert kept == messages[-3:]
+    assert ConversationMemory.bounded(messages, per_message - 1) == []
+    assert ConversationMemory.bounded(iter(messages), 10**6) == messages
+
+
+def test_rewrite_query_uses_the_history():
+    llm = RecordingChatModel("  Does unused vacation carry over?  ")
+    history = [
+        HumanMessage(content="How many vacation days do I get?"),
+        AIMessage(content="15 days per year."),
+    ]
+    rewritten = rewrite_query(llm, history, "Does it carry over?")
+    assert rewritten == "Does unused vacation carry over?"
+    (prompt,) = llm.prompts
+    assert "User: How many vacation days do I get?" in prompt[-1].content
+    assert "Assistant: 15 days per year." in prompt[-1].content
+    assert "Last question: Does it carry over?" in prompt[-1].content
+
+
+def test_rewrite_query_falls_back_to_the_question():
+    question = "Does it carry over?"
+    history = [HumanMessage(content="Vacation days?")]
+    assert rewrite_query(RecordingChatModel("x"), [], question) == question
+    assert rewrite_query(FailingChatModel(), history, question) == question
+    assert rewrite_query(RecordingChatModel(" "), history, question) == (
+        question
+    )
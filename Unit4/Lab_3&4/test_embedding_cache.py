@@ -0,0 +1,117 @@
+import asyncio
+import threading
+
+import pytest
+
+import embedding_cache
+from embedding_cache import CachedEmbeddings
+from hashing_embeddings import HashingEmbeddings
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    """HashingEmbeddings that counts the texts it is asked to embed."""
+
+    def __init__(self):
+        super().__init__(16)
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.embedded.append(text)
+        return super().embed_query(text)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "cache.sqlite3")
+
+
+def test_only_misses_reach_the_model(path):
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, cache_path=path)
+    first = cache.embed_documents(["a b", "c d"])
+    again = cache.embed_documents(["c d", "e f", "e f"])
+    assert model.embedded == ["a b", "c d", "e f"]
+    assert again[0] == first[1] and again[1] == again[2]
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 4,
+        "hit_rate": 0.2,
+        "requests": 2,
+        "entries": 3,
+    }
+
+
+def test_vectors_persist_across_instances(path):
+    vectors = CachedEmbeddings(
+        CountingEmbeddings(), cache_path=path
+    ).embed_documents(["a b"])
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, cache_path=path)
+    assert cache.embed_documents(["a b"]) == vectors
+    assert model.embedded == [] and cache.hits == 1
+
+
+def test_query_and_document_vectors_are_kept_apart(path):
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, cache_path=path)
+    cache.embed_documents(["a b"])
+    cache.embed_query("a b")
+    cache.embed_query("a b")
+    assert model.embedded == ["a b", "a b"]
+    assert asyncio.run(cache.aembed_query("a b")) == cache.embed_query("a b")
+    assert cache.requests == 2
+
+
+def test_least_recently_used_entries_are_evicted(path, monkeypatch):
+    clock = iter(range(1000))
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: next(clock))
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, cache_path=path, max_entries=2)
+    cache.embed_documents(["a"])
+    cache.embed_documents(["b"])
+    cache.embed_documents(["a"])
+    cache.embed_documents(["c"])
+    assert cache.stats()["entries"] == 2
+    model.embedded.clear()
+    cache.embed_documents(["a", "b", "c"])
+    assert model.embedded == ["b"]
+
+
+def test_entry_count_is_kept_without_counting_the_table(path):
+    cache = CachedEmbeddings(CountingEmbeddings(), cache_path=path)
+    cache.embed_documents(["a", "b"])
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+    cache.embed_documents(["b", "c", "d"])
+    cache._store({cache._key("doc", "a"): [0.0] * 16})
+    assert not [s for s in statements if "COUNT(" in s.upper()]
+    assert cache.stats()["entries"] == 4
+    cache.close()
+    reopened = CachedEmbeddings(
+        CountingEmbeddings(), cache_path=path, max_entries=3
+    )
+    assert reopened.stats()["entries"] == 4
+    reopened.embed_documents(["e"])
+    assert reopened.stats()["entries"] == 3
+
+
+def test_counters_add_up_across_threads(path):
+    cache = CachedEmbeddings(CountingEmbeddings(), cache_path=path)
+    texts = [f"text {i % 10}" for i in range(40)]
+
+    def embed(start):
+        for text in texts[start::4]:
+            cache.embed_documents([text])
+
+    threads = [threading.Thread(target=embed, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = cache.stats()
+    assert stats["hits"] + stats["misses"] == 40
+    assert stats["requests"] == stats["misses"] and stats["entries"] == 10
@@ -0,0 +1,273 @@
+import pytest
+from langchain_core.documents import Document
+
+import ingest
+import tokens
+from hashing_embeddings import HashingEmbeddings
+from ingest import (
+    batch_chunks_by_tokens,
+    fit_token_limit,
+    ingest_directory,
+    load_document_with_chunks,
+    reindex_document,
+    stored_documents_by_source,
+)
+from retrieval import build_context
+from vector_store import MmapVectorStore
+
+HANDBOOK = """# Employee Handbook
+
+## Vacation
+
+Employees accrue 15 days of paid time off per year.
+
+## Benefits
+
+Health insurance starts on the first day of employment.
+"""
+
+
+@pytest.fixture
+def store():
+    return MmapVectorStore(HashingEmbeddings(64))
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+    return path
+
+
+def test_directory_file_does_not_replace_bundled_document(store, tmp_path):
+    bundled = write(tmp_path / "bundled" / "EmployeeHandbook.md", HANDBOOK)
+    reindex_document(store, str(bundled))
+    bundled_ids = set(stored_documents_by_source(store)["EmployeeHandbook.md"])
+    assert bundled_ids
+
+    docs = tmp_path / "docs"
+    write(docs / "EmployeeHandbook.md", "# Notes\n\nA different file.\n")
+    ingest_directory(store, str(docs), max_workers=1)
+
+    grouped = stored_documents_by_source(store)
+    assert set(grouped["EmployeeHandbook.md"]) == bundled_ids
+    assert "dir:EmployeeHandbook.md" in grouped
+    assert not bundled_ids & set(grouped["dir:EmployeeHandbook.md"])
+
+
+def test_removed_directory_files_are_deleted(store, tmp_path):
+    bundled = write(tmp_path / "bundled" / "EmployeeHandbook.md", HANDBOOK)
+    reindex_document(store, str(bundled))
+    docs = tmp_path / "docs"
+    write(docs / "a.md", "# A\n\nAlpha policy text.\n")
+    gone = write(docs / "sub" / "b.txt", "Bravo policy text.\n")
+    ingest_directory(store, str(docs), max_workers=1)
+    assert {"dir:a.md", "dir:sub/b.txt"} <= set(
+        stored_documents_by_source(store)
+    )
+
+    gone.unlink()
+    summary = ingest_directory(store, str(docs), max_workers=1)
+    grouped = stored_documents_by_source(store)
+    assert "dir:sub/b.txt" not in grouped
+    assert summary["removed"] == 1 and summary["unchanged"] >= 1
+    assert "dir:a.md" in grouped and "EmployeeHandbook.md" in grouped
+
+    (docs / "a.md").unlink()
+    ingest_directory(store, str(docs), max_workers=1)
+    assert set(stored_documents_by_source(store)) == {"EmployeeHandbook.md"}
+
+
+def test_unchanged_directory_is_not_re_embedded(store, tmp_path):
+    docs = tmp_path / "docs"
+    write(docs / "a.md", HANDBOOK)
+    first = ingest_directory(store, str(docs), max_workers=1)
+    again = ingest_directory(store, str(docs), max_workers=1)
+    assert first["added"] > 0
+    assert again["added"] == 0 and again["requests"] == 0
+    assert again["unchanged"] == first["added"]
+
+
+class CountingEncoder:
+    """Stands in for tiktoken: one token per word, counting encode calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text, disallowed_special=()):
+        self.calls += 1
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+def test_fit_token_limit_encodes_each_chunk_once(monkeypatch):
+    encoder = CountingEncoder()
+    monkeypatch.setattr(tokens, "_TOKEN_ENCODER", encoder)
+    monkeypatch.setattr(tokens, "_TOKEN_ENCODER_LOADED", True)
+    chunks = [
+        Document(page_content="one two three", metadata={"i": i})
+        for i in range(3)
+    ]
+    fitted = list(fit_token_limit(chunks, max_tokens=10))
+    assert [c.metadata["tokenCount"] for c in fitted] == [3, 3, 3]
+    assert encoder.calls == 3
+
+    long = Document(page_content=" ".join(["word"] * 25), metadata={"i": 9})
+    pieces = list(fit_token_limit([long], max_tokens=10))
+    assert len(pieces) > 1
+    assert all(p.metadata["tokenCount"] <= 10 for p in pieces)
+    assert all(p.metadata["i"] == 9 for p in pieces)
+
+
+POLICY = "Remote employees must submit expense reports within thirty days.\n"
+
+
+def only_chunk(store, source):
+    (doc,) = stored_documents_by_source(store)[source].values()
+    return doc
+
+
+def test_cross_source_near_duplicate_is_merged(store, tmp_path):
+    docs = tmp_path / "docs"
+    write(docs / "a.md", "# Travel\n\n" + POLICY)
+    write(docs / "b.md", "# Expenses\n\n" + POLICY)
+    summary = ingest_directory(store, str(docs), max_workers=1)
+    assert summary["added"] == 1 and summary["duplicates"] == 1
+
+    kept = only_chunk(store, "dir:a.md")
+    assert kept.metadata["alsoIn"] == [
+        {"source": "dir:b.md", "headerPath": "Expenses"}
+    ]
+    hits = store.similarity_search(POLICY, k=2, filter={"source": "dir:b.md"})
+    assert [h.id for h in hits] == [kept.id]
+    assert store.similarity_search(POLICY, k=2, filter={"section": "Expenses"})
+    context, _ = build_context([(kept, 1.0)])
+    assert "also in dir:b.md" in context.splitlines()[0]
+
+    # Re-running changes nothing: the entry is dropped and recorded again.
+    again = ingest_directory(store, str(docs), max_workers=1)
+    assert again["added"] == 0
+    assert only_chunk(store, "dir:a.md").metadata["alsoIn"] == (
+        kept.metadata["alsoIn"]
+    )
+
+
+def test_reindex_drops_stale_also_in(store, tmp_path):
+    a = write(tmp_path / "a.md", "# Travel\n\n" + POLICY)
+    b = write(tmp_path / "b.md", "# Expenses\n\n" + POLICY)
+    reindex_document(store, str(a), hierarchical=False)
+    reindex_document(store, str(b), hierarchical=False)
+    assert "b.md" not in stored_documents_by_source(store)
+    assert only_chunk(store, "a.md").metadata["alsoIn"][0]["source"] == "b.md"
+
+    write(b, "# Expenses\n\nMeals are reimbursed up to fifty dollars a day.\n")
+    reindex_document(store, str(b), hierarchical=False)
+    assert "alsoIn" not in only_chunk(store, "a.md").metadata
+    assert store.similarity_search(POLICY, k=5, filter={"source": "b.md"})[
+        0
+    ].page_content.startswith("Meals")
+
+
+def test_same_source_near_duplicate_is_collapsed(store, tmp_path, capsys):
+    path = write(
+        tmp_path / "a.md",
+        "# Travel\n\n" + POLICY + "\n# Expenses\n\n" + POLICY,
+    )
+    reindex_document(store, str(path), hierarchical=False)
+    doc = only_chunk(store, "a.md")
+    assert "alsoIn" not in doc.metadata
+    out = capsys.readouterr().out
+    assert "Ingested 1/2 chunks" in out
+    assert "Collapsed 1 near-duplicate chunks" in out
+
+
+def sized(tokens):
+    return Document(page_content="x", metadata={"tokenCount": tokens})
+
+
+def test_batches_respect_token_and_item_budgets():
+    chunks = [sized(n) for n in (4, 4, 4, 30, 1, 1, 1, 1)]
+    batches = list(batch_chunks_by_tokens(iter(chunks), 10, max_items=3))
+    assert [[c.metadata["tokenCount"] for c in b] for b in batches] == [
+        [4, 4],
+        [4],
+        [30],
+        [1, 1, 1],
+        [1],
+    ]
+    assert list(batch_chunks_by_tokens([], 10)) == []
+
+
+def test_batched_load_uses_one_request_per_batch(store, capsys):
+    chunks = [
+        Document(page_content=f"Policy number {i} applies to all staff.")
+        for i in range(10)
+    ]
+    stored = load_document_with_chunks(
+        store, "policies.md", iter(chunks), max_batch_items=4
+    )
+    out = capsys.readouterr().out
+    assert stored == 10 and len(store) == 10
+    assert "Ingested 10/10 chunks" in out and "3 embedding requests" in out
+
+
+def test_reindex_embeds_only_changed_sections(store, tmp_path):
+    path = write(tmp_path / "EmployeeHandbook.md", HANDBOOK)
+    first = reindex_document(store, str(path), hierarchical=False)
+    assert first == {"added": 2, "removed": 0, "unchanged": 0}
+    write(path, HANDBOOK.replace("15 days", "20 days"))
+    second = reindex_document(store, str(path), hierarchical=False)
+    assert second == {"added": 1, "removed": 1, "unchanged": 1}
+    (doc,) = store.similarity_search(
+        "paid time off", k=1, filter={"section": "Vacation"}
+    )
+    assert "20 days" in doc.page_content
+
+
+def test_failed_reindex_keeps_the_old_chunks(store, tmp_path, monkeypatch):
+    path = write(tmp_path / "EmployeeHandbook.md", HANDBOOK)
+    reindex_document(store, str(path), hierarchical=False)
+    write(path, HANDBOOK.replace("15 days", "20 days"))
+
+    def fail(documents, **kwargs):
+        raise RuntimeError("embedding service unavailable")
+
+    with monkeypatch.context() as m:
+        m.setattr(store, "add_documents", fail)
+        failed = reindex_document(store, str(path), hierarchical=False)
+    assert failed == {"added": 0, "removed": 0, "unchanged": 1}
+    (doc,) = store.similarity_search(
+        "paid time off", k=1, filter={"section": "Vacation"}
+    )
+    assert "15 days" in doc.page_content
+
+    retried = reindex_document(store, str(path), hierarchical=False)
+    assert retried == {"added": 1, "removed": 1, "unchanged": 1}
+    assert len(store) == 2
+
+
+def test_failed_directory_batch_keeps_the_old_chunks(
+    store, tmp_path, monkeypatch
+):
+    docs = tmp_path / "docs"
+    write(docs / "handbook.md", HANDBOOK)
+    ingest_directory(store, str(docs), max_workers=1)
+    write(docs / "handbook.md", HANDBOOK.replace("15 days", "20 days"))
+
+    def fail(embeddings, texts, **kwargs):
+        raise RuntimeError("embedding service unavailable")
+
+    with monkeypatch.context() as m:
+        m.setattr(ingest, "embed_with_backoff", fail)
+        summary = ingest_directory(store, str(docs), max_workers=1)
+    assert (summary["failed"], summary["removed"]) == (1, 0)
+    texts = [
+        d.page_content
+        for d in stored_documents_by_source(store)["dir:handbook.md"].values()
+    ]
+    assert any("15 days" in text for text in texts)
+
+    summary = ingest_directory(store, str(docs), max_workers=1)
+    assert (summary["added"], summary["removed"]) == (1, 1)
+    assert len(store) == 2
@@ -0,0 +1,67 @@
+import pytest
+
+from lexical import BM25Index, is_keyword_query, reciprocal_rank_fusion
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "FMLA",
+        "401(k)",
+        "section 5.3",
+        "What is PTO?",
+        "What is the PTO policy?",
+        "How many PTO days do I get?",
+    ],
+)
+def test_keyword_queries(query):
+    assert is_keyword_query(query)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "",
+        "What is the?",
+        "how do I request time off",
+        "WHAT IS THIS",
+        "PTO accrual rules for part time staff",
+    ],
+)
+def test_not_keyword_queries(query):
+    assert not is_keyword_query(query)
+
+
+def test_bm25_ranks_rarer_and_more_frequent_terms_higher():
+    index = BM25Index()
+    index.add(
+        ["pto", "both", "health"],
+        [
+            "PTO PTO policy for staff",
+            "PTO and health policy",
+            "health insurance policy",
+        ],
+    )
+    assert [i for i, _ in index.search("PTO", k=5)] == ["pto", "both"]
+    assert index.search("policy", k=5)[0][1] > 0
+    assert [i for i, _ in index.search("PTO", allowed={"both"})] == ["both"]
+    assert index.search("dental") == []
+
+
+def test_bm25_remove_and_replace():
+    index = BM25Index()
+    index.add(["a", "b"], ["PTO rules", "dental plan"])
+    index.remove(["a", "missing"])
+    assert len(index) == 1 and "pto" not in index.postings
+    index.add(["b"], ["PTO rules"])
+    assert len(index) == 1 and "dental" not in index.postings
+    assert index.search("PTO")[0][0] == "b"
+
+
+def test_reciprocal_rank_fusion():
+    vector = [("a", 0.9), ("b", 0.8), ("c", 0.1)]
+    keyword = [("c", 12.0), ("a", 3.0)]
+    fused = reciprocal_rank_fusion([vector, keyword], k=2, c=60)
+    assert [i for i, _ in fused] == ["a", "c"]
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 62)
+    assert reciprocal_rank_fusion([], k=3) == []
@@ -0,0 +1,86 @@
+import pytest
+
+from hashing_embeddings import HashingEmbeddings
+from metadata_filter import MetadataFilterIndex
+from vector_store import MmapVectorStore
+
+SECTIONS = {
+    "intro": "Handbook > 1. Introduction",
+    "scope": "Handbook > 1.2 Scope",
+    "travel": "Handbook > 10. Travel",
+    "conduct": "Handbook > 11. Conduct",
+    "pay": "Handbook > 2.1 Pay",
+    "benefits": "Handbook > 4. Compensation and Benefits",
+}
+
+
+@pytest.fixture
+def index():
+    index = MetadataFilterIndex()
+    index.add(
+        list(SECTIONS),
+        [
+            {"source": "handbook.md", "headerPath": path}
+            for path in SECTIONS.values()
+        ],
+    )
+    return index
+
+
+def test_section_numbers_match_whole_numbers(index):
+    assert index.matching({"section": "1"}) == {"intro", "scope"}
+    assert index.matching({"section": "10"}) == {"travel"}
+    assert index.matching({"section": "2.1"}) == {"pay"}
+
+
+def test_words_match_case_insensitively(index):
+    assert index.matching({"section": "benefits"}) == {"benefits"}
+    assert index.matching({"section": "Benefit"}) == set()
+    assert index.matching({"source": "handbook.md", "section": "Pay"}) == {
+        "pay"
+    }
+
+
+def test_contains_opts_into_substring_matching(index):
+    assert index.matching({"section": {"contains": "Benefit"}}) == {
+        "benefits"
+    }
+    assert index.matching({"section": {"contains": "1"}}) == {
+        "intro",
+        "scope",
+        "travel",
+        "conduct",
+        "pay",
+    }
+    with pytest.raises(ValueError):
+        index.matching({"section": {"startswith": "1"}})
+
+
+def test_lists_match_any_value(index):
+    assert index.matching({"section": ["10", "11"]}) == {"travel", "conduct"}
+
+
+def test_unknown_field_and_removal(index):
+    with pytest.raises(ValueError):
+        index.matching({"author": "HR"})
+    index.remove(["intro"])
+    assert index.matching({"section": "1"}) == {"scope"}
+    assert "Handbook > 1. Introduction" not in index.values("section")
+
+
+def test_store_filters_broad_and_narrow():
+    store = MmapVectorStore(HashingEmbeddings(64))
+    texts = [f"Policy number {i} about leave and pay." for i in range(40)]
+    store.add_texts(
+        texts,
+        metadatas=[
+            {"source": "a.md" if i % 10 else "b.md"} for i in range(40)
+        ],
+    )
+    vector = store.embeddings.embed_query("leave policy")
+    for source, count in (("a.md", 36), ("b.md", 4)):
+        hits = store.similarity_search_with_score_by_vector(
+            vector, k=50, filter={"source": source}
+        )
+        assert len(hits) == count
+        assert {doc.metadata["source"] for doc, _ in hits} == {source}
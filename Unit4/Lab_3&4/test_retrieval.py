@@ -0,0 +1,86 @@
+from langchain_core.documents import Document
+
+from hashing_embeddings import HashingEmbeddings
+from retrieval import (
+    build_context,
+    format_search_results,
+    result_score_kind,
+    retrieve_with_score,
+)
+from vector_store import MmapVectorStore
+
+
+def make_store():
+    store = MmapVectorStore(HashingEmbeddings(64))
+    store.add_texts(
+        [
+            "Employees accrue 15 days of PTO per year.",
+            "Health insurance starts on the first day of employment.",
+        ],
+        metadatas=[{"source": "handbook.md"}, {"source": "benefits.md"}],
+    )
+    return store
+
+
+def test_score_kind_follows_the_retrieval_path():
+    store = make_store()
+    vector, results = retrieve_with_score(store, "PTO", k=1)
+    assert vector is None and result_score_kind(store, vector) == "BM25"
+    vector, _ = retrieve_with_score(store, "when does health cover begin")
+    assert result_score_kind(store, vector) == "RRF"
+    vector, _ = retrieve_with_score(store, "PTO", mode="vector")
+    assert result_score_kind(store, vector, mode="vector") == "cosine"
+
+
+def test_format_search_results_labels_scores():
+    results = [(Document(page_content="15 days"), 0.5)]
+    assert format_search_results(results, "BM25") == (
+        "Result 1 (Score (BM25): 0.5000): 15 days"
+    )
+    assert format_search_results(results) == (
+        "Result 1 (Score: 0.5000): 15 days"
+    )
+
+
+def chunk(text, index, source="handbook.md", section="Vacation"):
+    return Document(
+        page_content=text,
+        metadata={
+            "source": source,
+            "chunkIndex": index,
+            "headerPath": section,
+        },
+    )
+
+
+def test_build_context_merges_neighbours_and_drops_duplicates():
+    results = [
+        (chunk("Employees accrue 15 days of PTO.", 1), 0.9),
+        (chunk("of PTO. Unused days roll over.", 2), 0.7),
+        (chunk("15 days of PTO", 5), 0.6),
+        (chunk("Dental starts day one.", 1, "benefits.md", "Dental"), 0.8),
+    ]
+    context, info = build_context(results)
+    blocks = context.split("\n\n")
+    assert blocks == [
+        "[handbook.md, chunks 1-2 | Vacation]\n"
+        "Employees accrue 15 days of PTO. Unused days roll over.",
+        "[benefits.md, chunk 1 | Dental]\nDental starts day one.",
+    ]
+    assert info["chunks"] == 4 and info["duplicates"] == 1
+    assert info["blocks"] == 2 and info["skipped"] == 0
+
+
+def test_build_context_respects_the_token_budget():
+    long = " ".join(["policy"] * 400)
+    results = [
+        (chunk("Short answer.", 1), 0.9),
+        (chunk(long, 7), 0.5),
+    ]
+    context, info = build_context(
+        results, token_budget=60, min_block_tokens=20
+    )
+    assert context.startswith("[handbook.md, chunk 1 | Vacation]")
+    assert context.endswith("…") and info["context_tokens"] <= 60
+    _, info = build_context(results, token_budget=30, min_block_tokens=20)
+    assert info["blocks"] == 1 and info["skipped"] == 1
@@ -0,0 +1,116 @@
+import numpy as np
+
+from search_engine import VectorSearchEngine
+
+
+def random_vectors(n, dim=32, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, dim))
+
+
+def brute_force(vectors, query, k):
+    unit = VectorSearchEngine.normalize(vectors)
+    scores = unit @ VectorSearchEngine.normalize(query)[0]
+    return [int(i) for i in np.argsort(-scores, kind="stable")[:k]]
+
+
+def test_search_matches_brute_force():
+    vectors = random_vectors(500)
+    engine = VectorSearchEngine()
+    engine.add(list(range(500)), vectors)
+    query = random_vectors(1, seed=1)[0]
+    hits = engine.search(query, k=5)
+    assert [i for i, _ in hits] == brute_force(vectors, query, 5)
+    assert all(a[1] >= b[1] for a, b in zip(hits, hits[1:]))
+
+
+def test_search_batch_matches_single_queries():
+    engine = VectorSearchEngine()
+    engine.add(list(range(200)), random_vectors(200))
+    queries = random_vectors(4, seed=2)
+    batch = engine.search_batch(queries, k=3)
+    for hits, q in zip(batch, queries):
+        single = engine.search(q, k=3)
+        assert [i for i, _ in hits] == [i for i, _ in single]
+        np.testing.assert_allclose(
+            [s for _, s in hits], [s for _, s in single], rtol=1e-5
+        )
+
+
+def test_incremental_add_keeps_ids_in_row_order():
+    vectors = random_vectors(3000)
+    engine = VectorSearchEngine()
+    for start in range(0, 3000, 7):
+        engine.add(
+            list(range(start, min(start + 7, 3000))),
+            vectors[start:start + 7],
+        )
+    assert engine.ids == list(range(3000))
+    assert engine.search(vectors[1234], k=1)[0][0] == 1234
+
+
+def test_remove_tombstones_rows_without_copying():
+    vectors = random_vectors(100)
+    engine = VectorSearchEngine()
+    engine.add(list(range(100)), vectors)
+    matrix = engine.matrix
+    assert engine.remove([3, 3, 999]) == [3]
+    # Below the compaction threshold the matrix is left as it is.
+    assert engine.matrix is matrix
+    assert len(engine) == 99 and 3 not in engine
+    assert 3 not in engine.ids
+    assert 3 not in [i for i, _ in engine.search(vectors[3], k=99)]
+    assert len(engine.search(vectors[3], k=200)) == 99
+
+
+def test_compaction_past_threshold():
+    vectors = random_vectors(100)
+    engine = VectorSearchEngine(compact_ratio=0.25)
+    engine.add(list(range(100)), vectors)
+    engine.remove(list(range(20)))
+    assert len(engine.matrix) == 100
+    engine.remove(list(range(20, 30)))
+    assert len(engine.matrix) == 70 and engine.ids == list(range(30, 100))
+    assert engine.row_of(30) == 0
+    assert engine.search(vectors[50], k=1)[0][0] == 50
+
+
+def test_add_after_remove_and_live_matrix():
+    vectors = random_vectors(10)
+    engine = VectorSearchEngine()
+    engine.add(list(range(8)), vectors[:8])
+    engine.remove([1])
+    engine.add([8, 9], vectors[8:])
+    assert engine.ids == [0, 2, 3, 4, 5, 6, 7, 8, 9]
+    expected = VectorSearchEngine.normalize(np.delete(vectors, 1, axis=0))
+    np.testing.assert_allclose(engine.live_matrix(), expected, rtol=1e-6)
+    assert engine.search(vectors[9], k=1)[0][0] == 9
+
+
+def test_remove_everything():
+    engine = VectorSearchEngine()
+    engine.add(["a", "b"], random_vectors(2))
+    assert engine.remove(["a", "b"]) == ["a", "b"]
+    assert len(engine) == 0 and engine.search(random_vectors(1)[0]) == []
+
+
+def test_rows_subset_search():
+    vectors = random_vectors(50)
+    engine = VectorSearchEngine()
+    engine.add(list(range(50)), vectors)
+    rows = engine.rows_of([40, 10, 20, 77])
+    assert rows.tolist() == [10, 20, 40]
+    hits = engine.search(vectors[10], k=5, rows=rows)
+    assert [i for i, _ in hits][0] == 10 and len(hits) == 3
+
+
+def test_broad_row_filter_masks_instead_of_copying():
+    vectors = random_vectors(200)
+    engine = VectorSearchEngine(subset_scan_ratio=0.25)
+    engine.add(list(range(200)), vectors)
+    rows = engine.rows_of([i for i in range(200) if i % 3])
+    query = random_vectors(1, seed=3)[0]
+    hits = engine.search(query, k=10, rows=rows)
+    expected = engine._search_rows(engine.normalize(query), 10, rows)[0]
+    assert [i for i, _ in hits] == [i for i, _ in expected]
+    assert all(i % 3 for i, _ in hits)
+    assert len(engine.search(query, k=500, rows=rows)) == len(rows)
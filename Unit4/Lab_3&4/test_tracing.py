@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+import app
+import tracing
+from embedding_cache import CachedEmbeddings
+from hashing_embeddings import HashingEmbeddings
+from tracing import Tracer, trace_span
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    tracer = Tracer(enabled=True)
+    monkeypatch.setattr(tracing, "TRACER", tracer)
+    return tracer
+
+
+def test_spans_nest_and_count_errors(tracer):
+    with trace_span("outer") as outer:
+        with trace_span("inner", tokens=3):
+            pass
+    with pytest.raises(ValueError):
+        with trace_span("outer"):
+            raise ValueError("boom")
+    assert tracer.breakdown(outer).startswith("inner ")
+    assert tracer.totals["outer"]["count"] == 2
+    assert tracer.totals["outer"]["errors"] == 1
+    assert tracer.totals["inner"]["tokens"] == 3
+
+
+def test_tracing_off_is_a_no_op(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACER", Tracer(enabled=False))
+    with trace_span("stage") as span:
+        span.set(tokens=1)
+    assert tracing.TRACER.totals == {}
+
+
+def test_async_embedding_cache_calls_are_traced(tracer, tmp_path):
+    cache = CachedEmbeddings(
+        HashingEmbeddings(16), cache_path=str(tmp_path / "cache.sqlite")
+    )
+
+    async def embed():
+        await cache.aembed_documents(["a", "b"])
+        await cache.aembed_documents(["a"])
+        await cache.aembed_query("a")
+
+    asyncio.run(embed())
+    cache.close()
+    documents = tracer.totals["embed.documents"]
+    assert documents["count"] == 2 and documents["requests"] == 1
+    assert documents["cache_hits"] == 1
+    assert tracer.totals["embed.query_cache"]["cache_misses"] == 1
+
+
+class FailingExecutor:
+    def invoke(self, inputs):
+        raise RuntimeError("model unavailable")
+
+    def stream(self, inputs):
+        yield "partial"
+        raise RuntimeError("model unavailable")
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_failed_chat_turn_is_traced_as_failed(tracer, monkeypatch, streaming):
+    monkeypatch.setattr(app, "AGENT_STREAMING", streaming)
+    history = []
+    with trace_span("chat.turn") as turn:
+        app._chat_turn(FailingExecutor(), history, "PTO?", turn)
+    assert turn.attrs["error"] == "RuntimeError"
+    assert tracer.totals["chat.turn"]["errors"] == 1
+    assert history == []
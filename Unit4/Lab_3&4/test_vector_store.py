@@ -0,0 +1,181 @@
+import gc
+import io
+import os
+
+import numpy as np
+import pytest
+
+from chunking import iter_hierarchical_chunks, register_parent_sections
+from hashing_embeddings import HashingEmbeddings
+from vector_store import MmapVectorStore
+
+
+def texts(start, stop):
+    return [
+        f"Policy {i}: employees may request leave type {i}."
+        for i in range(start, stop)
+    ]
+
+
+def spill_file(store):
+    matrix = store.engine.matrix
+    assert isinstance(matrix, np.memmap) and store.engine._buffer is None
+    return os.path.realpath(matrix.filename)
+
+
+def test_int8_store_keeps_rows_in_a_spill_file(tmp_path):
+    store = MmapVectorStore(HashingEmbeddings(64), index="int8", rerank=20)
+    for start in range(0, 300, 50):
+        store.add_texts(texts(start, start + 50))
+    path = spill_file(store)
+    assert os.path.getsize(path) == 300 * 64 * 4
+    query = store.embeddings.embed_query(texts(123, 124)[0])
+    hit = store.similarity_search_with_score_by_vector(query, k=1)[0][0]
+    assert hit.page_content == texts(123, 124)[0]
+
+    # Past the compaction threshold the spill file is rewritten.
+    store.delete([doc.id for doc in store.get_by_ids(store.engine.ids[:100])])
+    assert spill_file(store) == path
+    assert os.path.getsize(path) == 200 * 64 * 4
+    hit = store.similarity_search_with_score_by_vector(query, k=1)[0][0]
+    assert hit.page_content == texts(123, 124)[0]
+
+    store.save(str(tmp_path / "snap"))
+    loaded = MmapVectorStore.load(
+        str(tmp_path / "snap"), HashingEmbeddings(64), index="int8"
+    )
+    np.testing.assert_array_equal(
+        loaded.engine.matrix, store.engine.live_matrix()
+    )
+    # Adding to a loaded snapshot copies it to the spill file, not to RAM.
+    loaded.add_texts(texts(300, 310))
+    assert spill_file(loaded) != path and len(loaded) == 210
+    loaded_path = spill_file(loaded)
+
+    del store, loaded, hit
+    gc.collect()
+    assert not os.path.exists(path) and not os.path.exists(loaded_path)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    store = MmapVectorStore(HashingEmbeddings(64))
+    ids = store.add_texts(
+        texts(0, 20), metadatas=[{"n": i} for i in range(20)]
+    )
+    store.delete(ids[:3])
+    store.save(str(tmp_path), extra={"version": 1})
+    loaded = MmapVectorStore.load(str(tmp_path), HashingEmbeddings(64))
+    assert loaded.engine.ids == ids[3:]
+    assert isinstance(loaded.engine.matrix, np.memmap)
+    np.testing.assert_array_equal(
+        loaded.engine.matrix, store.engine.live_matrix()
+    )
+    assert loaded.get_by_ids([ids[5]])[0].metadata == {"n": 5}
+    assert MmapVectorStore.read_snapshot_extra(str(tmp_path)) == {"version": 1}
+    query = store.embeddings.embed_query(texts(7, 8)[0])
+    assert (
+        loaded.similarity_search_with_score_by_vector(query, k=1)[0][0].id
+        == ids[7]
+    )
+
+
+def test_int8_store_search_after_delete_and_regrowth():
+    store = MmapVectorStore(HashingEmbeddings(64), index="int8")
+    first = store.add_texts([f"policy number {i}" for i in range(100)])
+    store.delete(first[:2])
+    store.add_texts([f"benefit number {i}" for i in range(150)])
+    hits = store.similarity_search("policy number 0", k=5)
+    assert len(hits) == 5 and not {h.id for h in hits} & set(first[:2])
+
+
+def test_load_defers_index_building_to_first_use(tmp_path):
+    store = MmapVectorStore(HashingEmbeddings(64), index="int8")
+    ids = store.add_texts(
+        texts(0, 50), metadatas=[{"source": f"{i % 2}.md"} for i in range(50)]
+    )
+    store.save(str(tmp_path))
+    loaded = MmapVectorStore.load(
+        str(tmp_path), HashingEmbeddings(64), index="int8"
+    )
+    assert loaded._lexical is None and loaded._filters is None
+    assert not loaded.engine.index.trained
+
+    query = store.embeddings.embed_query(texts(7, 8)[0])
+    hits = loaded.similarity_search_with_score_by_vector(
+        query, k=1, filter={"source": "1.md"}
+    )
+    assert hits[0][0].id == ids[7] and loaded.engine.index.trained
+    assert [d.id for d, _ in loaded.keyword_search("Policy 7", k=1)] == [
+        ids[7]
+    ]
+
+
+def test_interrupted_save_keeps_the_previous_snapshot(tmp_path, monkeypatch):
+    store = MmapVectorStore(HashingEmbeddings(64))
+    store.add_texts(texts(0, 10))
+    store.save(str(tmp_path), extra={"version": 1})
+    store.add_texts(texts(10, 20))
+
+    def crash(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", crash)
+    with pytest.raises(OSError):
+        store.save(str(tmp_path), extra={"version": 2})
+    monkeypatch.undo()
+    loaded = MmapVectorStore.load(str(tmp_path), HashingEmbeddings(64))
+    assert len(loaded) == 10 and loaded.engine.matrix.shape == (10, 64)
+    assert MmapVectorStore.read_snapshot_extra(str(tmp_path)) == {"version": 1}
+
+    store.save(str(tmp_path), extra={"version": 3})
+    vectors = [n for n in os.listdir(tmp_path) if n.endswith(".npy")]
+    assert len(vectors) == 1
+    assert (
+        len(MmapVectorStore.load(str(tmp_path), HashingEmbeddings(64))) == 20
+    )
+
+
+HANDBOOK = """# Handbook
+
+## Vacation
+
+Employees accrue 15 days of paid time off per year. Unused days carry
+over. Requests go to your manager two weeks ahead.
+
+## Benefits
+
+Health insurance starts on the first day. Dental cover is optional.
+"""
+
+
+def test_parent_sections_are_deduplicated_and_survive_save_and_load(
+    tmp_path,
+):
+    store = MmapVectorStore(HashingEmbeddings(64))
+    passages = list(
+        register_parent_sections(
+            store,
+            iter_hierarchical_chunks(
+                io.StringIO(HANDBOOK), "handbook.md", passage_tokens=8
+            ),
+        )
+    )
+    assert {c.metadata["level"] for c in passages} == {"passage"}
+    assert {c.metadata["parentId"] for c in passages} == set(store.parents)
+    assert len(store.parents) == 2 and len(passages) > 2
+    store.add_documents(passages)
+
+    results = store.similarity_search_with_score("paid time off", k=10)
+    expanded = store.expand_to_parents(results, k=10)
+    assert sorted(doc.id for doc, _ in expanded) == sorted(store.parents)
+    top, score = expanded[0]
+    assert top.metadata["level"] == "section"
+    assert "15 days" in top.page_content and score == results[0][1]
+
+    store.save(str(tmp_path))
+    loaded = MmapVectorStore.load(str(tmp_path), HashingEmbeddings(64))
+    assert loaded.parents == store.parents
+    reloaded = loaded.expand_to_parents(
+        loaded.similarity_search_with_score("paid time off", k=10), k=10
+    )
+    assert [doc.id for doc, _ in reloaded] == [doc.id for doc, _ in expanded]
@@ -0,0 +1,112 @@
+"""
+Token counting for chunk sizing and prompt budgets.
+
+Uses tiktoken when it (and its cached encoding files) are available and
+falls back to estimates otherwise.
+"""
+import math
+import os
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# Optional: exact token counts for chunking and request budgeting. Without
+# it (or without its cached encoding files) counts fall back to estimates
+# and the embedding limit is enforced on the UTF-8 byte length instead.
+try:
+    import tiktoken
+except Exception:
+    tiktoken = None
+
+
+# text-embedding-3-small rejects any single input longer than this.
+EMBEDDING_MAX_TOKENS = 8191
+# Target chunk size (and overlap) of the token-aware chunkers, comfortably
+# below EMBEDDING_MAX_TOKENS; 2000 tokens is roughly the 8000 characters the
+# markdown chunker used to be sized in.
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", "2000"))
+CHUNK_TOKEN_OVERLAP = int(os.getenv("CHUNK_TOKEN_OVERLAP", "50"))
+
+# Tokenizer of the text-embedding-3 models.
+EMBEDDING_ENCODING = "cl100k_base"
+
+_TOKEN_ENCODER = None
+_TOKEN_ENCODER_LOADED = False
+
+
+def _token_encoder():
+    """The tiktoken encoding, loaded once.
+
+    None when tiktoken or its encoding files are unavailable.
+    """
+    global _TOKEN_ENCODER, _TOKEN_ENCODER_LOADED
+    if not _TOKEN_ENCODER_LOADED:
+        _TOKEN_ENCODER_LOADED = True
+        if tiktoken is not None:
+            try:
+                _TOKEN_ENCODER = tiktoken.get_encoding(EMBEDDING_ENCODING)
+            except Exception as e:
+                print(
+                    f"⚠️ tiktoken encoding '{EMBEDDING_ENCODING}' "
+                    f"unavailable ({e}); using token estimates."
+                )
+    return _TOKEN_ENCODER
+
+
+def count_tokens(text: str) -> int:
+    """Exact token count with tiktoken, else an estimate (~4 chars/token)."""
+    encoder = _token_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return max(1, math.ceil(len(text) / 4))
+
+
+def token_upper_bound(text: str) -> int:
+    """
+    A count that is never below the real token count: exact with tiktoken,
+    else the UTF-8 byte length (every BPE token covers at least one byte).
+    Use this to decide whether an input fits EMBEDDING_MAX_TOKENS.
+    """
+    encoder = _token_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return len(text.encode("utf-8"))
+
+
+def token_count_and_bound(text: str) -> tuple:
+    """(`count_tokens(text)`, `token_upper_bound(text)`), encoding once.
+
+    With tiktoken both are the same exact count.
+    """
+    encoder = _token_encoder()
+    if encoder is not None:
+        count = len(encoder.encode(text, disallowed_special=()))
+        return count, count
+    return max(1, math.ceil(len(text) / 4)), len(text.encode("utf-8"))
+
+
+def token_text_splitter(
+    chunk_tokens: int = CHUNK_TOKEN_BUDGET,
+    overlap_tokens: int = CHUNK_TOKEN_OVERLAP,
+):
+    """A `RecursiveCharacterTextSplitter` sized in tokens (`count_tokens`)."""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_tokens,
+        chunk_overlap=overlap_tokens,
+        length_function=count_tokens,
+    )
+
+
+def truncate_to_tokens(
+    text: str, max_tokens: int, keep_end: bool = False
+) -> str:
+    """Cut `text` to at most `max_tokens` tokens (by `count_tokens`).
+
+    Keeps the start of the text, or the end with `keep_end`.
+    """
+    encoder = _token_encoder()
+    if encoder is not None:
+        tokens = encoder.encode(text, disallowed_special=())
+        return encoder.decode(
+            tokens[-max_tokens:] if keep_end else tokens[:max_tokens]
+        )
+    return text[-max_tokens * 4:] if keep_end else text[:max_tokens * 4]
@@ -0,0 +1,242 @@
+"""
+Lightweight span tracing for the retrieval and agent pipeline.
+
+TRACE=1 turns it on; `trace_span()` is the one entry point used by the
+rest of the code.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+
+# Tracing: TRACE=1 records a span (name, duration, attributes such as
+# token counts and cache hits) for every pipeline stage. TRACE_EXPORT is
+# written on exit: a path ending in ".prom" gets the Prometheus text
+# format, anything else JSON lines.
+TRACE_ENABLED = os.getenv("TRACE", "0") == "1"
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "")
+# Numeric span attributes that are summed per span name in `Tracer.totals`.
+TRACE_COUNTERS = (
+    "tokens",
+    "prompt_tokens",
+    "completion_tokens",
+    "cache_hits",
+    "cache_misses",
+    "requests",
+)
+
+
+class _NoopSpan:
+    """What `trace_span()` returns while tracing is off: all no-ops."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+_CURRENT_SPAN = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed stage. Use as a context manager; `set()` adds attributes.
+    A span left by an exception, or given an `error` attribute (e.g. a
+    handled failure), counts as failed.
+    """
+
+    __slots__ = (
+        "tracer",
+        "name",
+        "attrs",
+        "span_id",
+        "parent_id",
+        "start",
+        "duration",
+        "_t0",
+        "_token",
+    )
+
+    def __init__(self, tracer, name: str, attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = None
+        self.start = None
+        self.duration = None
+
+    def __enter__(self):
+        parent = _CURRENT_SPAN.get()
+        self.parent_id = parent.span_id if parent is not None else None
+        self._token = _CURRENT_SPAN.set(self)
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._t0
+        _CURRENT_SPAN.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.record(self)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class Tracer:
+    """
+    Collects `Span`s. Disabled, `trace_span()` hands back a shared no-op
+    object, so an instrumented call costs one attribute check.
+
+    Finished spans are kept in a bounded ring (`max_spans`) for JSON lines
+    export, and aggregated per span name (count, total/max seconds, summed
+    `TRACE_COUNTERS`, cache hits) for the Prometheus text dump. Parent
+    links follow the calling context (contextvars), so they stay right in
+    threads and asyncio tasks alike.
+    """
+
+    def __init__(self, enabled: bool = TRACE_ENABLED, max_spans: int = 10000):
+        self.enabled = enabled
+        self.spans = deque(maxlen=max_spans)
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def record_span(self, name: str, seconds: float, **attrs):
+        """
+        Record an already-timed stage under the current span. For work that
+        can't sit inside one `with` block, such as a generator consumed over
+        many calls.
+        """
+        if not self.enabled:
+            return
+        span = Span(self, name, attrs)
+        parent = _CURRENT_SPAN.get()
+        span.parent_id = parent.span_id if parent is not None else None
+        span.start = time.time() - seconds
+        span.duration = seconds
+        self.record(span)
+
+    def record(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+            total = self.totals.setdefault(
+                span.name,
+                {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "errors": 0},
+            )
+            total["count"] += 1
+            total["seconds"] += span.duration
+            total["max_seconds"] = max(total["max_seconds"], span.duration)
+            if "error" in span.attrs:
+                total["errors"] += 1
+            if span.attrs.get("cache_hit") is not None:
+                key = (
+                    "cache_hits" if span.attrs["cache_hit"] else "cache_misses"
+                )
+                total[key] = total.get(key, 0) + 1
+            for key in TRACE_COUNTERS:
+                value = span.attrs.get(key)
+                if isinstance(value, (int, float)) and not isinstance(
+                    value, bool
+                ):
+                    total[key] = total.get(key, 0) + value
+
+    def breakdown(self, span) -> str:
+        """One-line 'name 12ms, ...' summary of the children of `span`."""
+        if not isinstance(span, Span):
+            return ""
+        with self._lock:
+            direct = [s for s in self.spans if s.parent_id == span.span_id]
+        parts = [
+            f"{s.name} {s.duration * 1000:.0f}ms"
+            for s in sorted(direct, key=lambda s: s.start)
+        ]
+        return ", ".join(parts)
+
+    def to_jsonl(self) -> str:
+        with self._lock:
+            spans = list(self.spans)
+        return "".join(
+            json.dumps(
+                {
+                    "name": s.name,
+                    "span_id": s.span_id,
+                    "parent_id": s.parent_id,
+                    "start": s.start,
+                    "duration_ms": round(s.duration * 1000, 3),
+                    "attrs": s.attrs,
+                },
+                default=str,
+            )
+            + "\n"
+            for s in spans
+        )
+
+    def to_prometheus(self, prefix: str = "rag") -> str:
+        with self._lock:
+            totals = {name: dict(t) for name, t in self.totals.items()}
+        lines = [
+            f"# HELP {prefix}_span_seconds Time spent in each pipeline stage.",
+            f"# TYPE {prefix}_span_seconds summary",
+        ]
+        for name, t in sorted(totals.items()):
+            lines.append(
+                f'{prefix}_span_seconds_count{{span="{name}"}} {t["count"]}'
+            )
+            lines.append(
+                f'{prefix}_span_seconds_sum{{span="{name}"}} '
+                f'{t["seconds"]:.6f}'
+            )
+        lines += [
+            f"# HELP {prefix}_span_max_seconds Slowest single span per stage.",
+            f"# TYPE {prefix}_span_max_seconds gauge",
+        ]
+        lines += [
+            f'{prefix}_span_max_seconds{{span="{name}"}} '
+            f'{t["max_seconds"]:.6f}'
+            for name, t in sorted(totals.items())
+        ]
+        for key in ("errors",) + TRACE_COUNTERS:
+            rows = [
+                (name, t[key])
+                for name, t in sorted(totals.items())
+                if t.get(key)
+            ]
+            if rows:
+                lines += [f"# TYPE {prefix}_{key}_total counter"]
+                lines += [
+                    f'{prefix}_{key}_total{{span="{name}"}} {value}'
+                    for name, value in rows
+                ]
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str):
+        """Write the spans as JSON lines, or Prometheus text for `.prom`."""
+        text = (
+            self.to_prometheus() if path.endswith(".prom") else self.to_jsonl()
+        )
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+TRACER = Tracer()
+
+
+def trace_span(name: str, **attrs):
+    """`with trace_span("stage", key=value) as span:` on `TRACER`."""
+    if not TRACER.enabled:
+        return _NOOP_SPAN
+    return Span(TRACER, name, attrs)
@@ -0,0 +1,618 @@
+"""
+`MmapVectorStore`: a LangChain vector store over one float32 matrix, with
+BM25, metadata-filter and near-duplicate indexes kept alongside.
+"""
+import asyncio
+import json
+import os
+import tempfile
+import uuid
+import weakref
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from ann_index import VECTOR_INDEX, create_index
+from lexical import BM25Index, is_keyword_query, reciprocal_rank_fusion
+from metadata_filter import MetadataFilterIndex
+from near_duplicates import NearDuplicateIndex
+from query_memo import QueryEmbeddingMemo
+from search_engine import VectorSearchEngine
+from tracing import trace_span
+
+
+# With the int8 index, full-precision rows are kept in a spill file in this
+# directory (default: the system temp directory) rather than in RAM.
+VECTOR_SPILL_DIR = os.getenv("VECTOR_SPILL_DIR") or None
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class MmapVectorStore(VectorStore):
+    """
+    Vector store that keeps every embedding in one contiguous float32 matrix.
+
+    Vectors are L2-normalized on insert and searched with
+    `VectorSearchEngine`, so cosine similarity is a single matrix product.
+    Pass `index="ivf"` (or set VECTOR_INDEX=ivf) to put an approximate
+    `IVFIndex` in front of the exact scoring for large corpora, or
+    `index="int8"` to search int8 codes (`Int8Index`) and rescore only the
+    shortlist against the full-precision matrix, which then stays on disk:
+    added rows go to a spill file (in VECTOR_SPILL_DIR, removed with the
+    store) and a loaded snapshot stays mapped. `index="pca"` /
+    `"truncate"` (`ReducedDimIndex`) runs a coarse pass on
+    reduced-dimension vectors first.
+    `save()` writes the matrix as a `vectors-*.npy` file plus a
+    `metadata.json` sidecar (ids, texts, metadata, parent sections, and the
+    name of that vectors file); `load()` maps the matrix back in with
+    `mmap_mode="r"`, so startup costs one file open instead of re-embedding
+    every document. The BM25, metadata-filter and ANN indexes of a loaded
+    store are built on first use rather than at startup. Adding to a
+    loaded store copies the matrix into memory first (copy-on-write), or
+    into the spill file with int8.
+
+    Query embeddings go through `embed_queries()`: a query that is exactly
+    the text of a stored chunk reuses that chunk's vector, recent queries
+    come from a `QueryEmbeddingMemo`, and everything else is embedded in a
+    single request. `search_many()` scores a whole list of queries at once.
+
+    Every stored chunk is also indexed in a `BM25Index` (`lexical`), used by
+    `keyword_search()` and the fused `hybrid_search_with_score()`, and in a
+    `MetadataFilterIndex` (`filters`): every search method takes a
+    `filter` dict (e.g. {"source": "HealthInsuranceBrochure.md"}) that
+    restricts the results to the matching chunks (a narrow filter scores
+    only those; see `VectorSearchEngine`).
+
+    Section-level chunks can be kept as `parents` (`add_parents`): text only,
+    never embedded. Stored chunks point at theirs through `parentId`
+    metadata, and `expand_to_parents()` turns passage hits into their
+    sections.
+    """
+
+    # Snapshots written before the vectors file was versioned use this name.
+    VECTORS_FILE = "vectors.npy"
+    METADATA_FILE = "metadata.json"
+
+    def __init__(
+        self, embedding: Embeddings, index: str = VECTOR_INDEX, **index_params
+    ):
+        self.embedding = embedding
+        self.index_name = index
+        self.index_params = index_params
+        self._spill_path = None
+        if index == "int8":
+            fd, self._spill_path = tempfile.mkstemp(
+                prefix="vectors-", suffix=".f32", dir=VECTOR_SPILL_DIR
+            )
+            os.close(fd)
+            weakref.finalize(self, _remove_file, self._spill_path)
+        self.engine = self._new_engine()
+        # id -> (text, metadata)
+        self._docs = {}
+        # Called with the ids that were replaced or removed (None = all).
+        self._change_listeners = []
+        self.query_memo = QueryEmbeddingMemo()
+        # text -> id of a stored chunk with that text; built on first use.
+        self._text_ids = None
+        # BM25 and metadata-filter indexes; None until first use after a
+        # load (see the `lexical` and `filters` properties).
+        self._lexical = BM25Index()
+        self._filters = MetadataFilterIndex()
+        # SimHash index for near-duplicate checks; built on first use.
+        self._near_duplicates = None
+        # parent id -> (text, metadata) of section chunks that aren't embedded.
+        self.parents = {}
+
+    def _new_engine(self) -> VectorSearchEngine:
+        return VectorSearchEngine(
+            index=create_index(self.index_name, **self.index_params),
+            spill_path=self._spill_path,
+        )
+
+    @property
+    def near_duplicates(self) -> NearDuplicateIndex:
+        """SimHash index of every stored chunk.
+
+        Built on first access, then kept up to date.
+        """
+        if self._near_duplicates is None:
+            index = NearDuplicateIndex()
+            index.add_texts(
+                list(self._docs), [text for text, _ in self._docs.values()]
+            )
+            self._near_duplicates = index
+        return self._near_duplicates
+
+    @property
+    def lexical(self) -> BM25Index:
+        """BM25 index of every stored chunk (built on first use after a
+        load)."""
+        if self._lexical is None:
+            index = BM25Index()
+            index.add(
+                list(self._docs), [text for text, _ in self._docs.values()]
+            )
+            self._lexical = index
+        return self._lexical
+
+    @property
+    def filters(self) -> MetadataFilterIndex:
+        """Metadata-filter index of every stored chunk (built on first use
+        after a load)."""
+        if self._filters is None:
+            index = MetadataFilterIndex()
+            index.add(
+                list(self._docs), [meta for _, meta in self._docs.values()]
+            )
+            self._filters = index
+        return self._filters
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return len(self.engine)
+
+    def add_change_listener(self, callback):
+        """
+        Register `callback(ids)`, called whenever stored chunks are replaced
+        or deleted (`ids` is None when the whole store is cleared). Caches
+        keyed on chunk ids use this to drop stale entries.
+        """
+        self._change_listeners.append(callback)
+
+    def _notify_changed(self, ids):
+        for callback in self._change_listeners:
+            callback(ids)
+
+    def add_vectors(
+        self, texts: list, vectors, metadatas: list = None, ids: list = None
+    ) -> list:
+        """Store `texts` with already-computed `vectors`. Returns their ids."""
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = [i or uuid.uuid4().hex for i in (ids or [None] * len(texts))]
+
+        # Re-adding an existing id replaces the old entry.
+        self.delete([i for i in ids if i in self.engine])
+
+        self.engine.add(ids, vectors)
+        if self._lexical is not None:
+            self._lexical.add(ids, texts)
+        if self._filters is not None:
+            self._filters.add(ids, metadatas)
+        if self._near_duplicates is not None:
+            self._near_duplicates.add_texts(ids, texts)
+        for doc_id, text, meta in zip(ids, texts, metadatas):
+            self._docs[doc_id] = (text, dict(meta or {}))
+        self._text_ids = None
+        return ids
+
+    def add_texts(
+        self, texts, metadatas: list = None, *, ids: list = None, **kwargs
+    ) -> list:
+        """Embed `texts` in one `embed_documents` call and store them."""
+        texts = list(texts)
+        if not texts:
+            return []
+        # Local backends hand back a matrix directly, skipping the
+        # per-float list round trip of `embed_documents`.
+        embed_matrix = getattr(self.embedding, "embed_matrix", None)
+        vectors = (
+            embed_matrix(texts)
+            if embed_matrix
+            else self.embedding.embed_documents(texts)
+        )
+        return self.add_vectors(texts, vectors, metadatas=metadatas, ids=ids)
+
+    def delete(self, ids: list = None, **kwargs) -> bool:
+        """Remove the given ids (all entries if `ids` is None)."""
+        if ids is None:
+            self.engine = self._new_engine()
+            self._docs = {}
+            self._text_ids = None
+            self._lexical = BM25Index()
+            self._filters = MetadataFilterIndex()
+            self._near_duplicates = None
+            self.parents = {}
+            self._notify_changed(None)
+            return True
+        removed = self.engine.remove(ids)
+        if self._lexical is not None:
+            self._lexical.remove(removed)
+        if self._filters is not None:
+            self._filters.remove(removed)
+        if self._near_duplicates is not None:
+            self._near_duplicates.remove(removed)
+        for doc_id in removed:
+            self._docs.pop(doc_id, None)
+        if removed:
+            self._text_ids = None
+            self._notify_changed(removed)
+        return bool(removed)
+
+    def _document(self, doc_id) -> Document:
+        text, meta = self._docs[doc_id]
+        return Document(id=doc_id, page_content=text, metadata=dict(meta))
+
+    def add_parents(self, documents):
+        """
+        Keep `documents` (with ids) as parent sections, without embedding
+        them. Re-adding an id replaces it; parents no stored chunk points at
+        any more are dropped on `save()`.
+        """
+        for doc in documents:
+            self.parents[doc.id] = (doc.page_content, dict(doc.metadata or {}))
+
+    def expand_to_parents(self, results: list, k: int) -> list:
+        """
+        Replace each (chunk, score) hit in `results` by its parent section,
+        scored by its best passage, keeping the first `k` distinct results.
+        Chunks without a known parent are kept as they are.
+        """
+        expanded = []
+        seen = set()
+        for doc, score in results:
+            parent_id = (doc.metadata or {}).get("parentId")
+            if parent_id in self.parents:
+                text, meta = self.parents[parent_id]
+                doc = Document(
+                    id=parent_id, page_content=text, metadata=dict(meta)
+                )
+            if doc.id in seen:
+                continue
+            seen.add(doc.id)
+            expanded.append((doc, score))
+            if len(expanded) == k:
+                break
+        return expanded
+
+    def get_by_ids(self, ids) -> list:
+        """Return the stored documents for `ids`, skipping unknown ids."""
+        return [self._document(i) for i in ids if i in self._docs]
+
+    def iter_documents(self):
+        """Yield every stored document in row order."""
+        for doc_id in list(self.engine.ids):
+            yield self._document(doc_id)
+
+    def update_metadata(self, doc_id, metadata: dict):
+        """Replace the metadata of `doc_id` without touching its vector."""
+        text, _ = self._docs[doc_id]
+        self._docs[doc_id] = (text, dict(metadata))
+        if self._filters is not None:
+            self._filters.add([doc_id], [metadata])
+
+    def _filtered(self, filter: dict):
+        """(allowed ids, their engine rows) for a metadata `filter`.
+
+        Returns (None, None) when there is no filter.
+        """
+        if not filter:
+            return None, None
+        allowed = self.filters.matching(filter)
+        return allowed, self.engine.rows_of(allowed)
+
+    def similarity_search_with_score_by_vectors(
+        self, embeddings, k: int = 4, filter: dict = None
+    ) -> list:
+        """Batch variant: one result list per query vector, one matmul."""
+        _, rows = self._filtered(filter)
+        return [
+            [(self._document(doc_id), score) for doc_id, score in hits]
+            for hits in self.engine.search_batch(embeddings, k, rows)
+        ]
+
+    def similarity_search_with_score_by_vector(
+        self, embedding, k: int = 4, filter: dict = None, **kwargs
+    ) -> list:
+        """Return the `k` documents closest to `embedding`, with cosines."""
+        _, rows = self._filtered(filter)
+        return [
+            (self._document(doc_id), score)
+            for doc_id, score in self.engine.search(embedding, k, rows)
+        ]
+
+    def _known_vectors(self, queries: list) -> dict:
+        """Vectors for `queries` available without an embedding call.
+
+        Keyed by position in `queries`.
+        """
+        if self._text_ids is None:
+            self._text_ids = {
+                text: doc_id for doc_id, (text, _) in self._docs.items()
+            }
+        known = {}
+        for pos, query in enumerate(queries):
+            doc_id = self._text_ids.get(query)
+            if doc_id is not None:
+                known[pos] = self.engine.matrix[self.engine.row_of(doc_id)]
+                continue
+            vector = self.query_memo.get(query)
+            if vector is not None:
+                known[pos] = vector
+        return known
+
+    def embed_queries(self, queries: list) -> list:
+        """
+        Embed `queries`, reusing stored chunk vectors and memoized queries.
+        Whatever is left is embedded in one request (`embed_documents`; the
+        OpenAI embedding models treat queries and documents alike), or with
+        `embed_query` when only one query is missing.
+        """
+        queries = list(queries)
+        with trace_span("embed.query", queries=len(queries)) as span:
+            known = self._known_vectors(queries)
+            missing = [pos for pos in range(len(queries)) if pos not in known]
+            span.set(
+                cache_hits=len(known),
+                cache_misses=len(missing),
+                requests=1 if missing else 0,
+            )
+            if len(missing) == 1:
+                fresh = [self.embedding.embed_query(queries[missing[0]])]
+            elif missing:
+                fresh = self.embedding.embed_documents(
+                    [queries[pos] for pos in missing]
+                )
+            else:
+                fresh = []
+        for pos, vector in zip(missing, fresh):
+            self.query_memo.put(queries[pos], vector)
+            known[pos] = vector
+        return [known[pos] for pos in range(len(queries))]
+
+    def embed_query(self, query: str) -> list:
+        """Embed one query through `embed_queries`."""
+        return self.embed_queries([query])[0]
+
+    async def aembed_query(self, query: str) -> list:
+        """Async `embed_query`; only a memo/stored-text miss awaits the API."""
+        known = self._known_vectors([query])
+        if known:
+            return known[0]
+        vector = await self.embedding.aembed_query(query)
+        self.query_memo.put(query, vector)
+        return vector
+
+    def search_many(
+        self, queries: list, k: int = 4, filter: dict = None
+    ) -> list:
+        """
+        Search several queries at once: one embedding request for the ones
+        not already known, then one matmul for all of them. Returns one
+        [(doc, score), ...] list per query, in order.
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        return self.similarity_search_with_score_by_vectors(
+            self.embed_queries(queries), k=k, filter=filter
+        )
+
+    def keyword_search(
+        self, query: str, k: int = 4, filter: dict = None
+    ) -> list:
+        """
+        Lexical-only fast path: BM25 results for a keyword-like `query`
+        (see `is_keyword_query`), or [] when the query isn't keyword-like or
+        nothing matches. Never calls the embedding API.
+        """
+        if not is_keyword_query(query):
+            return []
+        allowed, _ = self._filtered(filter)
+        return [
+            (self._document(doc_id), score)
+            for doc_id, score in self.lexical.search(query, k, allowed)
+        ]
+
+    def hybrid_search_with_score_by_vector(
+        self,
+        query: str,
+        embedding,
+        k: int = 4,
+        fetch_k: int = None,
+        filter: dict = None,
+    ) -> list:
+        """
+        Fuse the top `fetch_k` vector hits for `embedding` with the top
+        `fetch_k` BM25 hits for `query` by reciprocal rank. Scores are RRF
+        scores, not cosine similarities.
+        """
+        fetch_k = fetch_k or max(4 * k, 20)
+        allowed, rows = self._filtered(filter)
+        vector_hits = self.engine.search(embedding, fetch_k, rows)
+        lexical_hits = self.lexical.search(query, fetch_k, allowed)
+        return [
+            (self._document(doc_id), score)
+            for doc_id, score in reciprocal_rank_fusion(
+                [vector_hits, lexical_hits], k
+            )
+        ]
+
+    def hybrid_search_with_score(
+        self, query: str, k: int = 4, fetch_k: int = None, filter: dict = None
+    ) -> list:
+        """Keyword fast path when it applies, else hybrid BM25 + vector search.
+
+        The hybrid path embeds `query` and fuses both rankings with RRF.
+        """
+        return self.keyword_search(
+            query, k, filter
+        ) or self.hybrid_search_with_score_by_vector(
+            query, self.embed_query(query), k, fetch_k, filter
+        )
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs
+    ) -> list:
+        """Embed `query`; return the `k` most similar documents with scores."""
+        return self.similarity_search_with_score_by_vector(
+            self.embed_query(query), k=k, **kwargs
+        )
+
+    async def asimilarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs
+    ) -> list:
+        """
+        Async search: the query is embedded with `aembed_query` and the
+        matmul runs on a worker thread (NumPy releases the GIL), so many
+        concurrent searches don't block the event loop.
+        """
+        embedding = await self.aembed_query(query)
+        return await asyncio.to_thread(
+            self.similarity_search_with_score_by_vector, embedding, k, **kwargs
+        )
+
+    def similarity_search_by_vector(
+        self, embedding, k: int = 4, **kwargs
+    ) -> list:
+        return [
+            doc
+            for doc, _ in self.similarity_search_with_score_by_vector(
+                embedding, k=k, **kwargs
+            )
+        ]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list:
+        return [
+            doc
+            for doc, _ in self.similarity_search_with_score(
+                query, k=k, **kwargs
+            )
+        ]
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts,
+        embedding: Embeddings,
+        metadatas: list = None,
+        *,
+        ids: list = None,
+        **kwargs
+    ):
+        store = cls(embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    def save(self, path: str, extra: dict = None):
+        """
+        Write the store to directory `path` as a new `vectors-<id>.npy` plus
+        `metadata.json`, which names that vectors file.
+
+        The sidecar is written last and swapped in with one `os.replace`:
+        until then it still names the previous vectors file, so a crash at
+        any point leaves the old snapshot or the new one, never a mix. Older
+        vectors files are deleted afterwards. `extra` is kept in the sidecar
+        untouched (e.g. fingerprints of the source files).
+        """
+        os.makedirs(path, exist_ok=True)
+        vectors_name = f"vectors-{uuid.uuid4().hex}.npy"
+        vectors_path = os.path.join(path, vectors_name)
+        metadata_path = os.path.join(path, self.METADATA_FILE)
+        ids = list(self.engine.ids)
+        referenced = {self._docs[i][1].get("parentId") for i in ids}
+        parents = {
+            pid: entry
+            for pid, entry in self.parents.items()
+            if pid in referenced
+        }
+        # Written a block at a time, so a store whose matrix lives on disk
+        # (memmap or spill file) is never copied into RAM whole.
+        with open(vectors_path, "wb") as f:
+            np.lib.format.write_array_header_1_0(
+                f,
+                {
+                    "descr": np.lib.format.dtype_to_descr(
+                        np.dtype(np.float32)
+                    ),
+                    "fortran_order": False,
+                    "shape": (len(ids), self.engine.matrix.shape[1]),
+                },
+            )
+            for block in self.engine.iter_live_blocks():
+                f.write(np.ascontiguousarray(block, np.float32).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(metadata_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "vectors": vectors_name,
+                "ids": ids,
+                "texts": [self._docs[i][0] for i in ids],
+                "metadatas": [self._docs[i][1] for i in ids],
+                "parents": parents,
+                "extra": extra or {},
+            }, f, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(metadata_path + ".tmp", metadata_path)
+        for name in os.listdir(path):
+            if name != vectors_name and (
+                name == self.VECTORS_FILE
+                or (name.startswith("vectors-") and name.endswith(".npy"))
+            ):
+                # A store loaded from `name` keeps its mapping (POSIX).
+                _remove_file(os.path.join(path, name))
+
+    @staticmethod
+    def read_snapshot_extra(path: str) -> dict:
+        """Return the `extra` dict of the snapshot at `path` ({} if none)."""
+        try:
+            with open(
+                os.path.join(path, MmapVectorStore.METADATA_FILE),
+                "r",
+                encoding="utf-8",
+            ) as f:
+                return json.load(f).get("extra", {})
+        except (OSError, ValueError):
+            return {}
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        embedding: Embeddings,
+        mmap: bool = True,
+        index: str = VECTOR_INDEX,
+        **index_params
+    ):
+        """
+        Open the snapshot in directory `path`, memory-mapping the vectors.
+        Nothing is indexed here: the ANN `index` (if any), BM25 and
+        metadata-filter indexes are built from the mapped matrix and the
+        sidecar by the first query that needs them.
+        """
+        with open(
+            os.path.join(path, cls.METADATA_FILE), "r", encoding="utf-8"
+        ) as f:
+            sidecar = json.load(f)
+        store = cls(embedding, index=index, **index_params)
+        matrix = np.load(
+            os.path.join(path, sidecar.get("vectors", cls.VECTORS_FILE)),
+            mmap_mode="r" if mmap else None,
+        )
+        store.engine.set_matrix(sidecar["ids"], matrix, defer_index=True)
+        store._docs = {
+            doc_id: (text, meta)
+            for doc_id, text, meta in zip(
+                sidecar["ids"], sidecar["texts"], sidecar["metadatas"]
+            )
+        }
+        store._lexical = None
+        store._filters = None
+        store.parents = {
+            pid: (text, meta)
+            for pid, (text, meta) in sidecar.get("parents", {}).items()
+        }
+        return store